@@ -13,4 +13,24 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'autopark.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from django.conf import settings  # noqa: E402
+from park.retention import start_retention_scheduler  # noqa: E402
+from park.write_buffer import ingest_buffer  # noqa: E402
+
+
+async def application(scope, receive, send):
+    # Django не обрабатывает lifespan, поэтому здесь запускаем прореживание точек по расписанию
+    # и дописываем буфер приёма точек при остановке сервера
+    if scope['type'] != 'lifespan':
+        return await django_application(scope, receive, send)
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            start_retention_scheduler()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await ingest_buffer.close(timeout=settings.INGEST_DRAIN_TIMEOUT)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
@@ -136,3 +136,90 @@ LOGIN_REDIRECT_URL = '/park/management'
 LOGOUT_REDIRECT_URL = '/'
 
 DATE_FORMAT = 'Y-m-d'
+
+# Количество процессов для расчёта отчётов по всему предприятию (1 - считать в текущем процессе,
+# больше 1 - в общем пуле процессов, запущенном при первом отчёте)
+REPORT_WORKERS = env.int('REPORT_WORKERS', default=1)
+
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://'),
+}
+
+# Кэш посчитанных отчётов и упрощённых треков: включён ли он, алиас из CACHES и время жизни записи в секундах.
+# Кэш должен быть общим для всех процессов (CACHE_URL=redis://... или pymemcache://...): с locmem
+# manage.py check не пропустит включённый кэш отчётов
+REPORT_CACHE_ENABLED = env.bool('REPORT_CACHE_ENABLED', default=False)
+REPORT_CACHE_ALIAS = 'default'
+REPORT_CACHE_TIMEOUT = env.int('REPORT_CACHE_TIMEOUT', default=60 * 60 * 24)
+
+# Фоновые задачи на отчёты: число потоков и время, после которого незавершённая задача считается потерянной
+REPORT_JOB_WORKERS = env.int('REPORT_JOB_WORKERS', default=2)
+REPORT_JOB_TIMEOUT = env.int('REPORT_JOB_TIMEOUT', default=60 * 60)
+
+# Приём точек пачками: максимальный размер пачки в одном запросе и размер пачки bulk_create
+INGEST_MAX_BATCH = env.int('INGEST_MAX_BATCH', default=100000)
+INGEST_BATCH_SIZE = env.int('INGEST_BATCH_SIZE', default=5000)
+
+# Буфер отложенной записи в ASGI-процессе: ёмкость в точках, размер и период сброса в базу, сколько раз
+# повторять пачку при сбоях соединения, время жизни и размер кэша токенов и сколько секунд ждать записи
+# буфера при остановке сервера
+INGEST_BUFFER_POINTS = env.int('INGEST_BUFFER_POINTS', default=500000)
+INGEST_FLUSH_SIZE = env.int('INGEST_FLUSH_SIZE', default=10000)
+INGEST_FLUSH_INTERVAL = env.float('INGEST_FLUSH_INTERVAL', default=1.0)
+INGEST_FLUSH_RETRIES = env.int('INGEST_FLUSH_RETRIES', default=5)
+INGEST_AUTH_TTL = env.int('INGEST_AUTH_TTL', default=60)
+INGEST_AUTH_CACHE_SIZE = env.int('INGEST_AUTH_CACHE_SIZE', default=1000)
+INGEST_DRAIN_TIMEOUT = env.float('INGEST_DRAIN_TIMEOUT', default=30.0)
+
+# Нарезка поездок по точкам: радиус стоянки в метрах, сколько минут стоять, чтобы поездка закончилась,
+# и после скольких минут без точек поездка считается прерванной
+SEGMENT_STOP_RADIUS_M = env.int('SEGMENT_STOP_RADIUS_M', default=100)
+SEGMENT_STOP_MINUTES = env.int('SEGMENT_STOP_MINUTES', default=5)
+SEGMENT_MAX_GAP_MINUTES = env.int('SEGMENT_MAX_GAP_MINUTES', default=30)
+
+# Обратное геокодирование: сервис, размер ячейки сетки (знаков после запятой, 4 - около 10 м),
+# размер LRU в памяти, число параллельных запросов к сервису и их предельная частота в секунду
+GEOCODING_PROVIDER = env.str('GEOCODING_PROVIDER', default='park.geocoding.GeocodeFarmProvider')
+GEOCODING_GRID_DIGITS = env.int('GEOCODING_GRID_DIGITS', default=4)
+GEOCODING_LRU_SIZE = env.int('GEOCODING_LRU_SIZE', default=10000)
+GEOCODING_WORKERS = env.int('GEOCODING_WORKERS', default=4)
+GEOCODING_RATE = env.float('GEOCODING_RATE', default=5.0)
+
+# Пространственные запросы по парку: период обновления индекса положений в памяти, секунд,
+# и за сколько минут до запрошенного момента искать последнюю точку машины
+FLEET_INDEX_REFRESH = env.float('FLEET_INDEX_REFRESH', default=2.0)
+FLEET_POSITION_WINDOW_MINUTES = env.int('FLEET_POSITION_WINDOW_MINUTES', default=10)
+
+# Тепловая карта: масштабы, для которых считаются тайлы, и сколько секунд клиент может кэшировать тайл
+HEATMAP_ZOOMS = env.list('HEATMAP_ZOOMS', cast=int, default=[6, 9, 12])
+HEATMAP_TILE_MAX_AGE = env.int('HEATMAP_TILE_MAX_AGE', default=300)
+# Пропуски в id точек не дальше стольких id от последней точки перепроверяются при каждом обновлении:
+# транзакция могла получить id раньше соседей, а закоммититься позже. Более старые пропуски считаются
+# откатами и забываются
+HEATMAP_GAP_WINDOW = env.int('HEATMAP_GAP_WINDOW', default=100000)
+
+# Прореживание старых точек: сколько дней хранить исходные точки (0 - не прореживать), шаг по времени
+# и допуск упрощения формы трека для оставшихся точек, размер пачки удаления и пауза между пачками, секунд,
+# через сколько секунд незавершённый запуск считается зависшим и период запуска в процессе сервера, часов
+# (0 - только командой apply_retention)
+RETENTION_RAW_DAYS = env.int('RETENTION_RAW_DAYS', default=90)
+RETENTION_INTERVAL_SECONDS = env.int('RETENTION_INTERVAL_SECONDS', default=300)
+RETENTION_TOLERANCE_M = env.float('RETENTION_TOLERANCE_M', default=20.0)
+RETENTION_DELETE_BATCH = env.int('RETENTION_DELETE_BATCH', default=1000)
+RETENTION_BATCH_PAUSE = env.float('RETENTION_BATCH_PAUSE', default=0.05)
+RETENTION_RUN_TIMEOUT = env.int('RETENTION_RUN_TIMEOUT', default=6 * 60 * 60)
+RETENTION_SCHEDULE_HOURS = env.float('RETENTION_SCHEDULE_HOURS', default=0)
+
+# Архив точек маршрута: каталог файлов, через сколько закрытых месяцев точки переносятся из базы
+# в архив (0 - не переносить) и уровень сжатия zlib
+ARCHIVE_ROOT = env.str('ARCHIVE_ROOT', default=str(BASE_DIR / 'archive'))
+ARCHIVE_AFTER_MONTHS = env.int('ARCHIVE_AFTER_MONTHS', default=12)
+ARCHIVE_COMPRESSION_LEVEL = env.int('ARCHIVE_COMPRESSION_LEVEL', default=6)
+
+# Маршруты для generate_track: класс маршрутизатора (park.routing.SyntheticRouter строит маршруты без сети,
+# park.routing.GraphHopperRouter - через GraphHopper), каталог дискового кэша маршрутов сетевых
+# маршрутизаторов (пусто - без кэша), адрес и ключ GraphHopper
+ROUTING_ROUTER = env.str('ROUTING_ROUTER', default='park.routing.SyntheticRouter')
+ROUTING_CACHE_DIR = env.str('ROUTING_CACHE_DIR', default=str(BASE_DIR / 'route_cache'))
+GRAPHHOPPER_URL = env.str('GRAPHHOPPER_URL', default='https://graphhopper.com/api/1/route')
+GRAPHHOPPER_KEY = env.str('GRAPHHOPPER_KEY', default='')
@@ -1,7 +1,9 @@
 from django.contrib import admin
 from django.contrib.gis.admin import OSMGeoAdmin
 
-from park.models import Vehicle, Manufacturer, Model, Enterprise, Driver, Manager, RoutePoint, Travel
+from park.models import Vehicle, Manufacturer, Model, Enterprise, Driver, Manager, RoutePoint, Travel, DailyMileage, ReportJob, \
+    SegmentationState, GeocodeCache, VehiclePosition, HeatmapTile, HeatmapState, RetentionState, \
+    ArchivedMonth, ArchivedTrack
 
 admin.site.register(Manufacturer)
 admin.site.register(Manager)
@@ -92,13 +94,94 @@ class ModelAdmin(admin.ModelAdmin):
 
 @admin.register(RoutePoint)
 class RoutePointAdmin(OSMGeoAdmin):
-    list_display = ('id', 'vehicle', 'point', 'datetime')
+    list_display = ('id', 'vehicle', 'point', 'datetime', 'travel', 'tier')
+    ordering = ('vehicle', 'datetime')
+    raw_id_fields = ('travel',)
     actions_on_bottom = True
     actions_on_top = False
 
 
 @admin.register(Travel)
 class TravelAdmin(admin.ModelAdmin):
-    list_display = ('id', 'vehicle', 'begin', 'end')
+    list_display = ('id', 'vehicle', 'begin', 'end', 'distance_km', 'point_count', 'max_speed_kmh')
+    readonly_fields = ('distance_km', 'point_count', 'max_speed_kmh', 'bbox', 'start_point', 'end_point',
+                       'summarized_at')
+    actions_on_bottom = True
+    actions_on_top = False
+
+
+@admin.register(DailyMileage)
+class DailyMileageAdmin(admin.ModelAdmin):
+    list_display = ('id', 'vehicle', 'day', 'km', 'point_count', 'first_ts', 'last_ts')
+    actions_on_bottom = True
+    actions_on_top = False
+
+
+@admin.register(ReportJob)
+class ReportJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'scope', 'owner_id', 'report_type', 'begin', 'end', 'status', 'created_by', 'created_at')
+    list_filter = ('status', 'scope')
+    actions_on_bottom = True
+    actions_on_top = False
+
+
+@admin.register(SegmentationState)
+class SegmentationStateAdmin(admin.ModelAdmin):
+    list_display = ('vehicle', 'last_ts', 'anchor_ts', 'travel', 'updated_at')
+    raw_id_fields = ('travel',)
+    actions_on_bottom = True
+    actions_on_top = False
+
+
+@admin.register(GeocodeCache)
+class GeocodeCacheAdmin(admin.ModelAdmin):
+    list_display = ('id', 'provider', 'digits', 'lat_key', 'lon_key', 'address', 'created_at')
+    list_filter = ('provider',)
+    actions_on_bottom = True
+    actions_on_top = False
+
+
+@admin.register(VehiclePosition)
+class VehiclePositionAdmin(OSMGeoAdmin):
+    list_display = ('vehicle', 'point', 'datetime', 'speed_kmh', 'updated_at')
+    actions_on_bottom = True
+    actions_on_top = False
+
+
+@admin.register(HeatmapTile)
+class HeatmapTileAdmin(admin.ModelAdmin):
+    list_display = ('id', 'enterprise', 'day', 'zoom', 'x', 'y', 'total')
+    list_filter = ('zoom',)
+    exclude = ('counts',)
+    actions_on_bottom = True
+    actions_on_top = False
+
+
+@admin.register(HeatmapState)
+class HeatmapStateAdmin(admin.ModelAdmin):
+    list_display = ('id', 'last_point_id', 'late_point_count', 'updated_at')
+    actions_on_bottom = True
+    actions_on_top = False
+
+
+@admin.register(RetentionState)
+class RetentionStateAdmin(admin.ModelAdmin):
+    list_display = ('id', 'downsampled_before', 'archived_before', 'running_since', 'updated_at')
+    actions_on_bottom = True
+    actions_on_top = False
+
+
+@admin.register(ArchivedMonth)
+class ArchivedMonthAdmin(admin.ModelAdmin):
+    list_display = ('id', 'enterprise', 'month', 'archive_path', 'point_count', 'size_bytes', 'archived_at',
+                    'purged_at')
+    actions_on_bottom = True
+    actions_on_top = False
+
+
+@admin.register(ArchivedTrack)
+class ArchivedTrackAdmin(admin.ModelAdmin):
+    list_display = ('id', 'archive', 'vehicle', 'first_ts', 'last_ts', 'point_count')
+    raw_id_fields = ('archive',)
     actions_on_bottom = True
     actions_on_top = False
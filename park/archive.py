@@ -0,0 +1,324 @@
+import os
+import struct
+import time
+import zlib
+from collections import defaultdict, namedtuple
+from datetime import date, datetime, timedelta, timezone
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Min
+from django.utils import timezone as django_timezone
+
+from autopark import settings
+from .models import ArchivedMonth, ArchivedTrack, DailyMileage, RetentionState, RoutePoint, Travel
+from .report_cache import caches_by_window
+from .retention import claim_run
+from .rollups import get_day_bounds, get_utc_day
+from .summaries import summarize_travels
+
+# Файл архива: заголовок, сжатые блоки (машина за сутки UTC) и в конце индекс блоков.
+# Читается через numpy.memmap: индекс - прямо из отображения файла, распаковываются только нужные блоки
+ARCHIVE_MAGIC = b'APKA'
+ARCHIVE_VERSION = 1
+ARCHIVE_SUFFIX = '.apka'
+# magic, версия, зарезервировано, количество блоков, смещение индекса
+ARCHIVE_HEADER = struct.Struct('<4sHHQQ')
+INDEX_DTYPE = np.dtype([
+    ('vehicle_id', '<i8'), ('first_ts', '<i8'), ('last_ts', '<i8'),
+    ('count', '<i8'), ('offset', '<i8'), ('size', '<i8'),
+])
+# Координаты хранятся целыми в 1e-7 градуса (около 1 см), время - в микросекундах Unix
+COORDINATE_SCALE = 10 ** 7
+
+# Колонки точек: время в микросекундах, широты и долготы в градусах, id поездок (0 - без поездки), уровни
+ArchivedPoints = namedtuple('ArchivedPoints', ['timestamps', 'lats', 'lons', 'travel_ids', 'tiers'])
+
+
+def empty_points():
+    return ArchivedPoints(np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0), np.zeros(0, dtype=np.int64),
+                          np.zeros(0, dtype=np.int8))
+
+
+def concatenate_points(parts):
+    parts = [part for part in parts if part.timestamps.size]
+    if not parts:
+        return empty_points()
+    return ArchivedPoints(*(np.concatenate(column) for column in zip(*parts)))
+
+
+def shuffle(values):
+    """Разности соседних значений, байты которых сгруппированы по разрядам: так zlib сжимает их в разы лучше."""
+    deltas = np.diff(np.asarray(values, dtype=np.int64), prepend=0).astype('<i8')
+    return deltas.view(np.uint8).reshape(-1, 8).T.tobytes()
+
+
+def unshuffle(buffer, count):
+    deltas = np.frombuffer(buffer, dtype=np.uint8, count=8 * count).reshape(8, count).T.copy().view('<i8').ravel()
+    return np.cumsum(deltas)
+
+
+def encode_block(points, level):
+    lats = np.round(np.asarray(points.lats) * COORDINATE_SCALE).astype(np.int64)
+    lons = np.round(np.asarray(points.lons) * COORDINATE_SCALE).astype(np.int64)
+    return zlib.compress(b''.join((
+        shuffle(points.timestamps), shuffle(lats), shuffle(lons), shuffle(points.travel_ids),
+        np.asarray(points.tiers, dtype=np.int8).tobytes(),
+    )), level)
+
+
+def decode_block(buffer, count):
+    data = zlib.decompress(buffer)
+    size = 8 * count
+    return ArchivedPoints(
+        unshuffle(data[:size], count),
+        unshuffle(data[size:2 * size], count) / COORDINATE_SCALE,
+        unshuffle(data[2 * size:3 * size], count) / COORDINATE_SCALE,
+        unshuffle(data[3 * size:4 * size], count),
+        np.frombuffer(data, dtype=np.int8, count=count, offset=4 * size),
+    )
+
+
+class ArchiveWriter:
+    """Пишет файл архива во временный файл и переименовывает его в path при close()."""
+
+    def __init__(self, path, level=6):
+        self.path = path
+        self.level = level
+        self.tmp_path = path + '.tmp'
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.file = open(self.tmp_path, 'wb')
+        self.file.write(b'\0' * ARCHIVE_HEADER.size)
+        self.index = []
+
+    def write_block(self, vehicle_id, points):
+        data = encode_block(points, self.level)
+        self.index.append((vehicle_id, points.timestamps[0], points.timestamps[-1], points.timestamps.size,
+                           self.file.tell(), len(data)))
+        self.file.write(data)
+
+    def close(self):
+        index = np.array(sorted(self.index), dtype=INDEX_DTYPE)
+        index_offset = self.file.tell()
+        self.file.write(index.tobytes())
+        self.file.seek(0)
+        self.file.write(ARCHIVE_HEADER.pack(ARCHIVE_MAGIC, ARCHIVE_VERSION, 0, len(index), index_offset))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        os.replace(self.tmp_path, self.path)
+        return os.path.getsize(self.path)
+
+    def abort(self):
+        self.file.close()
+        os.remove(self.tmp_path)
+
+
+class ArchiveFile:
+    """Файл архива, отображённый в память. Чтение трека распаковывает только блоки, пересекающие интервал."""
+
+    def __init__(self, path):
+        self.data = np.memmap(path, dtype=np.uint8, mode='r')
+        magic, version, _, block_count, index_offset = ARCHIVE_HEADER.unpack_from(self.data)
+        if magic != ARCHIVE_MAGIC or version != ARCHIVE_VERSION:
+            raise ValueError('Not an Autopark route point archive: {0}'.format(path))
+        self.index = np.frombuffer(self.data, dtype=INDEX_DTYPE, count=block_count, offset=index_offset)
+
+    def read(self, vehicle_id, begin_ts=None, end_ts=None):
+        """Точки машины с begin_ts < время < end_ts (микросекунды Unix, None - без границы)."""
+        index = self.index
+        mask = index['vehicle_id'] == vehicle_id
+        if begin_ts is not None:
+            mask &= index['last_ts'] > begin_ts
+        if end_ts is not None:
+            mask &= index['first_ts'] < end_ts
+        parts = []
+        for block in index[mask]:
+            offset, size = int(block['offset']), int(block['size'])
+            points = decode_block(self.data[offset:offset + size], int(block['count']))
+            keep = np.ones(points.timestamps.size, dtype=bool)
+            if begin_ts is not None:
+                keep &= points.timestamps > begin_ts
+            if end_ts is not None:
+                keep &= points.timestamps < end_ts
+            parts.append(ArchivedPoints(*(column[keep] for column in points)))
+        return concatenate_points(parts)
+
+
+def to_timestamp(dt):
+    return int(round(dt.timestamp() * 1000000))
+
+
+def from_timestamp(timestamp):
+    return datetime(1970, 1, 1, tzinfo=timezone.utc) + timedelta(microseconds=int(timestamp))
+
+
+def get_month_bounds(month):
+    begin = datetime(month.year, month.month, 1, tzinfo=timezone.utc)
+    end = datetime(month.year + month.month // 12, month.month % 12 + 1, 1, tzinfo=timezone.utc)
+    return begin, end
+
+
+def get_archive_path(archived_month):
+    return os.path.join(settings.ARCHIVE_ROOT, archived_month.archive_path)
+
+
+def fetch_vehicle_month(vehicle_id, begin, end, chunk_size):
+    rows = RoutePoint.objects.filter(vehicle_id=vehicle_id, datetime__gte=begin, datetime__lt=end)\
+        .order_by('datetime').values_list('datetime', 'point', 'travel_id', 'tier').iterator(chunk_size=chunk_size)
+    timestamps, lats, lons, travel_ids, tiers = [], [], [], [], []
+    for point_dt, point, travel_id, tier in rows:
+        timestamps.append(to_timestamp(point_dt))
+        lats.append(point.y)
+        lons.append(point.x)
+        travel_ids.append(travel_id or 0)
+        tiers.append(tier)
+    return ArchivedPoints(np.asarray(timestamps, dtype=np.int64), np.asarray(lats, dtype=np.float64),
+                          np.asarray(lons, dtype=np.float64), np.asarray(travel_ids, dtype=np.int64),
+                          np.asarray(tiers, dtype=np.int8))
+
+
+def get_month_days(month, enterprise_id=None):
+    """
+    Сутки с точками за месяц по суточным пробегам: {предприятие: {машина: [сутки по порядку]}}.
+    Суточные пробеги ведутся на всех путях записи точек, поэтому таблицу точек перебирать не нужно.
+    """
+    begin, end = get_month_bounds(month)
+    mileages = DailyMileage.objects.filter(day__gte=begin.date(), day__lt=end.date())
+    if enterprise_id is not None:
+        mileages = mileages.filter(vehicle__enterprise_id=enterprise_id)
+    days = defaultdict(lambda: defaultdict(list))
+    for enterprise, vehicle_id, day in mileages.order_by('vehicle_id', 'day')\
+            .values_list('vehicle__enterprise_id', 'vehicle_id', 'day'):
+        days[enterprise][vehicle_id].append(day)
+    return days
+
+
+def archive_enterprise_month(enterprise_id, month, level=None, chunk_size=5000, vehicle_days=None):
+    """
+    Переносит точки машин предприятия за месяц в файл архива и регистрирует его в ArchivedMonth.
+    Читаются только машины и сутки, по которым есть суточные пробеги (vehicle_days, по умолчанию
+    из get_month_days). Точки из RoutePoint здесь не удаляются (см. purge_archived_month).
+    Возвращает ArchivedMonth или None, если точек за месяц нет.
+    """
+    level = settings.ARCHIVE_COMPRESSION_LEVEL if level is None else level
+    if vehicle_days is None:
+        vehicle_days = get_month_days(month, enterprise_id).get(enterprise_id, {})
+    archive_path = os.path.join(str(enterprise_id), '{0:%Y-%m}{1}'.format(month, ARCHIVE_SUFFIX))
+    archived_month = ArchivedMonth(enterprise_id=enterprise_id, month=month, archive_path=archive_path)
+    writer = ArchiveWriter(get_archive_path(archived_month), level)
+    tracks = []
+    try:
+        for vehicle_id, days in sorted(vehicle_days.items()):
+            points = fetch_vehicle_month(vehicle_id, get_day_bounds(days[0])[0], get_day_bounds(days[-1])[1],
+                                         chunk_size)
+            if not points.timestamps.size:
+                continue
+            # Блок - сутки UTC: чтение короткого интервала распакует не больше пары блоков
+            days = points.timestamps // (24 * 60 * 60 * 1000000)
+            bounds = np.concatenate(([0], np.flatnonzero(days[1:] != days[:-1]) + 1, [days.size]))
+            for start, stop in zip(bounds[:-1], bounds[1:]):
+                writer.write_block(vehicle_id, ArchivedPoints(*(column[start:stop] for column in points)))
+            tracks.append(ArchivedTrack(vehicle_id=vehicle_id, first_ts=from_timestamp(points.timestamps[0]),
+                                        last_ts=from_timestamp(points.timestamps[-1]),
+                                        point_count=points.timestamps.size))
+    except BaseException:
+        writer.abort()
+        raise
+    if not tracks:
+        writer.abort()
+        return None
+
+    archived_month.size_bytes = writer.close()
+    archived_month.point_count = sum(track.point_count for track in tracks)
+    with transaction.atomic():
+        ArchivedMonth.objects.filter(enterprise_id=enterprise_id, month=month).delete()
+        archived_month.save()
+        for track in tracks:
+            track.archive = archived_month
+        ArchivedTrack.objects.bulk_create(tracks, batch_size=1000)
+    return archived_month
+
+
+def purge_archived_month(archived_month, pause=0):
+    """Удаляет из RoutePoint точки заархивированного месяца по одной машине за сутки на запрос."""
+    deleted = 0
+    for track in archived_month.tracks.all():
+        day = get_utc_day(track.first_ts)
+        while day <= get_utc_day(track.last_ts):
+            begin = datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+            deleted += RoutePoint.objects.filter(vehicle_id=track.vehicle_id, datetime__gte=begin,
+                                                 datetime__lt=begin + timedelta(days=1)).delete_without_signals()
+            if pause:
+                time.sleep(pause)
+            day += timedelta(days=1)
+    ArchivedMonth.objects.filter(pk=archived_month.pk).update(purged_at=django_timezone.now())
+    return deleted
+
+
+def run_archive(after_months=None, max_months=None, level=None, pause=None, stdout=None):
+    """
+    Переносит в архив закрытые месяцы старше after_months, по порядку, начиная с самых старых.
+    Месяц сначала записывается в файлы по всем предприятиям, затем сдвигается RetentionState.archived_before
+    (с этого момента чтение идёт из файлов) и только потом точки удаляются из RoutePoint.
+    Возвращает (заархивировано месяцев, удалено точек) или None, если уже выполняется другая работа с историей.
+    """
+    after_months = settings.ARCHIVE_AFTER_MONTHS if after_months is None else after_months
+    pause = settings.RETENTION_BATCH_PAUSE if pause is None else pause
+    if not after_months:
+        return 0, 0
+
+    state = claim_run()
+    if state is None:
+        return None
+    months, deleted = 0, 0
+    try:
+        if state.archived_before is not None:
+            # Удаление, прерванное в прошлый раз: эти точки уже читаются из архива
+            for archived_month in ArchivedMonth.objects.filter(purged_at__isnull=True,
+                                                                month__lt=get_utc_day(state.archived_before)):
+                deleted += purge_archived_month(archived_month, pause)
+
+        today = get_utc_day(django_timezone.now())
+        last_month = date(today.year, today.month, 1)
+        for _ in range(after_months):
+            last_month = (last_month - timedelta(days=1)).replace(day=1)
+        if state.archived_before is not None:
+            month = get_utc_day(state.archived_before).replace(day=1)
+        else:
+            first_day = DailyMileage.objects.aggregate(first_day=Min('day'))['first_day']
+            if first_day is None:
+                return 0, 0
+            month = first_day.replace(day=1)
+
+        while month < last_month and (max_months is None or months < max_months):
+            begin, end = get_month_bounds(month)
+            # Сводки поездок должны быть посчитаны, пока точки ещё в таблице
+            summarize_travels(Travel.objects.filter(begin__lt=end, end__gte=begin, summarized_at__isnull=True))
+            month_days = get_month_days(month)
+            # Машины без предприятия не архивируются: архив лежит в каталоге предприятия
+            month_days.pop(None, None)
+            archived = [archived_month for archived_month in (
+                archive_enterprise_month(enterprise_id, month, level, vehicle_days=vehicle_days)
+                for enterprise_id, vehicle_days in sorted(month_days.items())
+            ) if archived_month is not None]
+            RetentionState.objects.filter(pk=state.pk).update(archived_before=end)
+
+            month_deleted = sum(purge_archived_month(archived_month, pause) for archived_month in archived)
+            # Кэши сбрасываются только по машинам и суткам, точки которых ушли в архив
+            for archived_month in archived:
+                for vehicle_id, days in month_days[archived_month.enterprise_id].items():
+                    for day in days:
+                        day_begin, _ = get_day_bounds(day)
+                        for cache in caches_by_window:
+                            cache.invalidate_vehicle(vehicle_id, archived_month.enterprise_id, day_begin, day_begin)
+            if stdout is not None:
+                stdout.write('{0:%Y-%m}: {1} route points in {2} files, {3} bytes'.format(
+                    month, sum(item.point_count for item in archived), len(archived),
+                    sum(item.size_bytes for item in archived)))
+            months += 1
+            deleted += month_deleted
+            month = end.date()
+    finally:
+        RetentionState.objects.filter(pk=state.pk).update(running_since=None)
+    return months, deleted
@@ -0,0 +1,21 @@
+from django.core.checks import Error, Tags, register
+
+from autopark import settings
+
+LOCAL_CACHE_BACKENDS = ('django.core.cache.backends.locmem.LocMemCache',)
+
+
+@register(Tags.caches)
+def check_report_cache(app_configs, **kwargs):
+    """Кэш отчётов сбрасывается счётчиками в кэше, поэтому кэш в памяти отдельного процесса не годится."""
+    if not settings.REPORT_CACHE_ENABLED:
+        return []
+    backend = settings.CACHES.get(settings.REPORT_CACHE_ALIAS, {}).get('BACKEND')
+    if backend in LOCAL_CACHE_BACKENDS:
+        return [Error(
+            'REPORT_CACHE_ENABLED requires a cache shared by all processes, "%s" uses %s.'
+            % (settings.REPORT_CACHE_ALIAS, backend),
+            hint='Set CACHE_URL to a Redis or Memcached server or set REPORT_CACHE_ENABLED=False.',
+            id='park.E001',
+        )]
+    return []
@@ -0,0 +1,105 @@
+import numpy as np
+from geographiclib.geodesic import Geodesic
+
+# Средний радиус Земли (IUGG) и параметры эллипсоида WGS-84, км
+EARTH_RADIUS_KM = 6371.0088
+WGS84_A = 6378.137
+WGS84_F = 1 / 298.257223563
+WGS84_B = WGS84_A * (1 - WGS84_F)
+
+HAVERSINE = 'haversine'
+VINCENTY = 'vincenty'
+METHODS = (HAVERSINE, VINCENTY)
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Расстояние по большому кругу в км, все аргументы - массивы градусов."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(a, dtype=np.float64)) for a in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def vincenty(lat1, lon1, lat2, lon2, max_iter=200, tol=1e-12):
+    """
+    Расстояние по эллипсоиду WGS-84 в км (обратная задача Винсенти), посчитанное сразу для всего массива.
+    Пары, для которых итерации не сошлись (почти антиподы), досчитываются через geographiclib.
+    """
+    lat1, lon1, lat2, lon2 = np.broadcast_arrays(*(np.asarray(a, dtype=np.float64) for a in (lat1, lon1, lat2, lon2)))
+    f = WGS84_F
+    L = np.radians(lon2 - lon1)
+    U1 = np.arctan((1 - f) * np.tan(np.radians(lat1)))
+    U2 = np.arctan((1 - f) * np.tan(np.radians(lat2)))
+    sin_u1, cos_u1 = np.sin(U1), np.cos(U1)
+    sin_u2, cos_u2 = np.sin(U2), np.cos(U2)
+
+    lam = L.copy()
+    sin_sigma = np.zeros_like(L)
+    cos_sigma = np.ones_like(L)
+    sigma = np.zeros_like(L)
+    cos_sq_alpha = np.ones_like(L)
+    cos_2sigma_m = np.zeros_like(L)
+    active = np.ones(L.shape, dtype=bool)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for _ in range(max_iter):
+            if not active.any():
+                break
+            sin_lam, cos_lam = np.sin(lam[active]), np.cos(lam[active])
+            su1, cu1, su2, cu2 = sin_u1[active], cos_u1[active], sin_u2[active], cos_u2[active]
+
+            s_sigma = np.hypot(cu2 * sin_lam, cu1 * su2 - su1 * cu2 * cos_lam)
+            c_sigma = su1 * su2 + cu1 * cu2 * cos_lam
+            sig = np.arctan2(s_sigma, c_sigma)
+            sin_alpha = np.where(s_sigma == 0, 0.0, cu1 * cu2 * sin_lam / s_sigma)
+            c_sq_alpha = 1 - sin_alpha ** 2
+            c_2sigma_m = np.where(c_sq_alpha == 0, 0.0, c_sigma - 2 * su1 * su2 / c_sq_alpha)
+            C = f / 16 * c_sq_alpha * (4 + f * (4 - 3 * c_sq_alpha))
+            lam_new = L[active] + (1 - C) * f * sin_alpha * (
+                sig + C * s_sigma * (c_2sigma_m + C * c_sigma * (-1 + 2 * c_2sigma_m ** 2)))
+
+            sin_sigma[active] = s_sigma
+            cos_sigma[active] = c_sigma
+            sigma[active] = sig
+            cos_sq_alpha[active] = c_sq_alpha
+            cos_2sigma_m[active] = c_2sigma_m
+
+            converged = np.abs(lam_new - lam[active]) <= tol
+            lam[active] = lam_new
+            indices = np.flatnonzero(active)
+            active[indices[converged]] = False
+
+        u_sq = cos_sq_alpha * (WGS84_A ** 2 - WGS84_B ** 2) / WGS84_B ** 2
+        A = 1 + u_sq / 16384 * (4096 + u_sq * (-768 + u_sq * (320 - 175 * u_sq)))
+        B = u_sq / 1024 * (256 + u_sq * (-128 + u_sq * (74 - 47 * u_sq)))
+        delta_sigma = B * sin_sigma * (cos_2sigma_m + B / 4 * (
+            cos_sigma * (-1 + 2 * cos_2sigma_m ** 2) -
+            B / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)))
+        distances = WGS84_B * A * (sigma - delta_sigma)
+
+    for index in zip(*np.nonzero(active)):
+        distances[index] = Geodesic.WGS84.Inverse(lat1[index], lon1[index], lat2[index], lon2[index])['s12'] / 1000
+    return distances
+
+
+def segment_distances(lats, lons, method=VINCENTY):
+    """Длины отрезков между соседними точками трека, км. Для n точек возвращает n-1 значений."""
+    if method not in METHODS:
+        raise ValueError('Unknown distance method: {0}'.format(method))
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    if lats.size < 2:
+        return np.zeros(0)
+    kernel = haversine if method == HAVERSINE else vincenty
+    return kernel(lats[:-1], lons[:-1], lats[1:], lons[1:])
+
+
+def cumulative_distances(lats, lons, method=VINCENTY):
+    """Пройденный путь от первой точки до каждой точки трека, км. Первый элемент всегда 0."""
+    lats = np.asarray(lats, dtype=np.float64)
+    if lats.size == 0:
+        return np.zeros(0)
+    return np.concatenate(([0.0], np.cumsum(segment_distances(lats, lons, method))))
+
+
+def total_distance(lats, lons, method=VINCENTY):
+    return float(segment_distances(lats, lons, method).sum())
@@ -0,0 +1,105 @@
+import struct
+from collections import namedtuple
+
+import numpy as np
+
+# Трек в виде колонок: широты и долготы в градусах, время - секунды Unix (UTC)
+TrackColumns = namedtuple('TrackColumns', ['lats', 'lons', 'timestamps', 'timezone'])
+
+POLYLINE_PRECISION = 5
+
+BINARY_MAGIC = b'APRK'
+BINARY_VERSION = 1
+# magic, версия, зарезервировано, количество точек; 16 байт, чтобы колонки float64/int64 были выровнены
+BINARY_HEADER = struct.Struct('<4sHHQ')
+
+
+def get_track_columns(route_points, timezone_name='UTC', chunk_size=2000):
+    lats, lons, timestamps = [], [], []
+    rows = route_points.order_by('datetime').values_list('point', 'datetime').iterator(chunk_size=chunk_size)
+    for point, point_dt in rows:
+        lats.append(point.y)
+        lons.append(point.x)
+        timestamps.append(int(point_dt.timestamp()))
+    return TrackColumns(np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64),
+                        np.asarray(timestamps, dtype=np.int64), timezone_name)
+
+
+def encode_polyline_values(values):
+    """Кодирует целые дельты в формат Google Encoded Polyline, все значения за один проход NumPy."""
+    values = np.asarray(values, dtype=np.int64)
+    if values.size == 0:
+        return ''
+    zigzag = ((values << 1) ^ (values >> 63)).astype(np.uint64)
+    # Каждое значение - до 7 пятибитных групп (35 бит хватает для int32 дельт координат)
+    shifts = np.arange(7, dtype=np.uint64) * np.uint64(5)
+    chunks = (zigzag[:, None] >> shifts) & np.uint64(31)
+    bit_length = np.floor(np.log2(np.maximum(zigzag, 1).astype(np.float64))).astype(np.int64) + 1
+    chunk_count = np.maximum((bit_length + 4) // 5, 1)
+
+    positions = np.arange(7)
+    present = positions[None, :] < chunk_count[:, None]
+    continued = positions[None, :] < (chunk_count - 1)[:, None]
+    chars = (chunks + np.where(continued, 0x20, 0).astype(np.uint64) + np.uint64(63)).astype(np.uint8)
+    return chars[present].tobytes().decode('ascii')
+
+
+def encode_polyline(lats, lons, precision=POLYLINE_PRECISION):
+    factor = 10 ** precision
+    lats = np.round(np.asarray(lats, dtype=np.float64) * factor).astype(np.int64)
+    lons = np.round(np.asarray(lons, dtype=np.float64) * factor).astype(np.int64)
+    deltas = np.empty(lats.size * 2, dtype=np.int64)
+    deltas[0::2] = np.diff(lats, prepend=0)
+    deltas[1::2] = np.diff(lons, prepend=0)
+    return encode_polyline_values(deltas)
+
+
+def decode_polyline(polyline, precision=POLYLINE_PRECISION):
+    values = []
+    current = shift = 0
+    for char in polyline.encode('ascii'):
+        chunk = char - 63
+        current |= (chunk & 0x1f) << shift
+        shift += 5
+        if chunk < 0x20:
+            values.append(~(current >> 1) if current & 1 else current >> 1)
+            current = shift = 0
+    coordinates = np.cumsum(np.asarray(values, dtype=np.int64).reshape(-1, 2), axis=0) / 10 ** precision
+    return coordinates[:, 0], coordinates[:, 1]
+
+
+def delta_encode(values):
+    """Первое значение как есть, дальше разности с предыдущим."""
+    values = np.asarray(values, dtype=np.int64)
+    return np.diff(values, prepend=0).tolist() if values.size else []
+
+
+def to_polyline_data(track, precision=POLYLINE_PRECISION):
+    return {
+        'polyline': encode_polyline(track.lats, track.lons, precision),
+        'precision': precision,
+        'timestamps': delta_encode(track.timestamps),
+        'timezone': track.timezone,
+    }
+
+
+def to_binary(track):
+    """Заголовок и три колонки подряд: lon float64[n], lat float64[n], ts int64[n], little-endian."""
+    count = track.lats.size
+    return b''.join((
+        BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, 0, count),
+        track.lons.astype('<f8').tobytes(),
+        track.lats.astype('<f8').tobytes(),
+        track.timestamps.astype('<i8').tobytes(),
+    ))
+
+
+def from_binary(buffer):
+    magic, version, _, count = BINARY_HEADER.unpack_from(buffer)
+    if magic != BINARY_MAGIC or version != BINARY_VERSION:
+        raise ValueError('Not an Autopark track buffer')
+    offset = BINARY_HEADER.size
+    lons = np.frombuffer(buffer, dtype='<f8', count=count, offset=offset)
+    lats = np.frombuffer(buffer, dtype='<f8', count=count, offset=offset + 8 * count)
+    timestamps = np.frombuffer(buffer, dtype='<i8', count=count, offset=offset + 16 * count)
+    return lons, lats, timestamps
@@ -0,0 +1,201 @@
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from django.contrib.gis.geos import Polygon
+from django.db.models import Max, Q
+from django.utils.timezone import now
+
+from autopark import settings
+from .distance import haversine
+from .models import Enterprise, RoutePoint, VehiclePosition
+
+
+class FleetPositions:
+    """
+    Положения набора машин в колонках numpy. Все выборки - векторные проходы по массивам:
+    на 100 тыс. машин это единицы миллисекунд, отдельное дерево индексов не нужно.
+    """
+
+    def __init__(self, vehicle_ids, enterprise_ids, lats, lons, timestamps, speeds):
+        self.vehicle_ids = np.asarray(vehicle_ids, dtype=np.int64)
+        self.enterprise_ids = np.asarray(enterprise_ids, dtype=np.int64)
+        self.lats = np.asarray(lats, dtype=np.float64)
+        self.lons = np.asarray(lons, dtype=np.float64)
+        self.timestamps = np.asarray(timestamps, dtype=np.float64)
+        self.speeds = np.asarray(speeds, dtype=np.float64)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Из строк (vehicle_id, enterprise_id, point, datetime, speed_kmh)."""
+        rows = list(rows)
+        return cls(
+            [row[0] for row in rows],
+            [row[1] if row[1] is not None else 0 for row in rows],
+            [row[2].y for row in rows],
+            [row[2].x for row in rows],
+            [row[3].timestamp() for row in rows],
+            [row[4] if row[4] is not None else np.nan for row in rows],
+        )
+
+    def __len__(self):
+        return len(self.vehicle_ids)
+
+    def columns(self):
+        return self.vehicle_ids, self.enterprise_ids, self.lats, self.lons, self.timestamps, self.speeds
+
+    def get_scope(self, enterprise_ids=None):
+        if enterprise_ids is None:
+            return np.ones(len(self), dtype=bool)
+        return np.isin(self.enterprise_ids, np.fromiter(enterprise_ids, dtype=np.int64))
+
+    def within_bbox(self, min_lon, min_lat, max_lon, max_lat, enterprise_ids=None):
+        mask = self.get_scope(enterprise_ids)
+        mask &= (self.lons >= min_lon) & (self.lons <= max_lon) & (self.lats >= min_lat) & (self.lats <= max_lat)
+        return np.flatnonzero(mask)
+
+    def within_polygon(self, rings, enterprise_ids=None):
+        """Машины внутри многоугольника: rings - внешнее кольцо и дырки, каждое - массив (lon, lat)."""
+        exterior = np.asarray(rings[0], dtype=np.float64)
+        candidates = self.within_bbox(exterior[:, 0].min(), exterior[:, 1].min(),
+                                      exterior[:, 0].max(), exterior[:, 1].max(), enterprise_ids)
+        lons, lats = self.lons[candidates], self.lats[candidates]
+        inside = np.zeros(len(candidates), dtype=bool)
+        # Правило чётности: дырка меняет результат так же, как ещё одно пересечение границы
+        for ring in rings:
+            inside ^= points_in_ring(lons, lats, np.asarray(ring, dtype=np.float64))
+        return candidates[inside]
+
+    def nearest(self, lat, lon, k, enterprise_ids=None):
+        """k ближайших машин к точке, возвращает (индексы, расстояния в км) по возрастанию расстояния."""
+        scope = np.flatnonzero(self.get_scope(enterprise_ids))
+        if not len(scope) or k <= 0:
+            return scope[:0], np.zeros(0)
+        distances = haversine(lat, lon, self.lats[scope], self.lons[scope])
+        if k < len(scope):
+            nearest = np.argpartition(distances, k)[:k]
+        else:
+            nearest = np.arange(len(scope))
+        nearest = nearest[np.argsort(distances[nearest])]
+        return scope[nearest], distances[nearest]
+
+    def to_data(self, indices, distances=None, timezones=None):
+        timezones = timezones or {}
+        utc = timezone.utc
+        speeds = np.round(self.speeds[indices], 1)
+        columns = (self.vehicle_ids[indices].tolist(), self.enterprise_ids[indices].tolist(),
+                   self.lons[indices].tolist(), self.lats[indices].tolist(), self.timestamps[indices].tolist(),
+                   np.where(np.isnan(speeds), None, speeds).tolist())
+        data = [
+            {
+                'vehicle': vehicle_id,
+                'enterprise': enterprise_id,
+                'lon': lon,
+                'lat': lat,
+                'datetime': str(datetime.fromtimestamp(timestamp, timezones.get(enterprise_id, utc))),
+                'speed_kmh': speed,
+            }
+            for vehicle_id, enterprise_id, lon, lat, timestamp, speed in zip(*columns)
+        ]
+        if distances is not None:
+            for row, distance in zip(data, np.round(distances, 3).tolist()):
+                row['distance_km'] = distance
+        return data
+
+
+def points_in_ring(lons, lats, ring):
+    """Проверка «точка в кольце» лучом вдоль параллели, сразу для всех точек и всех рёбер кольца."""
+    if len(ring) and (ring[0] != ring[-1]).any():
+        ring = np.vstack([ring, ring[:1]])
+    x1, y1 = ring[:-1, 0][:, None], ring[:-1, 1][:, None]
+    x2, y2 = ring[1:, 0][:, None], ring[1:, 1][:, None]
+    crosses = (y1 > lats) != (y2 > lats)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_cross = x1 + (lats - y1) * (x2 - x1) / (y2 - y1)
+    return ((crosses & (lons < x_cross)).sum(axis=0) % 2).astype(bool)
+
+
+class FleetIndex:
+    """
+    Последние положения всех машин в памяти процесса. Раз в refresh_interval секунд дочитывает из базы
+    только положения, изменившиеся с прошлого обновления (индекс по updated_at).
+    """
+
+    def __init__(self, refresh_interval):
+        self.refresh_interval = refresh_interval
+        self.positions = None
+        self.index_of = {}
+        self.loaded_at = None
+        self.checked_at = 0
+        self.lock = threading.Lock()
+
+    def get_positions(self):
+        with self.lock:
+            if time.monotonic() - self.checked_at >= self.refresh_interval:
+                self.refresh()
+            return self.positions
+
+    def refresh(self):
+        loaded_at = now()
+        rows = VehiclePosition.objects.all()
+        if self.loaded_at is not None:
+            # Запас на транзакции, закоммиченные с опозданием относительно своего updated_at
+            rows = rows.filter(updated_at__gte=self.loaded_at - timedelta(seconds=self.refresh_interval))
+        rows = list(rows.values_list('vehicle_id', 'vehicle__enterprise_id', 'point', 'datetime', 'speed_kmh'))
+
+        if self.positions is None or any(row[0] not in self.index_of for row in rows):
+            if self.positions is not None:
+                # Появились новые машины - проще перечитать всё
+                rows = VehiclePosition.objects.values_list(
+                    'vehicle_id', 'vehicle__enterprise_id', 'point', 'datetime', 'speed_kmh')
+            self.positions = FleetPositions.from_rows(rows)
+            self.index_of = {vehicle_id: index for index, vehicle_id in enumerate(self.positions.vehicle_ids.tolist())}
+        elif rows:
+            # Новые массивы вместо правки на месте: запросы, уже получившие positions, дочитают старую версию
+            changed = FleetPositions.from_rows(rows)
+            indices = np.fromiter((self.index_of[row[0]] for row in rows), dtype=np.int64, count=len(rows))
+            positions = FleetPositions(*(np.copy(column) for column in self.positions.columns()))
+            for column, values in zip(positions.columns(), changed.columns()):
+                column[indices] = values
+            self.positions = positions
+        self.loaded_at = loaded_at
+        self.checked_at = time.monotonic()
+
+
+def get_positions_at(at, enterprise_ids=None, bbox=None, window=None, chunk_size=500):
+    """
+    Положения машин на момент at: последняя точка каждой машины не раньше at - window.
+    Для прошлых моментов времени читается RoutePoint: если задан bbox (min_lon, min_lat, max_lon, max_lat),
+    кандидаты сначала отбираются по пространственному индексу, потом для них ищутся последние точки
+    по индексу (vehicle, datetime).
+    """
+    window = window or timedelta(minutes=settings.FLEET_POSITION_WINDOW_MINUTES)
+    route_points = RoutePoint.objects.filter(datetime__gt=at - window, datetime__lte=at)
+    if enterprise_ids is not None:
+        route_points = route_points.filter(vehicle__enterprise_id__in=enterprise_ids)
+    if bbox is not None:
+        candidates = route_points.filter(point__within=Polygon.from_bbox(bbox)).values('vehicle_id').distinct()
+        route_points = route_points.filter(vehicle_id__in=candidates)
+    latest = list(route_points.values_list('vehicle_id').annotate(max_dt=Max('datetime')))
+
+    rows = []
+    for start in range(0, len(latest), chunk_size):
+        condition = Q()
+        for vehicle_id, max_dt in latest[start:start + chunk_size]:
+            condition |= Q(vehicle_id=vehicle_id, datetime=max_dt)
+        rows.extend(RoutePoint.objects.filter(condition).values_list(
+            'vehicle_id', 'vehicle__enterprise_id', 'point', 'datetime'))
+    # Несколько точек машины с одним временем дают одну строку
+    rows = {row[0]: (*row, None) for row in rows}
+    return FleetPositions.from_rows(rows.values())
+
+
+def get_enterprise_timezones():
+    from .serializers import get_tzinfo
+
+    return {enterprise_id: get_tzinfo(timezone_name)
+            for enterprise_id, timezone_name in Enterprise.objects.values_list('id', 'timezone')}
+
+
+fleet_index = FleetIndex(settings.FLEET_INDEX_REFRESH)
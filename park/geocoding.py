@@ -0,0 +1,178 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import geocoder
+from django.utils.module_loading import import_string
+
+from autopark import settings
+from .models import GeocodeCache
+
+
+class GeocodingProvider:
+    """Сервис обратного геокодирования: адрес по координатам, None - если адрес не найден."""
+    name = None
+
+    def reverse(self, lat, lon):
+        raise NotImplementedError
+
+
+class GeocodeFarmProvider(GeocodingProvider):
+    name = 'geocodefarm'
+
+    def reverse(self, lat, lon):
+        result = geocoder.geocodefarm([lat, lon], method='reverse')
+        return result.address if result.ok else None
+
+
+class OfflineProvider(GeocodingProvider):
+    """Заглушка без сети для тестов и разработки: адресом служат сами координаты."""
+    name = 'offline'
+
+    def __init__(self):
+        self.calls = 0
+
+    def reverse(self, lat, lon):
+        self.calls += 1
+        return '{0:.5f}, {1:.5f}'.format(lat, lon)
+
+
+class LRUCache:
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.items:
+                return None
+            self.items.move_to_end(key)
+            return self.items[key]
+
+    def set(self, key, value):
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+
+class RateLimiter:
+    """Не больше rate вызовов в секунду на все потоки процесса."""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self.next_call = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_call - now
+            self.next_call = max(now, self.next_call) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class Geocoder:
+    """
+    Обратное геокодирование с кэшем: координаты округляются до сетки в digits знаков после запятой,
+    адреса ячеек хранятся в GeocodeCache, перед таблицей - LRU в памяти процесса.
+    Промахи запрашиваются у сервиса параллельно с ограничением частоты запросов.
+    """
+
+    def __init__(self, provider, digits, lru_size, workers, rate):
+        self.provider = provider
+        self.digits = digits
+        self.workers = workers
+        self.lru = LRUCache(lru_size)
+        self.rate_limiter = RateLimiter(rate)
+
+    def get_cell(self, lat, lon):
+        scale = 10 ** self.digits
+        return round(lat * scale), round(lon * scale)
+
+    def reverse(self, lat, lon):
+        return self.reverse_many([(lat, lon)])[(lat, lon)]
+
+    def reverse_many(self, coordinates):
+        """Адреса для набора пар (lat, lon), словарь {(lat, lon): адрес или None}."""
+        cells = {coordinate: self.get_cell(*coordinate) for coordinate in coordinates}
+        addresses = {}
+        missing = set()
+        for cell in set(cells.values()):
+            address = self.lru.get(cell)
+            if address is None:
+                missing.add(cell)
+            else:
+                addresses[cell] = address
+
+        if missing:
+            found = self.load(missing)
+            addresses.update(found)
+            missing -= found.keys()
+        if missing:
+            addresses.update(self.fetch(missing))
+        return {coordinate: addresses.get(cell) or None for coordinate, cell in cells.items()}
+
+    def load(self, cells):
+        # Одним запросом: широты и долготы ячеек по отдельности, лишние пары отсеиваются ниже
+        rows = GeocodeCache.objects.filter(
+            provider=self.provider.name, digits=self.digits,
+            lat_key__in={lat_key for lat_key, _ in cells}, lon_key__in={lon_key for _, lon_key in cells}
+        ).values_list('lat_key', 'lon_key', 'address')
+        found = {}
+        for lat_key, lon_key, address in rows:
+            if (lat_key, lon_key) in cells:
+                found[(lat_key, lon_key)] = address
+                self.lru.set((lat_key, lon_key), address)
+        return found
+
+    def fetch(self, cells):
+        scale = 10 ** self.digits
+
+        def reverse_cell(cell):
+            self.rate_limiter.wait()
+            try:
+                return cell, self.provider.reverse(cell[0] / scale, cell[1] / scale) or ''
+            except Exception:
+                # Сбой сервиса не кэшируется: адрес запросят снова при следующем обращении
+                return cell, None
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='geocoding') as executor:
+            results = dict(executor.map(reverse_cell, cells))
+
+        # Пустой адрес («не найдено») кэшируется тоже, чтобы не спрашивать сервис про ту же ячейку снова
+        resolved = {cell: address for cell, address in results.items() if address is not None}
+        GeocodeCache.objects.bulk_create([
+            GeocodeCache(provider=self.provider.name, digits=self.digits, lat_key=lat_key, lon_key=lon_key,
+                         address=address)
+            for (lat_key, lon_key), address in resolved.items()
+        ], ignore_conflicts=True)
+        for cell, address in resolved.items():
+            self.lru.set(cell, address)
+        return resolved
+
+
+_geocoder = None
+_geocoder_lock = threading.Lock()
+
+
+def get_geocoder():
+    global _geocoder
+    with _geocoder_lock:
+        if _geocoder is None:
+            _geocoder = Geocoder(
+                import_string(settings.GEOCODING_PROVIDER)(),
+                digits=settings.GEOCODING_GRID_DIGITS,
+                lru_size=settings.GEOCODING_LRU_SIZE,
+                workers=settings.GEOCODING_WORKERS,
+                rate=settings.GEOCODING_RATE,
+            )
+        return _geocoder
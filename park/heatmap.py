@@ -0,0 +1,168 @@
+import zlib
+from collections import defaultdict
+from datetime import date
+
+import numpy as np
+from django.db import transaction
+from django.db.models import F, Max
+
+from autopark import settings
+from .models import HeatmapState, HeatmapTile, RoutePoint, Vehicle
+
+# Сторона сетки внутри тайла: 64 ячейки по 4 пикселя на тайле 256x256
+BINS = 64
+MAX_LAT = 85.05112878
+
+
+def encode_counts(counts):
+    return zlib.compress(np.asarray(counts, dtype='<u4').tobytes())
+
+
+def decode_counts(data):
+    return np.frombuffer(zlib.decompress(bytes(data)), dtype='<u4').astype(np.int64)
+
+
+def get_bins(lats, lons, zoom, bins=BINS):
+    """Номера ячеек в глобальной сетке масштаба zoom (по bins ячеек на сторону тайла), проекция Web Mercator."""
+    size = (2 ** zoom) * bins
+    lats = np.radians(np.clip(lats, -MAX_LAT, MAX_LAT))
+    xs = ((np.asarray(lons) + 180) / 360 * size).astype(np.int64)
+    ys = ((1 - np.arcsinh(np.tan(lats)) / np.pi) / 2 * size).astype(np.int64)
+    return np.clip(xs, 0, size - 1), np.clip(ys, 0, size - 1)
+
+
+def bin_points(enterprise_ids, days, lats, lons, zoom, bins=BINS):
+    """
+    Раскладывает пачку точек по тайлам одного масштаба. Возвращает словарь
+    {(enterprise_id, day_ordinal, zoom, x, y): плоский массив bins * bins счётчиков}.
+    """
+    xs, ys = get_bins(lats, lons, zoom, bins)
+    tiles = np.stack([enterprise_ids, days, xs // bins, ys // bins], axis=1)
+    cells = (ys % bins) * bins + xs % bins
+    keys, inverse = np.unique(tiles, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+
+    # Одной сортировкой группируем точки по тайлам, потом счётчики каждой группы через bincount
+    order = np.argsort(inverse, kind='stable')
+    bounds = np.searchsorted(inverse[order], np.arange(len(keys) + 1))
+    result = {}
+    for index, (enterprise_id, day, x, y) in enumerate(keys.tolist()):
+        group = cells[order[bounds[index]:bounds[index + 1]]]
+        result[(enterprise_id, day, zoom, x, y)] = np.bincount(group, minlength=bins * bins)
+    return result
+
+
+def merge_tiles(accumulated, tiles):
+    for key, counts in tiles.items():
+        if key in accumulated:
+            accumulated[key] += counts
+        else:
+            accumulated[key] = counts
+
+
+def save_tiles(accumulated):
+    """Прибавляет накопленные счётчики к сохранённым тайлам, по одному запросу на предприятие, день и масштаб."""
+    groups = defaultdict(dict)
+    for (enterprise_id, day, zoom, x, y), counts in accumulated.items():
+        groups[(enterprise_id, day, zoom)][(x, y)] = counts
+
+    created, updated = [], []
+    for (enterprise_id, day, zoom), counts_by_tile in groups.items():
+        day = date.fromordinal(day)
+        existing = HeatmapTile.objects.select_for_update().filter(
+            enterprise_id=enterprise_id, day=day, zoom=zoom,
+            x__in={x for x, _ in counts_by_tile}, y__in={y for _, y in counts_by_tile}
+        )
+        for tile in existing:
+            counts = counts_by_tile.pop((tile.x, tile.y), None)
+            if counts is None:
+                continue
+            counts = decode_counts(tile.counts) + counts
+            tile.counts, tile.total = encode_counts(counts), int(counts.sum())
+            updated.append(tile)
+        for (x, y), counts in counts_by_tile.items():
+            created.append(HeatmapTile(enterprise_id=enterprise_id, day=day, zoom=zoom, x=x, y=y,
+                                       counts=encode_counts(counts), total=int(counts.sum())))
+    HeatmapTile.objects.bulk_create(created, batch_size=500)
+    HeatmapTile.objects.bulk_update(updated, ['counts', 'total'], batch_size=500)
+    return len(created) + len(updated)
+
+
+def bin_rows(accumulated, rows, enterprise_of, zooms):
+    """Раскладывает строки (id, vehicle_id, datetime, point) по тайлам в accumulated, возвращает их число."""
+    rows = [row for row in rows if enterprise_of.get(row[1]) is not None]
+    if not rows:
+        return 0
+    enterprise_ids = np.fromiter((enterprise_of[row[1]] for row in rows), dtype=np.int64, count=len(rows))
+    days = np.fromiter((row[2].date().toordinal() for row in rows), dtype=np.int64, count=len(rows))
+    lats = np.fromiter((row[3].y for row in rows), dtype=np.float64, count=len(rows))
+    lons = np.fromiter((row[3].x for row in rows), dtype=np.float64, count=len(rows))
+    for zoom in zooms:
+        merge_tiles(accumulated, bin_points(enterprise_ids, days, lats, lons, zoom))
+    return len(rows)
+
+
+def update_heatmaps(zooms=None, chunk_size=50000, flush_points=1000000, gap_window=None):
+    """
+    Дописывает в тайлы точки, появившиеся с прошлого запуска (id больше сохранённого в HeatmapState).
+    Точки читаются диапазонами id, счётчики копятся в памяти и сохраняются вместе с новым id
+    каждые flush_points точек, так что прерванный запуск продолжится с последнего сохранения.
+    id, которых не оказалось в таблице в последних gap_window id, запоминаются и перепроверяются
+    следующими запусками: точки поздно закоммиченных транзакций не теряются. Возвращает число
+    обработанных точек.
+    """
+    zooms = zooms or settings.HEATMAP_ZOOMS
+    gap_window = settings.HEATMAP_GAP_WINDOW if gap_window is None else gap_window
+    state = HeatmapState.objects.first() or HeatmapState.objects.create()
+    max_id = RoutePoint.objects.aggregate(max_id=Max('id'))['max_id'] or 0
+    enterprise_of = dict(Vehicle.objects.values_list('id', 'enterprise_id'))
+    fields = ('id', 'vehicle_id', 'datetime', 'point')
+
+    accumulated = {}
+    gaps = {point_id for point_id in state.gap_ids if point_id > max_id - gap_window}
+    late_rows = list(RoutePoint.objects.filter(id__in=gaps).values_list(*fields)) if gaps else []
+    gaps -= {row[0] for row in late_rows}
+    late = bin_rows(accumulated, late_rows, enterprise_of, zooms)
+    processed, pending = late, late
+
+    last_id = state.last_point_id
+    while last_id < max_id:
+        upper_id = min(last_id + chunk_size, max_id)
+        rows = list(RoutePoint.objects.filter(id__gt=last_id, id__lte=upper_id).values_list(*fields))
+        gaps.update(set(range(max(last_id, max_id - gap_window) + 1, upper_id + 1)) - {row[0] for row in rows})
+        count = bin_rows(accumulated, rows, enterprise_of, zooms)
+        processed += count
+        pending += count
+        last_id = upper_id
+        if pending >= flush_points or last_id >= max_id:
+            save_progress(state, accumulated, last_id, gaps, late)
+            accumulated, pending, late = {}, 0, 0
+    if accumulated or gaps != set(state.gap_ids):
+        # Новых точек нет, но дописались опоздавшие или забылись старые пропуски
+        save_progress(state, accumulated, last_id, gaps, late)
+    return processed
+
+
+def save_progress(state, accumulated, last_id, gaps, late):
+    with transaction.atomic():
+        save_tiles(accumulated)
+        HeatmapState.objects.filter(pk=state.pk).update(
+            last_point_id=last_id, gap_ids=sorted(gaps), late_point_count=F('late_point_count') + late)
+    state.gap_ids = sorted(gaps)
+
+
+def get_tile_counts(enterprise_id, zoom, x, y, begin_day, end_day):
+    """Сумма суточных тайлов за [begin_day, end_day]: (плоский массив счётчиков или None, всего точек)."""
+    tiles = HeatmapTile.objects.filter(
+        enterprise_id=enterprise_id, zoom=zoom, x=x, y=y, day__gte=begin_day, day__lte=end_day
+    ).values_list('counts', flat=True)
+    counts = None
+    for data in tiles:
+        counts = decode_counts(data) if counts is None else counts + decode_counts(data)
+    return counts, int(counts.sum()) if counts is not None else 0
+
+
+def get_watermark():
+    """Версия тайлов для ETag: меняется и с новыми точками, и с дописанными опоздавшими."""
+    state = HeatmapState.objects.values_list('last_point_id', 'late_point_count').first() or (0, 0)
+    return '{0}.{1}'.format(*state)
@@ -0,0 +1,207 @@
+import datetime
+
+import numpy as np
+from django.contrib.gis.geos import Point
+from django.db import transaction
+from django.utils import timezone
+
+from autopark import settings
+from .models import RoutePoint, Vehicle, Manager
+from .report_cache import caches_by_window
+from .positions import update_positions
+from .rollups import refresh_daily_mileage
+from .travels import assign_travels
+
+COLUMNS = ('vehicle_id', 'lon', 'lat', 'ts')
+# Насколько время точки может опережать часы сервера
+MAX_CLOCK_SKEW = datetime.timedelta(minutes=5)
+
+
+class IngestError(ValueError):
+    pass
+
+
+def get_columns(data):
+    """
+    Приводит тело запроса к колонкам. Принимаются словарь колонок {"vehicle_id": [...], ...},
+    список объектов [{"vehicle_id": ..., "lon": ..., "lat": ..., "ts": ...}, ...]
+    или список строк [[vehicle_id, lon, lat, ts], ...]; то же самое можно обернуть в {"points": ...}.
+    """
+    if isinstance(data, dict) and 'points' in data:
+        data = data['points']
+    if isinstance(data, dict):
+        missing = [name for name in COLUMNS if name not in data]
+        if missing:
+            raise IngestError('Missing columns: {0}'.format(', '.join(missing)))
+        columns = {name: list(data[name]) for name in COLUMNS}
+        if len({len(values) for values in columns.values()}) > 1:
+            raise IngestError('Columns have different lengths')
+        return columns
+    if isinstance(data, list):
+        if data and isinstance(data[0], dict):
+            return {name: [row.get(name) if isinstance(row, dict) else None for row in data] for name in COLUMNS}
+        rows = [row if isinstance(row, (list, tuple)) and len(row) == len(COLUMNS) else (None,) * len(COLUMNS)
+                for row in data]
+        return dict(zip(COLUMNS, map(list, zip(*rows)))) if rows else {name: [] for name in COLUMNS}
+    raise IngestError('Expected a list of points or a dict of columns')
+
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def to_float_array(values):
+    try:
+        return np.asarray(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        return np.array([to_float(value) for value in values], dtype=np.float64)
+
+
+def to_timestamp(value):
+    """Unix-время в секундах из числа или строки ISO 8601. Время без зоны считается UTC."""
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            pass
+        try:
+            dt = datetime.datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+        except ValueError:
+            return np.nan
+        if timezone.is_naive(dt):
+            dt = dt.replace(tzinfo=datetime.timezone.utc)
+        return dt.timestamp()
+    return to_float(value)
+
+
+def to_timestamp_array(values):
+    try:
+        return np.asarray(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        return np.array([to_timestamp(value) for value in values], dtype=np.float64)
+
+
+def get_allowed_vehicle_ids(user, vehicle_ids):
+    """Одним запросом: какие из машин пачки существуют и доступны пользователю."""
+    vehicles = Vehicle.objects.filter(pk__in=vehicle_ids)
+    if user is not None and not user.is_superuser:
+        manager = Manager.objects.filter(user=user).first()
+        if manager is None:
+            return np.zeros(0, dtype=np.int64)
+        vehicles = vehicles.filter(enterprise__in=manager.enterprise.all())
+    return np.fromiter(vehicles.values_list('id', flat=True), dtype=np.int64)
+
+
+def get_token_vehicle_ids(key):
+    """Пользователь по ключу токена DRF и все доступные ему машины, None - если токен неизвестен."""
+    from rest_framework.authtoken.models import Token
+
+    token = Token.objects.select_related('user').filter(key=key, user__is_active=True).first()
+    if token is None:
+        return None
+    vehicles = Vehicle.objects.all()
+    if not token.user.is_superuser:
+        manager = Manager.objects.filter(user=token.user).first()
+        if manager is None:
+            return None
+        vehicles = vehicles.filter(enterprise__in=manager.enterprise.all())
+    return token.user_id, np.fromiter(vehicles.values_list('id', flat=True), dtype=np.int64)
+
+
+def validate_route_points(columns, user=None, allowed_vehicle_ids=None):
+    """
+    Проверяет пачку целиком на массивах. Возвращает (vehicle_ids, lons, lats, timestamps) принятых строк,
+    их номера в исходной пачке и список ошибок [{"row": номер, "error": причина}] по отклонённым.
+    Если доступные машины уже известны (allowed_vehicle_ids), база не запрашивается.
+    """
+    vehicle_ids = to_float_array(columns['vehicle_id'])
+    lons = to_float_array(columns['lon'])
+    lats = to_float_array(columns['lat'])
+    timestamps = to_timestamp_array(columns['ts'])
+    max_timestamp = (timezone.now() + MAX_CLOCK_SKEW).timestamp()
+
+    with np.errstate(invalid='ignore'):
+        bad_vehicle = ~np.isfinite(vehicle_ids) | (vehicle_ids <= 0) | (vehicle_ids != np.floor(vehicle_ids))
+        checks = [
+            (bad_vehicle, 'invalid vehicle_id'),
+            (~np.isfinite(lons) | (np.abs(lons) > 180), 'invalid lon'),
+            (~np.isfinite(lats) | (np.abs(lats) > 90), 'invalid lat'),
+            (~np.isfinite(timestamps) | (timestamps < 0), 'invalid ts'),
+            (timestamps > max_timestamp, 'ts is in the future'),
+        ]
+    vehicle_ids = np.where(bad_vehicle, 0, vehicle_ids).astype(np.int64)
+
+    allowed = allowed_vehicle_ids
+    if allowed is None:
+        candidates = np.unique(vehicle_ids[~bad_vehicle])
+        allowed = get_allowed_vehicle_ids(user, candidates.tolist()) if candidates.size else candidates
+    checks.append((~np.isin(vehicle_ids, allowed), 'unknown vehicle or access denied'))
+
+    reasons = np.select([mask for mask, _ in checks], [reason for _, reason in checks], default='')
+    accepted = np.flatnonzero(reasons == '')
+    errors = [{'row': int(row), 'error': str(reasons[row])} for row in np.flatnonzero(reasons != '')]
+    return (vehicle_ids[accepted], lons[accepted], lats[accepted], timestamps[accepted]), accepted, errors
+
+
+def build_route_points(vehicle_ids, lons, lats, timestamps):
+    utc = datetime.timezone.utc
+    fromtimestamp = datetime.datetime.fromtimestamp
+    return [
+        RoutePoint(vehicle_id=vehicle_id, point=Point(lon, lat), datetime=fromtimestamp(ts, utc))
+        for vehicle_id, lon, lat, ts in zip(vehicle_ids.tolist(), lons.tolist(), lats.tolist(), timestamps.tolist())
+    ]
+
+
+def store_route_points(route_points, batch_size=None):
+    """
+    Общий путь массовой записи точек: привязка к поездкам, bulk_create в одной транзакции вместе
+    с пересчётом суточных пробегов и текущих положений машин, сброс кэшей отчётов и треков.
+    Сигналы post_save при bulk_create не срабатывают, поэтому всё, что они делают для одиночной точки,
+    для пачки делается здесь.
+    """
+    if not route_points:
+        return 0
+    batch_size = batch_size or settings.INGEST_BATCH_SIZE
+    assign_travels(route_points)
+    with transaction.atomic():
+        RoutePoint.objects.bulk_create(route_points, batch_size=batch_size)
+        refresh_daily_mileage(route_points)
+        update_positions(route_points)
+    invalidate_caches(route_points)
+    return len(route_points)
+
+
+def invalidate_caches(route_points):
+    windows = {}
+    for route_point in route_points:
+        begin, end = windows.get(route_point.vehicle_id, (route_point.datetime, route_point.datetime))
+        windows[route_point.vehicle_id] = (min(begin, route_point.datetime), max(end, route_point.datetime))
+    enterprise_ids = dict(Vehicle.objects.filter(pk__in=windows.keys()).values_list('id', 'enterprise_id'))
+    for vehicle_id, (begin, end) in windows.items():
+        for cache in caches_by_window:
+            cache.invalidate_vehicle(vehicle_id, enterprise_ids.get(vehicle_id), begin, end)
+
+
+def get_batch_columns(data):
+    columns = get_columns(data)
+    total = len(columns['vehicle_id'])
+    if total > settings.INGEST_MAX_BATCH:
+        raise IngestError('Batch is too large: {0} points, at most {1} allowed'.format(
+            total, settings.INGEST_MAX_BATCH))
+    return columns, total
+
+
+def ingest_route_points(data, user=None):
+    """Разбирает, проверяет и сохраняет пачку точек. Отклонённые строки не мешают записи остальных."""
+    columns, total = get_batch_columns(data)
+    values, accepted, errors = validate_route_points(columns, user)
+    created = store_route_points(build_route_points(*values))
+    return {
+        'received': total,
+        'created': created,
+        'rejected': len(errors),
+        'errors': errors,
+    }
@@ -0,0 +1,128 @@
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.db import IntegrityError, connections, transaction
+from django.utils import timezone
+
+from autopark import settings
+from .models import ReportJob
+from .report_cache import report_cache
+from .reports import ReportCancelled, TrackReport
+
+# Локальный пул потоков вместо внешнего брокера: задачи живут в процессе веб-сервера,
+# а состояние и результат хранятся в ReportJob, поэтому опрашивать их можно из любого процесса
+_executor = None
+_executor_lock = threading.Lock()
+_futures = {}
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.REPORT_JOB_WORKERS, thread_name_prefix='report-job')
+        return _executor
+
+
+def submit_report_job(scope, owner_id, report_type, begin, end, user=None):
+    """
+    Ставит отчёт в очередь. Если такой же отчёт уже считается, возвращает существующую задачу.
+    Возвращает пару (задача, создана ли новая).
+    """
+    key = report_cache.make_key(scope, owner_id, report_type, begin, end)
+    expire_lost_jobs(active_key=key)
+    try:
+        with transaction.atomic():
+            job = ReportJob.objects.create(
+                key=key, active_key=key, scope=scope, owner_id=owner_id, report_type=report_type,
+                begin=report_cache.normalize(begin), end=report_cache.normalize(end),
+                created_by=user if user is not None and user.is_authenticated else None
+            )
+    except IntegrityError:
+        job = ReportJob.objects.filter(active_key=key).first()
+        if job is None:
+            # Одинаковая задача успела завершиться между insert и select
+            return submit_report_job(scope, owner_id, report_type, begin, end, user)
+        return job, False
+
+    # Поток пула не должен искать задачу раньше, чем её строка станет видна другим соединениям
+    transaction.on_commit(lambda: start_report_job(job.id))
+    return job, True
+
+
+def start_report_job(job_id):
+    future = get_executor().submit(run_report_job, job_id)
+    _futures[job_id] = future
+    future.add_done_callback(lambda _: _futures.pop(job_id, None))
+
+
+def expire_lost_jobs(**filters):
+    """
+    Помечает ошибкой активные задачи старше REPORT_JOB_TIMEOUT: они пережили перезапуск процесса,
+    иначе навсегда заблокировали бы свой ключ и висели бы в очереди у опрашивающих. Возвращает их число.
+    """
+    deadline = timezone.now() - timedelta(seconds=settings.REPORT_JOB_TIMEOUT)
+    return ReportJob.objects.filter(active_key__isnull=False, created_at__lt=deadline, **filters).update(
+        status=ReportJob.FAILED, active_key=None, finished_at=timezone.now(), error='Job was lost or timed out.'
+    )
+
+
+def refresh_report_job(job):
+    """Состояние задачи для опроса: потерянная задача помечается ошибкой, а не остаётся в очереди навсегда."""
+    if job.status in ReportJob.ACTIVE_STATUSES and expire_lost_jobs(pk=job.pk):
+        job.refresh_from_db()
+    return job
+
+
+def cancel_report_job(job):
+    cancelled = ReportJob.objects.filter(pk=job.pk, status__in=ReportJob.ACTIVE_STATUSES).update(
+        status=ReportJob.CANCELLED, active_key=None, finished_at=timezone.now()
+    )
+    future = _futures.get(job.pk)
+    if future is not None:
+        future.cancel()
+    return bool(cancelled)
+
+
+def run_report_job(job_id):
+    try:
+        started = ReportJob.objects.filter(pk=job_id, status=ReportJob.PENDING).update(
+            status=ReportJob.RUNNING, started_at=timezone.now()
+        )
+        if not started:
+            return
+        job = ReportJob.objects.get(pk=job_id)
+        try:
+            result = compute_report(job)
+        except ReportCancelled:
+            # Задачу отменили или признали потерянной, её строка уже закрыта
+            return
+        except Exception:
+            finish_report_job(job_id, ReportJob.FAILED, error=traceback.format_exc())
+        else:
+            finish_report_job(job_id, ReportJob.DONE, result=result)
+    finally:
+        connections.close_all()
+
+
+def finish_report_job(job_id, status, result=None, error=''):
+    # Отменённая во время расчёта задача остаётся отменённой, результат отбрасывается
+    ReportJob.objects.filter(pk=job_id, status=ReportJob.RUNNING).update(
+        status=status, result=result, error=error, active_key=None, finished_at=timezone.now()
+    )
+
+
+def is_job_stopped(job_id):
+    return not ReportJob.objects.filter(pk=job_id, status=ReportJob.RUNNING).exists()
+
+
+def compute_report(job):
+    track_report = TrackReport(report_type=job.report_type, begin_report_dt=job.begin, finish_report_dt=job.end,
+                               is_cancelled=lambda: is_job_stopped(job.id))
+    if job.scope == ReportJob.ENTERPRISE:
+        compute = lambda: track_report.generate_full_enterprise_report(job.owner_id)
+    else:
+        compute = lambda: track_report.generate_report(job.owner_id)
+    return report_cache.get_or_set(job.scope, job.owner_id, job.report_type, job.begin, job.end, compute)
@@ -0,0 +1,23 @@
+from django.core.management import BaseCommand, CommandError
+
+from park.retention import run_retention
+
+
+class Command(BaseCommand):
+    help = 'Downsamples route points older than the raw retention period, oldest days first.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--raw-days', type=int, help='Keep full resolution for this many days (default: RETENTION_RAW_DAYS).')
+        parser.add_argument('--interval', type=int, help='Keep at least one point per this many seconds.')
+        parser.add_argument('--tolerance', type=float, help='Track shape tolerance of kept points, meters.')
+        parser.add_argument('--batch', type=int, help='Route points deleted per statement.')
+        parser.add_argument('--pause', type=float, help='Seconds to sleep between delete batches.')
+        parser.add_argument('--max-days', type=int, help='Stop after downsampling this many days.')
+
+    def handle(self, *args, **options):
+        result = run_retention(raw_days=options['raw_days'], interval=options['interval'],
+                               tolerance=options['tolerance'], batch_size=options['batch'], pause=options['pause'],
+                               max_days=options['max_days'], stdout=self.stdout)
+        if result is None:
+            raise CommandError('Retention is already running in another process.')
+        self.stdout.write(self.style.SUCCESS('Downsampled %d days, %d route points deleted.' % result))
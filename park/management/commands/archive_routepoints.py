@@ -0,0 +1,21 @@
+from django.core.management import BaseCommand, CommandError
+
+from park.archive import run_archive
+
+
+class Command(BaseCommand):
+    help = 'Moves route points of closed months into compressed per enterprise-month archive files.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--after-months', type=int,
+                            help='Archive months older than this many closed months (default: ARCHIVE_AFTER_MONTHS).')
+        parser.add_argument('--max-months', type=int, help='Stop after archiving this many months.')
+        parser.add_argument('--level', type=int, help='zlib compression level (default: ARCHIVE_COMPRESSION_LEVEL).')
+        parser.add_argument('--pause', type=float, help='Seconds to sleep between delete statements.')
+
+    def handle(self, *args, **options):
+        result = run_archive(after_months=options['after_months'], max_months=options['max_months'],
+                             level=options['level'], pause=options['pause'], stdout=self.stdout)
+        if result is None:
+            raise CommandError('Retention or archiving is already running in another process.')
+        self.stdout.write(self.style.SUCCESS('Archived %d months, %d route points deleted.' % result))
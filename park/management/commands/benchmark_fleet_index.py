@@ -0,0 +1,55 @@
+import time
+
+import numpy as np
+from django.core.management import BaseCommand
+
+from park.fleet_index import FleetPositions
+
+
+class Command(BaseCommand):
+    help = ('Measures bbox, polygon and k-nearest queries of the in-memory fleet index on synthetic fleets, '
+            'including conversion of the result to response data.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--vehicles', type=int, nargs='+', default=[10000, 100000], help='Fleet sizes.')
+        parser.add_argument('--enterprises', type=int, default=50, help='Number of synthetic enterprises.')
+        parser.add_argument('--repeat', type=int, default=50, help='Runs of every query.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        self.stdout.write('{0:>8} {1:<10} {2:>8} {3:>9} {4:>9}'.format('vehicles', 'query', 'found', 'p50, ms',
+                                                                        'p95, ms'))
+        for count in options['vehicles']:
+            positions = self.make_fleet(rng, count, options['enterprises'])
+            scope = set(range(1, options['enterprises'] // 2 + 1))
+            # Прямоугольник и многоугольник размером с крупный город, точка - в центре парка
+            polygon = [[(37.3 + 0.5 * np.cos(angle), 55.75 + 0.3 * np.sin(angle))
+                        for angle in np.linspace(0, 2 * np.pi, 24)]]
+            queries = {
+                'bbox': lambda: positions.to_data(positions.within_bbox(37.3, 55.6, 37.9, 55.9, scope)),
+                'polygon': lambda: positions.to_data(positions.within_polygon(polygon, scope)),
+                'nearest': lambda: positions.to_data(*positions.nearest(55.75, 37.6, 10, scope)),
+            }
+            for name, query in queries.items():
+                timings = []
+                for _ in range(options['repeat']):
+                    started = time.perf_counter()
+                    found = len(query())
+                    timings.append((time.perf_counter() - started) * 1000)
+                self.stdout.write('{0:>8} {1:<10} {2:>8} {3:>9.2f} {4:>9.2f}'.format(
+                    count, name, found, np.percentile(timings, 50), np.percentile(timings, 95)))
+
+    @staticmethod
+    def make_fleet(rng, count, enterprises):
+        # Машины вокруг нескольких городов, чтобы плотность была похожа на настоящую
+        centers = np.array([[55.75, 37.6], [59.93, 30.3], [56.84, 60.6], [57.82, 28.33], [54.98, 82.9]])
+        city = rng.integers(len(centers), size=count)
+        return FleetPositions(
+            np.arange(1, count + 1),
+            rng.integers(1, enterprises + 1, size=count),
+            centers[city, 0] + rng.normal(0, 0.3, count),
+            centers[city, 1] + rng.normal(0, 0.5, count),
+            1.68e9 + rng.uniform(0, 600, count),
+            rng.uniform(0, 90, count),
+        )
@@ -0,0 +1,153 @@
+import time
+
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+
+from park.models import RoutePoint
+
+BENCHMARK_TABLE = 'park_routepoint_benchmark'
+INDEX_NAME = 'park_rp_bench_vehicle_dt'
+
+
+class Command(BaseCommand):
+    help = ('Builds a synthetic route point table on MySQL and compares query plans and latency of typical '
+            'track queries with and without the (vehicle_id, datetime) index. Prints the plan unless '
+            '--execute is given.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--points', type=int, default=50_000_000, help='Number of synthetic points.')
+        parser.add_argument('--vehicles', type=int, default=5000, help='Number of synthetic vehicles.')
+        parser.add_argument('--repeat', type=int, default=20, help='Runs of every query, the median is reported.')
+        parser.add_argument('--batch', type=int, default=1_000_000, help='Rows inserted by one statement.')
+        parser.add_argument('--keep', action='store_true', help='Keep the synthetic table after the benchmark.')
+        parser.add_argument('--reuse', action='store_true', help='Reuse the table left by a previous --keep run.')
+        parser.add_argument('--execute', action='store_true',
+                            help='Create the table and run the benchmark instead of printing the plan. MySQL only.')
+
+    def handle(self, *args, **options):
+        if not options['execute']:
+            self.print_plan(options)
+            self.stdout.write(self.style.WARNING('Dry run, nothing executed. Add --execute to run the benchmark.'))
+            return
+        if connection.vendor != 'mysql':
+            raise CommandError('The benchmark targets the MySQL GIS backend, run without --execute to print the plan.')
+
+        if not options['reuse']:
+            self.create_table(options['points'], options['vehicles'], options['batch'])
+        queries = self.get_queries(options['vehicles'])
+        try:
+            if INDEX_NAME in self.get_secondary_indexes():
+                self.execute('ALTER TABLE `{0}` DROP INDEX `{1}`'.format(BENCHMARK_TABLE, INDEX_NAME))
+            self.stdout.write(self.style.MIGRATE_HEADING('Without the composite index'))
+            before = self.run_queries(queries, options['repeat'])
+
+            started = time.perf_counter()
+            self.execute('ALTER TABLE `{0}` ADD INDEX `{1}` (`vehicle_id`, `datetime`)'.format(
+                BENCHMARK_TABLE, INDEX_NAME))
+            self.stdout.write('Index built in %.1f s' % (time.perf_counter() - started))
+
+            self.stdout.write(self.style.MIGRATE_HEADING('With the composite index'))
+            after = self.run_queries(queries, options['repeat'])
+        finally:
+            if not options['keep']:
+                self.execute('DROP TABLE IF EXISTS `{0}`'.format(BENCHMARK_TABLE))
+
+        self.stdout.write(self.style.MIGRATE_HEADING('Median latency, ms'))
+        for name in queries:
+            self.stdout.write('{0:<16} {1:>10.2f} {2:>10.2f} {3:>8.1f}x'.format(
+                name, before[name], after[name], before[name] / max(after[name], 1e-6)))
+
+    def print_plan(self, options):
+        table = BENCHMARK_TABLE
+        statements = []
+        if not options['reuse']:
+            statements += [
+                'DROP TABLE IF EXISTS `{0}`'.format(table),
+                'CREATE TABLE `{0}` LIKE `{1}`'.format(table, RoutePoint._meta.db_table),
+                '-- drop the secondary indexes of `{0}`, then insert {1} points in {2} INSERT ... SELECT '
+                'statements'.format(table, options['points'], -(-options['points'] // options['batch'])),
+                'ANALYZE TABLE `{0}`'.format(table),
+            ]
+        statements.append('ALTER TABLE `{0}` ADD INDEX `{1}` (`vehicle_id`, `datetime`)'.format(table, INDEX_NAME))
+        for name, (sql, params) in self.get_queries(options['vehicles']).items():
+            statements.append('-- {0}, {1} runs before and after the index: {2}'.format(
+                name, options['repeat'], sql % tuple(repr(param) for param in params)))
+        if not options['keep']:
+            statements.append('DROP TABLE IF EXISTS `{0}`'.format(table))
+        for statement in statements:
+            self.stdout.write(statement if statement.startswith('--') else statement + ';')
+
+    @staticmethod
+    def execute(sql, params=None):
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall() if cursor.description else None
+
+    def create_table(self, points, vehicles, batch):
+        # Таблица повторяет структуру park_routepoint, но без внешнего ключа,
+        # чтобы не заводить десятки тысяч машин ради синтетических данных
+        self.execute('DROP TABLE IF EXISTS `{0}`'.format(BENCHMARK_TABLE))
+        self.execute('CREATE TABLE `{0}` LIKE `{1}`'.format(BENCHMARK_TABLE, RoutePoint._meta.db_table))
+        for name in self.get_secondary_indexes():
+            self.execute('ALTER TABLE `{0}` DROP INDEX `{1}`'.format(BENCHMARK_TABLE, name))
+
+        # Генератор строк 0..999999 из декартова произведения цифр, дальше INSERT ... SELECT пачками
+        digits = '(SELECT 0 d UNION ALL SELECT 1 UNION ALL SELECT 2 UNION ALL SELECT 3 UNION ALL SELECT 4 ' \
+                 'UNION ALL SELECT 5 UNION ALL SELECT 6 UNION ALL SELECT 7 UNION ALL SELECT 8 UNION ALL SELECT 9)'
+        sequence = 'SELECT a.d + b.d * 10 + c.d * 100 + e.d * 1000 + f.d * 10000 + g.d * 100000 AS n FROM ' + \
+                   ', '.join('{0} {1}'.format(digits, alias) for alias in 'abcefg')
+        started = time.perf_counter()
+        for offset in range(0, points, batch):
+            size = min(batch, points - offset)
+            self.execute(
+                'INSERT INTO `{0}` (`vehicle_id`, `datetime`, `point`) '
+                'SELECT MOD(s.n + %s, %s) + 1, '
+                'TIMESTAMPADD(SECOND, (s.n + %s) DIV %s * 10, %s), '
+                'ST_SRID(POINT(37.6 + RAND() * 0.5, 55.7 + RAND() * 0.3), 4326) '
+                'FROM ({1}) s WHERE s.n < %s'.format(BENCHMARK_TABLE, sequence),
+                [offset, vehicles, offset, vehicles, '2022-01-01 00:00:00', size])
+            self.stdout.write('Inserted %d / %d points' % (offset + size, points))
+        self.execute('ANALYZE TABLE `{0}`'.format(BENCHMARK_TABLE))
+        self.stdout.write('Table filled in %.1f s' % (time.perf_counter() - started))
+
+    def get_secondary_indexes(self):
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, BENCHMARK_TABLE)
+        return [name for name, constraint in constraints.items()
+                if constraint['index'] and not constraint['primary_key'] and constraint['type'] != 'spatial']
+
+    @staticmethod
+    def get_queries(vehicles):
+        vehicle_id = vehicles // 2
+        table = BENCHMARK_TABLE
+        return {
+            'track_day': (
+                'SELECT `datetime`, ST_AsWKB(`point`) FROM `{0}` WHERE `vehicle_id` = %s '
+                'AND `datetime` BETWEEN %s AND %s ORDER BY `datetime`'.format(table),
+                [vehicle_id, '2022-01-20 00:00:00', '2022-01-21 00:00:00']),
+            'track_month': (
+                'SELECT `datetime`, ST_AsWKB(`point`) FROM `{0}` WHERE `vehicle_id` = %s '
+                'AND `datetime` BETWEEN %s AND %s ORDER BY `datetime`'.format(table),
+                [vehicle_id, '2022-01-01 00:00:00', '2022-02-01 00:00:00']),
+            'last_point': (
+                'SELECT `datetime` FROM `{0}` WHERE `vehicle_id` = %s ORDER BY `datetime` DESC LIMIT 1'.format(table),
+                [vehicle_id]),
+            'window_bounds': (
+                'SELECT MIN(`datetime`), MAX(`datetime`) FROM `{0}` WHERE `vehicle_id` = %s '
+                'AND `datetime` BETWEEN %s AND %s'.format(table),
+                [vehicle_id, '2022-01-01 00:00:00', '2022-02-01 00:00:00']),
+        }
+
+    def run_queries(self, queries, repeat):
+        latencies = {}
+        for name, (sql, params) in queries.items():
+            for row in self.execute('EXPLAIN ' + sql, params):
+                self.stdout.write('{0:<16} {1}'.format(name, ' | '.join(str(value) for value in row)))
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                self.execute(sql, params)
+                timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            latencies[name] = timings[len(timings) // 2]
+        return latencies
@@ -1,10 +1,106 @@
 import string
-from random import random, sample, choice
+import time
+from itertools import chain
 
-from django.core.management import BaseCommand, CommandError, CommandParser
+import numpy as np
+from django.core.management import BaseCommand, CommandError
+from django.utils import timezone
 
 from park.models import Enterprise, Model, Manufacturer, Vehicle, Driver
 
+COLORS = np.array(['черный', 'желтый', 'красный', 'серый', 'коричневый', 'зелёный'])
+PLATE_ALPHABET = string.ascii_uppercase + string.digits
+# Каждый десятый водитель остаётся без машины
+DRIVERS_WITHOUT_CAR = 10
+# bulk_update собирает CASE по id на всю пачку, на длинных CASE MySQL замедляется
+UPDATE_BATCH_SIZE = 1000
+
+
+def random_codes(rng, alphabet, size, length):
+    symbols = np.frombuffer(alphabet.encode(), dtype=np.uint8)
+    return symbols[rng.integers(0, symbols.size, (size, length))]
+
+
+def join_codes(codes):
+    """Строки из матрицы ASCII-кодов, по строке на ряд, без цикла по строкам."""
+    return np.ascontiguousarray(codes).view('S%d' % codes.shape[1]).ravel().astype('U%d' % codes.shape[1]).tolist()
+
+
+def random_strings(rng, alphabet, size, length):
+    return join_codes(random_codes(rng, alphabet, size, length))
+
+
+def random_names(rng, size, length):
+    codes = random_codes(rng, string.ascii_lowercase, size, length)
+    codes[:, 0] -= ord('a') - ord('A')  # с заглавной буквы
+    return join_codes(codes)
+
+
+def random_ids(rng, ids, size):
+    """size случайных id из массива ids, None - если ids пуст (внешние ключи допускают NULL)."""
+    if not len(ids):
+        return [None] * size
+    return ids[rng.integers(0, len(ids), size)].tolist()
+
+
+def get_batches(total, batch_size):
+    for offset in range(0, total, batch_size):
+        yield offset, min(batch_size, total - offset)
+
+
+def create_vehicles(rng, enterprise, manufacturer_ids, model_ids, size):
+    buy_datetime = timezone.now()
+    vehicles = [
+        Vehicle(manufacturer_id=manufacturer_id, model_id=model_id, cost=cost, odometer=odometer, year=year,
+                color=color, number_plate=number_plate, enterprise_id=enterprise.id, buy_datetime=buy_datetime)
+        for manufacturer_id, model_id, cost, odometer, year, color, number_plate in zip(
+            random_ids(rng, manufacturer_ids, size),
+            random_ids(rng, model_ids, size),
+            (rng.integers(1, 1001, size) * 10000).tolist(),
+            rng.integers(0, 1000001, size).tolist(),
+            rng.integers(1973, 2024, size).tolist(),
+            COLORS[rng.integers(0, COLORS.size, size)].tolist(),
+            random_strings(rng, PLATE_ALPHABET, size, 8),
+        )
+    ]
+    Vehicle.objects.bulk_create(vehicles, batch_size=len(vehicles))
+
+
+def create_drivers(rng, enterprise, vehicle_ids, offset, size):
+    car_ids = random_ids(rng, vehicle_ids, size)
+    for number in range(-offset % DRIVERS_WITHOUT_CAR, size, DRIVERS_WITHOUT_CAR):
+        car_ids[number] = None
+    drivers = [
+        Driver(first_name=first_name, last_name=last_name, age=age, salary=salary, enterprise_id=enterprise.id,
+               car_id=car_id)
+        for first_name, last_name, age, salary, car_id in zip(
+            random_names(rng, size, 8),
+            random_names(rng, size, 10),
+            rng.integers(18, 80, size).tolist(),
+            rng.integers(30000, 130000, size).tolist(),
+            car_ids,
+        )
+    ]
+    Driver.objects.bulk_create(drivers, batch_size=len(drivers))
+
+
+def assign_active_drivers(rng, enterprise, batch_size):
+    """Каждой машине предприятия, у которой есть водители, - случайный из них активным. Возвращает число машин."""
+    rows = Driver.objects.filter(enterprise=enterprise, car__isnull=False).order_by('id')\
+        .values_list('id', 'car_id').iterator(chunk_size=batch_size)
+    pairs = np.fromiter(chain.from_iterable(rows), dtype=np.int64).reshape(-1, 2)
+    # После перемешивания первый водитель каждой машины - случайный из её водителей
+    pairs = pairs[rng.permutation(len(pairs))]
+    car_ids, first = np.unique(pairs[:, 1], return_index=True)
+    driver_ids = pairs[first, 0]
+    for offset, size in get_batches(len(car_ids), batch_size):
+        Vehicle.objects.bulk_update([
+            Vehicle(id=car_id, active_driver_id=driver_id)
+            for car_id, driver_id in zip(car_ids[offset:offset + size].tolist(),
+                                         driver_ids[offset:offset + size].tolist())
+        ], ['active_driver'], batch_size=UPDATE_BATCH_SIZE)
+    return len(car_ids)
+
 
 class Command(BaseCommand):
     help = 'Generates vehicles and drivers for company/companies.'
@@ -13,57 +109,38 @@ class Command(BaseCommand):
         parser.add_argument('enterprise_id', nargs='+', type=int)
 
         # Optional arguments
-        parser.add_argument('--car-number', type=int, help='Number of cars.')
-        parser.add_argument('--driver-number', type=int, help='Number of drivers.')
+        parser.add_argument('--car-number', type=int, default=0, help='Number of cars per company.')
+        parser.add_argument('--driver-number', type=int, default=0, help='Number of drivers per company.')
+        parser.add_argument('--batch', type=int, default=10000, help='Number of objects generated and written at once.')
+        parser.add_argument('--seed', type=int, help='Seed for reproducible objects.')
 
     def handle(self, *args, **options):
-        # enterprises = []
-        # num_of_companies = len(options['enterprise_id'])
-        print(options.keys())
-        car_number = options['car_number']
-        driver_number = options['driver_number']
+        enterprises = Enterprise.objects.in_bulk(options['enterprise_id'])
+        for enterprise_id in options['enterprise_id']:
+            if enterprise_id not in enterprises:
+                raise CommandError('Enterprise "%s" does not exist' % enterprise_id)
+
+        rng = np.random.default_rng(options['seed'])
+        batch_size = options['batch']
+        # Справочники читаются один раз на весь запуск
+        manufacturer_ids = np.fromiter(Manufacturer.objects.order_by('id').values_list('id', flat=True), dtype=np.int64)
+        model_ids = np.fromiter(Model.objects.order_by('id').values_list('id', flat=True), dtype=np.int64)
 
         for enterprise_id in options['enterprise_id']:
-            try:
-                enterprise = Enterprise.objects.get(pk=enterprise_id)
-                cars = []
-                drivers = []
-
-                for _ in range(car_number):
-                    car = Vehicle.objects.create(
-                        manufacturer=choice(list(Manufacturer.objects.all())),
-                        model=choice(list(Model.objects.all())),
-                        cost=int(round(random() * 1000) * 10000),
-                        odometer=int(round(random() * 1000000)),
-                        year=int(round(random(), 2)*50+1973),
-                        color=choice(('черный','желтый','красный','серый','коричневый','зелёный')),
-                        number_plate=''.join(choice(string.ascii_uppercase + string.digits) for _ in range(8)),
-                        enterprise=enterprise
-                    )
-                    car.save()
-                    cars.append(car)
-                    self.stdout.write(self.style.SUCCESS('Car %s created successfully!' % car.number_plate))
-
-                for i in range(driver_number):
-                    cars = Vehicle.objects.filter(enterprise=enterprise)
-                    driver = Driver.objects.create(
-                        first_name=(''.join(choice(string.ascii_lowercase) for _ in range(8))).capitalize(),
-                        last_name=(''.join(choice(string.ascii_lowercase) for _ in range(10))).capitalize(),
-                        age=int(random()*62)+18,
-                        salary=int(random()*100000)+30000,
-                        enterprise=enterprise
-                    )
-                    if i % 10 != 0:
-                        driver.car = choice(cars)
-                    driver.save()
-                    drivers.append(driver)
-                    self.stdout.write(self.style.SUCCESS('Driver %s created successfully!' % driver.last_name))
-
-                for car in cars:
-                    drivers = Driver.objects.filter(car=car)
-                    if len(drivers) > 0:
-                        car.active_driver = choice(drivers)
-                        car.save()
-
-            except enterprise.DoesNotExist:
-                raise CommandError('Enterprise "%s" does not exist' % enterprise_id)
\ No newline at end of file
+            enterprise = enterprises[enterprise_id]
+            started = time.perf_counter()
+            for _, size in get_batches(options['car_number'], batch_size):
+                create_vehicles(rng, enterprise, manufacturer_ids, model_ids, size)
+
+            # Водители садятся на любые машины предприятия, включая созданные раньше
+            vehicle_ids = np.fromiter(Vehicle.objects.filter(enterprise=enterprise).order_by('id')
+                                      .values_list('id', flat=True).iterator(chunk_size=batch_size), dtype=np.int64)
+            for offset, size in get_batches(options['driver_number'], batch_size):
+                create_drivers(rng, enterprise, vehicle_ids, offset, size)
+
+            active = assign_active_drivers(rng, enterprise, batch_size)
+            self.stdout.write(self.style.SUCCESS(
+                'Enterprise %s: %d cars and %d drivers created, %d cars got an active driver in %.1f s.'
+                % (enterprise, options['car_number'], options['driver_number'], active,
+                   time.perf_counter() - started)
+            ))
@@ -1,143 +1,205 @@
-import string
-from random import random, sample, choice
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from random import Random
 
-from django.core.management import BaseCommand, CommandError, CommandParser
 from django.contrib.gis.geos import Point
-
-from park.models import Enterprise, Model, Manufacturer, Vehicle, Driver, RoutePoint, Travel
-
-import requests
-import json
-from pprint import pprint
-from datetime import datetime, timedelta
-import geocoder
+from django.core.management import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+
+from autopark import settings
+from park.ingest import store_route_points
+from park.models import Vehicle, RoutePoint, Travel
+from park.routing import get_router
+from park.signals import invalidate_vehicle_caches
+from park.summaries import summarize_travels
+
+COORD_FROM_LIST = [
+    [28.332460, 57.819274],
+    [27.609352, 57.813756],
+    [30.515671, 56.343703],
+    [28.916437, 57.021432],
+    [27.819594, 58.744398],
+    [28.484823, 56.277403]
+]
+COORD_TO_LIST = [
+    [65.541227, 57.152985],
+    [60.597474, 56.838011],
+    [39.200296, 51.660781],
+    [32.045287, 54.782635],
+    [38.975313, 45.035470],
+    [48.030178, 46.347614]
+]
+# Точка трека пишется не чаще, чем раз в 30 секунд пути
+POINT_INTERVAL_MS = 30000
+# Перерыв между поездками
+STOP_DURATION = timedelta(hours=12)
+
+# Маршруты между одними и теми же городами повторяются, в процессе пула каждый строится один раз
+_routers = {}
+_routes = {}
+
+
+def get_route(router_path, cache_dir, coord_from, coord_to):
+    """Маршрут между точками [lon, lat] через маршрутизатор router_path, запомненный в процессе."""
+    key = (router_path, cache_dir, tuple(coord_from), tuple(coord_to))
+    if key not in _routes:
+        if (router_path, cache_dir) not in _routers:
+            _routers[router_path, cache_dir] = get_router(router_path, cache_dir)
+        _routes[key] = _routers[router_path, cache_dir].route(coord_from, coord_to)
+    return _routes[key]
+
+
+def build_travel_points(start_dt, coord_from, coordinates, times, interval_ms=POINT_INTERVAL_MS):
+    """Точки поездки по деталям time маршрута: пары (datetime, [lon, lat]) не чаще раза в interval_ms."""
+    points = [(start_dt, coord_from)]
+    point_dt = start_dt
+    time_buffer = 0
+    for _, current_point_number, time_delta in times:
+        if time_delta + time_buffer < interval_ms:
+            time_buffer += time_delta
+            continue
+        time_delta += time_buffer
+        time_buffer = 0
+        point_dt += timedelta(seconds=int(time_delta / 1000))
+        points.append((point_dt, coordinates[current_point_number]))
+    return points
+
+
+def store_travels(vehicle_id, enterprise_id, travels, route_points, batch_size):
+    # Поездки пишутся раньше своих точек: store_route_points привяжет к ним точки по времени
+    Travel.objects.bulk_create(travels, batch_size=batch_size)
+    # bulk_create не отправляет post_save, кэши по окну поездок сбрасываются так же, как при сохранении поездки
+    invalidate_vehicle_caches(vehicle_id, enterprise_id, travels[0].begin, travels[-1].end)
+    store_route_points(route_points, batch_size=batch_size)
+    summarize_travels(Travel.objects.filter(vehicle_id=vehicle_id, begin__gte=travels[0].begin,
+                                            begin__lte=travels[-1].begin, summarized_at__isnull=True))
+
+
+def generate_vehicle_track(vehicle_id, start_dt, end_dt, seed=None, batch_size=5000, router=None, cache_dir=None):
+    """
+    Поездки машины туда и обратно между городами с 12-часовыми стоянками. Поездка, которая закончилась бы
+    позже end_dt, не создаётся: по умолчанию end_dt - текущее время, и её точки и положение машины оказались бы
+    в будущем. Маршруты строит router (путь к классу, см. park.routing.get_router).
+    Поездки копятся и пишутся пачками от batch_size точек.
+    Вызывается в процессах пула. Возвращает (поездок, точек).
+    """
+    rng = Random(None if seed is None else seed * 1000003 + vehicle_id)
+    enterprise_id = Vehicle.objects.filter(pk=vehicle_id).values_list('enterprise_id', flat=True).first()
+    coord_from = rng.choice(COORD_FROM_LIST)
+    coord_to = rng.choice(COORD_TO_LIST)
+    forward = True  # из какого списка выбирать пункт назначения
+
+    travel_count, point_count = 0, 0
+    travels, route_points = [], []
+    while start_dt < end_dt:
+        coordinates, times, route_time = get_route(router, cache_dir, coord_from, coord_to)
+        travel_end = start_dt + timedelta(seconds=int(route_time / 1000))
+        if travel_end > end_dt:
+            break
+        travels.append(Travel(vehicle_id=vehicle_id, begin=start_dt, end=travel_end))
+        route_points.extend(RoutePoint(vehicle_id=vehicle_id, datetime=point_dt, point=Point(point_coordinates))
+                            for point_dt, point_coordinates in build_travel_points(start_dt, coord_from, coordinates,
+                                                                                   times))
+        if len(route_points) >= batch_size:
+            store_travels(vehicle_id, enterprise_id, travels, route_points, batch_size)
+            travel_count += len(travels)
+            point_count += len(route_points)
+            travels, route_points = [], []
+
+        start_dt = travel_end + STOP_DURATION
+        forward = not forward  # едем обратно
+        coord_from = coord_to
+        coord_to = rng.choice(COORD_TO_LIST if forward else COORD_FROM_LIST)
+
+    if travels:
+        store_travels(vehicle_id, enterprise_id, travels, route_points, batch_size)
+        travel_count += len(travels)
+        point_count += len(route_points)
+    return travel_count, point_count
+
+
+def close_connections():
+    # Процессы пула получают копию соединений родителя при fork, каждый должен открыть свои
+    connections.close_all()
 
 
 class Command(BaseCommand):
-    help = 'Generates track for vehicle'
+    help = 'Generates tracks for vehicles'
 
     def add_arguments(self, parser):
-        parser.add_argument('vehicle_id', nargs='+', type=int)
+        parser.add_argument('vehicle_id', nargs='*', type=int)
 
         # Optional arguments
+        parser.add_argument('--enterprise', type=int, nargs='+',
+                            help='Generate tracks for all vehicles of these enterprises.')
+        parser.add_argument('--start', type=str, required=True, help='Date/time of the beginning of the journey.')
+        parser.add_argument('--end', type=str, help='Generate travels until this date/time. Defaults to now.')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Number of worker processes, defaults to the number of CPUs '
+                                 '(1 - generate in the current process).')
+        parser.add_argument('--batch', type=int, default=settings.INGEST_BATCH_SIZE,
+                            help='Number of route points written at once.')
+        parser.add_argument('--seed', type=int, help='Seed for reproducible routes.')
+        parser.add_argument('--router', type=str, default=settings.ROUTING_ROUTER,
+                            help='Router class, e.g. park.routing.SyntheticRouter (offline) '
+                                 'or park.routing.GraphHopperRouter.')
+        parser.add_argument('--route-cache', type=str, default=settings.ROUTING_CACHE_DIR,
+                            help='Directory of the on-disk route cache for network routers (empty - no cache).')
         parser.add_argument('--length', type=int, help='Length of the track.')
         parser.add_argument('--speed', type=int, help='Max speed of the car.')
         parser.add_argument('--acceleration', type=int, help='Max acceleration of the car.')
-        parser.add_argument('--start', type=str, help='Date/time of the beginning of the journey.')
 
     def handle(self, *args, **options):
-        vehicle_id = options['vehicle_id'][0]
-        vehicle = Vehicle.objects.get(pk=vehicle_id)
-
-        coord_from_list = [
-            [28.332460, 57.819274],
-            [27.609352, 57.813756],
-            [30.515671, 56.343703],
-            [28.916437, 57.021432],
-            [27.819594, 58.744398],
-            [28.484823, 56.277403]
-        ]
-        coord_to_list = [
-            [65.541227, 57.152985],
-            [60.597474, 56.838011],
-            [39.200296, 51.660781],
-            [32.045287, 54.782635],
-            [38.975313, 45.035470],
-            [48.030178, 46.347614]
-        ]
-        # coord_from = [28.33485326156282, 57.81664162349827]
-        # coord_to = [60.902996, 58.232520]
-        coord_from = choice(coord_from_list)
-        coord_to = choice(coord_to_list)
-        length = options['length']
-        speed = options['speed']
-        acceleration = options['acceleration']
-        start = options['start']
-        forward = True  # из какого списка выбирать пункт назначения
-
-        start_dt = datetime.fromisoformat(start)
-        end_dt = start_dt
-        url = "https://graphhopper.com/api/1/route"
-
-        query = {
-          "key": "22e6c1f4-4d04-4492-bb0b-c4febde829a3"
-        }
-
-        while end_dt < datetime.fromisoformat('2023-03-21 21:00:00+03:00'):
-            # print('From {0} to {1} begins {2}, Forward = {3}'.format(
-            #     geocoder.yandex(coord_from, apikey='e85c72cb-b9ca-4887-838f-b0cf38d74df9', method='reverse', sco='latlong'),
-            #     geocoder.yandex(coord_to, apikey='e85c72cb-b9ca-4887-838f-b0cf38d74df9', method='reverse',  sco='latlong'),
-            #     start_dt, forward))
-
-            # print('From {0} to {1} begins {2}, Forward = {3}'.format(coord_from, coord_to, start_dt, forward))
-
-            payload = {
-              "points": [
-                  coord_from,
-                  coord_to
-              ],
-              "details": [
-                "road_class",
-                "surface",
-                'time',
-              ],
-              "vehicle": "car",
-              "locale": "en",
-              "instructions": True,
-              "calc_points": True,
-              "points_encoded": False
-            }
-
-            headers = {"Content-Type": "application/json"}
-
-            response = requests.post(url, json=payload, headers=headers, params=query)
-
-            data = response.json()
-            coordinates = data['paths'][0]['points']['coordinates']
-            times = data['paths'][0]['details']['time']
-
-            route_time = data['paths'][0]['time']
-            end_dt = start_dt + timedelta(seconds=int(route_time / 1000))
-
-            null_point = RoutePoint.objects.create(
-                vehicle=vehicle, datetime=start_dt, point=Point(coord_from)
-            )
-            null_point.save()
-            previous_point = null_point
-
-            time_buffer = 0
-            for point_time in times:
-                prev_point_number, current_point_number, time_delta = point_time
-                if time_delta + time_buffer < 30000:  # 30 секунд
-                    time_buffer += time_delta
-                    continue
-                else:
-                    time_delta += time_buffer
-                    time_buffer = 0
-                current_coordinates = coordinates[current_point_number]
-                current_dt = previous_point.datetime + timedelta(seconds=int(time_delta/1000))
-
-                current_point = RoutePoint.objects.create(
-                    vehicle=vehicle,
-                    datetime=current_dt,
-                    point=Point(current_coordinates)
-                )
-                current_point.save()
-                previous_point = current_point
-
-            travel = Travel.objects.create(
-                vehicle=vehicle,
-                begin=start_dt,
-                end=end_dt
-            )
-            travel.save()
-
-            start_dt = end_dt + timedelta(hours=12)  # перерыв между поездками 12 часов
-            forward = not forward  # едем обратно
-            coord_from = coord_to
-            if forward:
-                coord_to = choice(coord_to_list)
-            else:
-                coord_to = choice(coord_from_list)
-
-
+        vehicle_ids = list(options['vehicle_id'])
+        if options['enterprise']:
+            vehicle_ids += Vehicle.objects.filter(enterprise_id__in=options['enterprise']).order_by('id')\
+                .values_list('id', flat=True)
+        vehicle_ids = sorted(set(vehicle_ids))
+        if not vehicle_ids:
+            raise CommandError('Give vehicle ids or --enterprise.')
+        missing = set(vehicle_ids) - set(Vehicle.objects.filter(pk__in=vehicle_ids).values_list('id', flat=True))
+        if missing:
+            raise CommandError('Vehicles not found: %s' % ', '.join(map(str, sorted(missing))))
+
+        try:
+            start_dt = datetime.fromisoformat(options['start'])
+            end_dt = datetime.fromisoformat(options['end']) if options['end'] else timezone.now()
+        except ValueError as error:
+            raise CommandError('Wrong date: %s' % error)
+        if timezone.is_naive(start_dt):
+            start_dt = timezone.make_aware(start_dt)
+        if timezone.is_naive(end_dt):
+            end_dt = timezone.make_aware(end_dt)
+        if start_dt >= end_dt:
+            raise CommandError('Start %s is not before end %s' % (start_dt, end_dt))
+
+        try:
+            get_router(options['router'], options['route_cache'])
+        except (ImportError, ValueError) as error:
+            raise CommandError('Wrong router: %s' % error)
+
+        started = time.perf_counter()
+        arguments = (start_dt, end_dt, options['seed'], options['batch'], options['router'], options['route_cache'])
+        results = {}
+        if options['workers'] > 1 and len(vehicle_ids) > 1:
+            close_connections()
+            with ProcessPoolExecutor(max_workers=options['workers'], initializer=close_connections) as executor:
+                futures = {vehicle_id: executor.submit(generate_vehicle_track, vehicle_id, *arguments)
+                           for vehicle_id in vehicle_ids}
+                for vehicle_id, future in futures.items():
+                    results[vehicle_id] = future.result()
+                    self.stdout.write('Vehicle %d: %d travels, %d route points' % (vehicle_id, *results[vehicle_id]))
+        else:
+            for vehicle_id in vehicle_ids:
+                results[vehicle_id] = generate_vehicle_track(vehicle_id, *arguments)
+                self.stdout.write('Vehicle %d: %d travels, %d route points' % (vehicle_id, *results[vehicle_id]))
+
+        elapsed = time.perf_counter() - started
+        travels = sum(travel_count for travel_count, _ in results.values())
+        points = sum(point_count for _, point_count in results.values())
+        self.stdout.write(self.style.SUCCESS('Generated %d travels and %d route points for %d vehicles in %.1f s '
+                                             '(%.0f points/s).' % (travels, points, len(vehicle_ids), elapsed,
+                                                                   points / elapsed if elapsed else 0)))
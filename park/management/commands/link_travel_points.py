@@ -0,0 +1,30 @@
+from django.core.management import BaseCommand
+from django.db import transaction
+
+from park.models import Travel
+from park.travels import link_travel_points
+
+
+class Command(BaseCommand):
+    help = 'Backfills RoutePoint.travel for existing travels.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--vehicle', type=int, nargs='+', help='Link only travels of these vehicles.')
+        parser.add_argument('--enterprise', type=int, nargs='+', help='Link only travels of these enterprises.')
+        parser.add_argument('--relink', action='store_true',
+                            help='Also move points already linked to another travel.')
+
+    def handle(self, *args, **options):
+        travels = Travel.objects.all()
+        if options['vehicle']:
+            travels = travels.filter(vehicle_id__in=options['vehicle'])
+        if options['enterprise']:
+            travels = travels.filter(vehicle__enterprise_id__in=options['enterprise'])
+
+        # Каждая поездка - отдельный UPDATE по индексу (vehicle, datetime) в своей транзакции
+        total, linked = 0, 0
+        for travel in travels.order_by('vehicle_id', 'begin').iterator(chunk_size=500):
+            with transaction.atomic():
+                linked += link_travel_points(travel, relink=options['relink'])
+            total += 1
+        self.stdout.write(self.style.SUCCESS('Linked %d route points to %d travels.' % (linked, total)))
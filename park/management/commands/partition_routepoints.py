@@ -0,0 +1,102 @@
+from datetime import date
+
+from dateutil.relativedelta import relativedelta
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+
+from park.models import RoutePoint
+
+
+class Command(BaseCommand):
+    help = ('Converts the route point table to monthly RANGE partitions on MySQL, or adds partitions for the '
+            'coming months. Prints the SQL unless --execute is given. The conversion drops every foreign key of '
+            'the table and makes the primary key (id, datetime): later migrations that add, alter or rely on '
+            'RoutePoint foreign keys fail on the partitioned table and have to be rewritten as RunSQL '
+            'or faked with --fake after a manual change.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=str, help='First partitioned month, YYYY-MM. Earlier rows go to p_old.')
+        parser.add_argument('--months-ahead', type=int, default=3, help='Monthly partitions to create in advance.')
+        parser.add_argument('--extend', action='store_true',
+                            help='Table is already partitioned: split p_future to add the coming months.')
+        parser.add_argument('--execute', '--apply', dest='execute', action='store_true',
+                            help='Execute the statements instead of printing them. MySQL only.')
+
+    def handle(self, *args, **options):
+        # Без --execute SQL только печатается, на любой базе: так его можно посмотреть до переезда на MySQL
+        is_mysql = connection.vendor == 'mysql'
+        if options['execute'] and not is_mysql:
+            raise CommandError('Partitioning is only supported for the MySQL backend, run without --execute '
+                               'to print the SQL.')
+        table = RoutePoint._meta.db_table
+
+        if options['extend']:
+            if not is_mysql:
+                raise CommandError('--extend reads the partitions of a MySQL table.')
+            statements = self.extend_statements(table, options['months_ahead'])
+        else:
+            if not options['start']:
+                raise CommandError('--start is required for the initial conversion.')
+            start = date.fromisoformat(options['start'] + '-01')
+            statements = self.convert_statements(table, start, options['months_ahead'])
+
+        for statement in statements:
+            self.stdout.write(statement + ';')
+            if options['execute']:
+                with connection.cursor() as cursor:
+                    cursor.execute(statement)
+        if options['execute']:
+            self.stdout.write(self.style.SUCCESS('Partitioning of %s updated.' % table))
+        else:
+            self.stdout.write(self.style.WARNING('Dry run, nothing executed. Add --execute to run the statements.'))
+
+    @staticmethod
+    def partition_definition(month):
+        bound = month + relativedelta(months=1)
+        return "PARTITION p{0:%Y%m} VALUES LESS THAN ('{1:%Y-%m-%d}')".format(month, bound)
+
+    def get_months(self, start, months_ahead):
+        last = date.today().replace(day=1) + relativedelta(months=months_ahead)
+        month = start
+        while month <= last:
+            yield month
+            month += relativedelta(months=1)
+
+    def convert_statements(self, table, start, months_ahead):
+        # Ограничения MySQL для секционированных таблиц: нет внешних ключей и SPATIAL-индексов,
+        # а столбец секционирования должен входить в каждый уникальный ключ, включая первичный
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, table)
+        statements = []
+        for name, constraint in constraints.items():
+            if constraint['foreign_key']:
+                statements.append('ALTER TABLE `{0}` DROP FOREIGN KEY `{1}`'.format(table, name))
+        for name, constraint in constraints.items():
+            if constraint['index'] and constraint['type'] == 'spatial':
+                statements.append('ALTER TABLE `{0}` DROP INDEX `{1}`'.format(table, name))
+        statements.append('ALTER TABLE `{0}` DROP PRIMARY KEY, ADD PRIMARY KEY (`id`, `datetime`)'.format(table))
+
+        partitions = ["PARTITION p_old VALUES LESS THAN ('{0:%Y-%m-%d}')".format(start)]
+        partitions += [self.partition_definition(month) for month in self.get_months(start, months_ahead)]
+        partitions.append('PARTITION p_future VALUES LESS THAN (MAXVALUE)')
+        statements.append('ALTER TABLE `{0}` PARTITION BY RANGE COLUMNS(`datetime`) (\n    {1}\n)'.format(
+            table, ',\n    '.join(partitions)))
+        return statements
+
+    def extend_statements(self, table, months_ahead):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT PARTITION_DESCRIPTION FROM information_schema.PARTITIONS '
+                'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME <> %s '
+                'ORDER BY PARTITION_ORDINAL_POSITION DESC LIMIT 1', [table, 'p_future'])
+            row = cursor.fetchone()
+        if row is None:
+            raise CommandError('Table %s is not partitioned yet, run without --extend first.' % table)
+        next_month = date.fromisoformat(row[0].strip("'")[:10])
+        months = list(self.get_months(next_month, months_ahead))
+        if not months:
+            return []
+        partitions = [self.partition_definition(month) for month in months]
+        partitions.append('PARTITION p_future VALUES LESS THAN (MAXVALUE)')
+        return ['ALTER TABLE `{0}` REORGANIZE PARTITION p_future INTO (\n    {1}\n)'.format(
+            table, ',\n    '.join(partitions))]
@@ -0,0 +1,55 @@
+from datetime import date, timedelta
+
+from django.core.management import BaseCommand, CommandError
+from django.db.models import Min, Max
+
+from park.models import RoutePoint, Vehicle
+from park.report_cache import report_cache
+from park.rollups import rebuild_daily_mileage, get_utc_day, get_day_bounds
+
+
+class Command(BaseCommand):
+    help = 'Backfills or rebuilds daily mileage rollups from raw route points.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=str, help='First day to rebuild, YYYY-MM-DD. Defaults to the first point.')
+        parser.add_argument('--end', type=str, help='Last day to rebuild, YYYY-MM-DD. Defaults to the last point.')
+        parser.add_argument('--vehicle', type=int, nargs='+', help='Rebuild only these vehicles.')
+        parser.add_argument('--enterprise', type=int, nargs='+', help='Rebuild only vehicles of these enterprises.')
+        parser.add_argument('--step', type=int, default=31, help='Number of days rebuilt in one transaction.')
+
+    def handle(self, *args, **options):
+        vehicle_ids = options['vehicle']
+        if options['enterprise']:
+            enterprise_vehicles = Vehicle.objects.filter(enterprise_id__in=options['enterprise'])
+            vehicle_ids = list(enterprise_vehicles.values_list('id', flat=True)) + (vehicle_ids or [])
+
+        route_points = RoutePoint.objects.all()
+        if vehicle_ids is not None:
+            route_points = route_points.filter(vehicle_id__in=vehicle_ids)
+        bounds = route_points.aggregate(min_dt=Min('datetime'), max_dt=Max('datetime'))
+        if bounds['min_dt'] is None:
+            self.stdout.write(self.style.WARNING('No route points to aggregate.'))
+            return
+
+        try:
+            start = date.fromisoformat(options['start']) if options['start'] else get_utc_day(bounds['min_dt'])
+            end = date.fromisoformat(options['end']) if options['end'] else get_utc_day(bounds['max_dt'])
+        except ValueError as error:
+            raise CommandError('Wrong date: %s' % error)
+        if start > end:
+            raise CommandError('Start date %s is after end date %s' % (start, end))
+
+        first_day = start
+        step = timedelta(days=max(options['step'], 1))
+        total = 0
+        while start <= end:
+            step_end = min(start + step - timedelta(days=1), end)
+            rows = rebuild_daily_mileage(start, step_end, vehicle_ids)
+            total += rows
+            self.stdout.write('%s - %s: %s rollup rows' % (start, step_end, rows))
+            start = step_end + timedelta(days=1)
+
+        report_cache.invalidate_vehicles(vehicle_ids, get_day_bounds(first_day)[0], get_day_bounds(end)[1])
+
+        self.stdout.write(self.style.SUCCESS('Daily mileage rebuilt, %s rows written.' % total))
@@ -0,0 +1,20 @@
+from django.core.management import BaseCommand
+
+from park.models import Vehicle
+from park.positions import rebuild_positions
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds last known vehicle positions from route points.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--vehicle', type=int, nargs='+', help='Rebuild only these vehicles.')
+        parser.add_argument('--enterprise', type=int, nargs='+', help='Rebuild only vehicles of these enterprises.')
+
+    def handle(self, *args, **options):
+        vehicle_ids = options['vehicle']
+        if options['enterprise']:
+            enterprise_vehicles = Vehicle.objects.filter(enterprise_id__in=options['enterprise'])
+            vehicle_ids = list(enterprise_vehicles.values_list('id', flat=True)) + (vehicle_ids or [])
+        count = rebuild_positions(vehicle_ids)
+        self.stdout.write(self.style.SUCCESS('Rebuilt positions of %d vehicles.' % count))
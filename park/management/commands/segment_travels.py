@@ -0,0 +1,58 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.core.management import BaseCommand
+from django.db import connection
+
+from park.models import Vehicle
+from park.segmentation import segment_vehicle
+
+
+def run_segmentation(vehicle_id, **options):
+    # У каждого потока своё соединение с базой, закрываем его по завершении
+    try:
+        return segment_vehicle(vehicle_id, **options)
+    finally:
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = 'Detects travels in new route points of every vehicle, resuming from the last processed point.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--vehicle', type=int, nargs='+', help='Segment only these vehicles.')
+        parser.add_argument('--enterprise', type=int, nargs='+', help='Segment only vehicles of these enterprises.')
+        parser.add_argument('--workers', type=int, default=4, help='Number of vehicles processed in parallel.')
+        parser.add_argument('--stop-radius', type=int, help='Stop radius, meters.')
+        parser.add_argument('--stop-minutes', type=int, help='Stop duration that ends a travel, minutes.')
+        parser.add_argument('--max-gap', type=int, help='Silence that ends a travel, minutes.')
+        parser.add_argument('--batch', type=int, default=50000, help='Points processed in one transaction.')
+
+    def handle(self, *args, **options):
+        vehicles = Vehicle.objects.all()
+        if options['vehicle']:
+            vehicles = vehicles.filter(pk__in=options['vehicle'])
+        if options['enterprise']:
+            vehicles = vehicles.filter(enterprise_id__in=options['enterprise'])
+        vehicle_ids = list(vehicles.values_list('id', flat=True))
+
+        segment_options = {
+            'batch_points': options['batch'],
+            'stop_radius_m': options['stop_radius'],
+            'stop_minutes': options['stop_minutes'],
+            'max_gap_minutes': options['max_gap'],
+        }
+        # Потоки, а не процессы: основное время уходит на чтение точек и запись поездок в базу
+        totals = [0, 0, 0]
+        with ThreadPoolExecutor(max_workers=max(options['workers'], 1)) as executor:
+            futures = {executor.submit(run_segmentation, vehicle_id, **segment_options): vehicle_id
+                       for vehicle_id in vehicle_ids}
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as error:
+                    self.stdout.write(self.style.ERROR('Vehicle %d: %s' % (futures[future], error)))
+                    continue
+                totals = [total + value for total, value in zip(totals, result)]
+        self.stdout.write(self.style.SUCCESS(
+            'Processed %d points of %d vehicles: %d travels started, %d closed.' % (
+                totals[0], len(vehicle_ids), totals[1], totals[2])))
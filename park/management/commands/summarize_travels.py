@@ -0,0 +1,33 @@
+from django.core.management import BaseCommand
+
+from park.models import Travel
+from park.summaries import summarize_travels
+
+
+class Command(BaseCommand):
+    help = 'Recomputes stored travel summaries (distance, point count, max speed, bbox, endpoints).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--vehicle', type=int, nargs='+', help='Recompute only travels of these vehicles.')
+        parser.add_argument('--enterprise', type=int, nargs='+', help='Recompute only travels of these enterprises.')
+        parser.add_argument('--missing', action='store_true', help='Only travels without a summary yet.')
+        parser.add_argument('--batch', type=int, default=200, help='Number of travels recomputed at once.')
+
+    def handle(self, *args, **options):
+        travels = Travel.objects.all()
+        if options['vehicle']:
+            travels = travels.filter(vehicle_id__in=options['vehicle'])
+        if options['enterprise']:
+            travels = travels.filter(vehicle__enterprise_id__in=options['enterprise'])
+        if options['missing']:
+            travels = travels.filter(summarized_at__isnull=True)
+
+        total = 0
+        batch = []
+        for travel in travels.order_by('id').iterator(chunk_size=options['batch']):
+            batch.append(travel)
+            if len(batch) >= options['batch']:
+                total += summarize_travels(batch)
+                batch = []
+        total += summarize_travels(batch)
+        self.stdout.write(self.style.SUCCESS('Summarized %d travels.' % total))
@@ -0,0 +1,26 @@
+from django.core.management import BaseCommand
+from django.db import transaction
+
+from autopark import settings
+from park.heatmap import update_heatmaps
+from park.models import HeatmapState, HeatmapTile
+
+
+class Command(BaseCommand):
+    help = 'Bins route points ingested since the last run into per-enterprise daily heatmap tiles.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--zooms', type=int, nargs='+', help='Zoom levels (default: HEATMAP_ZOOMS).')
+        parser.add_argument('--chunk', type=int, default=50000, help='Route point ids read per query.')
+        parser.add_argument('--flush', type=int, default=1000000, help='Points binned in memory between saves.')
+        parser.add_argument('--rebuild', action='store_true', help='Drop all tiles and bin every route point again.')
+
+    def handle(self, *args, **options):
+        zooms = options['zooms'] or settings.HEATMAP_ZOOMS
+        if options['rebuild']:
+            with transaction.atomic():
+                HeatmapTile.objects.all().delete()
+                HeatmapState.objects.all().delete()
+        processed = update_heatmaps(zooms, chunk_size=options['chunk'], flush_points=options['flush'])
+        self.stdout.write(self.style.SUCCESS(
+            'Binned %d route points at zoom levels %s.' % (processed, ', '.join(map(str, zooms)))))
@@ -0,0 +1,39 @@
+# Generated by Django 4.1.7 on 2023-04-03 19:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('park', '0015_alter_manager_enterprise_travel'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='travel',
+            options={'ordering': ['vehicle'], 'verbose_name': 'Поездка', 'verbose_name_plural': 'Поездки'},
+        ),
+        migrations.CreateModel(
+            name='DailyMileage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='День (UTC)')),
+                ('km', models.FloatField(default=0, verbose_name='Пробег за день, км')),
+                ('point_count', models.IntegerField(default=0, verbose_name='Количество точек маршрута')),
+                ('first_ts', models.DateTimeField(verbose_name='Время первой точки')),
+                ('last_ts', models.DateTimeField(verbose_name='Время последней точки')),
+                ('vehicle', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_mileage', to='park.vehicle', verbose_name='Транспортное средство')),
+            ],
+            options={
+                'verbose_name': 'Суточный пробег',
+                'verbose_name_plural': 'Суточные пробеги',
+                'ordering': ['vehicle', 'day'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='dailymileage',
+            constraint=models.UniqueConstraint(fields=('vehicle', 'day'), name='park_dailymileage_vehicle_day'),
+        ),
+    ]
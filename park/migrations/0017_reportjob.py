@@ -0,0 +1,41 @@
+# Generated by Django 4.1.7 on 2023-04-10 18:47
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('park', '0016_dailymileage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(db_index=True, max_length=64, verbose_name='Ключ параметров отчёта')),
+                ('active_key', models.CharField(blank=True, max_length=64, null=True, unique=True, verbose_name='Ключ активной задачи')),
+                ('scope', models.CharField(choices=[('vehicle', 'Автомобиль'), ('enterprise', 'Предприятие')], max_length=10, verbose_name='По чему строится отчёт')),
+                ('owner_id', models.BigIntegerField(verbose_name='Автомобиль или предприятие')),
+                ('report_type', models.IntegerField(verbose_name='Тип отчёта')),
+                ('begin', models.DateTimeField(verbose_name='Начало отчёта')),
+                ('end', models.DateTimeField(verbose_name='Окончание отчёта')),
+                ('status', models.CharField(choices=[('pending', 'В очереди'), ('running', 'Выполняется'), ('done', 'Готов'), ('failed', 'Ошибка'), ('cancelled', 'Отменён')], default='pending', max_length=10, verbose_name='Состояние')),
+                ('result', models.JSONField(blank=True, null=True, verbose_name='Результат')),
+                ('error', models.TextField(blank=True, default='', verbose_name='Ошибка')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Создана')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Начата')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Завершена')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='report_jobs', to=settings.AUTH_USER_MODEL, verbose_name='Автор')),
+            ],
+            options={
+                'verbose_name': 'Задача на отчёт',
+                'verbose_name_plural': 'Задачи на отчёты',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.1.7 on 2023-04-17 20:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('park', '0017_reportjob'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='routepoint',
+            options={'verbose_name': 'Точка маршрута', 'verbose_name_plural': 'Точки маршрута'},
+        ),
+        migrations.AddIndex(
+            model_name='routepoint',
+            index=models.Index(fields=['vehicle', 'datetime'], name='park_routepoint_vehicle_dt'),
+        ),
+    ]
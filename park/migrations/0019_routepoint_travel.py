@@ -0,0 +1,23 @@
+# Generated by Django 4.1.7 on 2023-04-18 19:42
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('park', '0018_routepoint_vehicle_datetime_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='routepoint',
+            name='travel',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='routepoints', to='park.travel', verbose_name='Поездка'),
+        ),
+        migrations.AddIndex(
+            model_name='routepoint',
+            index=models.Index(fields=['travel', 'datetime'], name='park_routepoint_travel_dt'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 4.1.7 on 2023-04-20 18:27
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('park', '0019_routepoint_travel'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='travel',
+            name='distance_km',
+            field=models.FloatField(blank=True, null=True, verbose_name='Пройденное расстояние, км'),
+        ),
+        migrations.AddField(
+            model_name='travel',
+            name='point_count',
+            field=models.IntegerField(default=0, verbose_name='Количество точек маршрута'),
+        ),
+        migrations.AddField(
+            model_name='travel',
+            name='max_speed_kmh',
+            field=models.FloatField(blank=True, null=True, verbose_name='Максимальная скорость, км/ч'),
+        ),
+        migrations.AddField(
+            model_name='travel',
+            name='bbox',
+            field=django.contrib.gis.db.models.fields.PolygonField(blank=True, null=True, spatial_index=False, srid=4326, verbose_name='Охватывающий прямоугольник'),
+        ),
+        migrations.AddField(
+            model_name='travel',
+            name='start_point',
+            field=django.contrib.gis.db.models.fields.PointField(blank=True, null=True, spatial_index=False, srid=4326, verbose_name='Точка начала'),
+        ),
+        migrations.AddField(
+            model_name='travel',
+            name='end_point',
+            field=django.contrib.gis.db.models.fields.PointField(blank=True, null=True, spatial_index=False, srid=4326, verbose_name='Точка окончания'),
+        ),
+        migrations.AddField(
+            model_name='travel',
+            name='summarized_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Время расчёта сводки'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.1.7 on 2023-04-22 16:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('park', '0020_travel_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SegmentationState',
+            fields=[
+                ('vehicle', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='segmentation_state', serialize=False, to='park.vehicle', verbose_name='Транспортное средство')),
+                ('last_ts', models.DateTimeField(blank=True, null=True, verbose_name='Время последней обработанной точки')),
+                ('last_lat', models.FloatField(blank=True, null=True)),
+                ('last_lon', models.FloatField(blank=True, null=True)),
+                ('anchor_ts', models.DateTimeField(blank=True, null=True, verbose_name='Начало возможной стоянки')),
+                ('anchor_lat', models.FloatField(blank=True, null=True)),
+                ('anchor_lon', models.FloatField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Обновлено')),
+                ('travel', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='park.travel', verbose_name='Незакрытая поездка')),
+            ],
+            options={
+                'verbose_name': 'Состояние нарезки поездок',
+                'verbose_name_plural': 'Состояния нарезки поездок',
+            },
+        ),
+    ]
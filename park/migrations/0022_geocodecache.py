@@ -0,0 +1,33 @@
+# Generated by Django 4.1.7 on 2023-04-24 20:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('park', '0021_segmentationstate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeocodeCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('provider', models.CharField(max_length=50, verbose_name='Сервис геокодирования')),
+                ('digits', models.SmallIntegerField(verbose_name='Знаков после запятой в ячейке сетки')),
+                ('lat_key', models.IntegerField(verbose_name='Широта ячейки')),
+                ('lon_key', models.IntegerField(verbose_name='Долгота ячейки')),
+                ('address', models.TextField(blank=True, default='', verbose_name='Адрес')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Получен')),
+            ],
+            options={
+                'verbose_name': 'Адрес точки',
+                'verbose_name_plural': 'Адреса точек',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='geocodecache',
+            constraint=models.UniqueConstraint(fields=('provider', 'digits', 'lat_key', 'lon_key'), name='park_geocodecache_cell'),
+        ),
+    ]
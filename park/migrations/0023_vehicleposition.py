@@ -0,0 +1,29 @@
+# Generated by Django 4.1.7 on 2023-04-26 17:48
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('park', '0022_geocodecache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VehiclePosition',
+            fields=[
+                ('vehicle', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='position', serialize=False, to='park.vehicle', verbose_name='Транспортное средство')),
+                ('point', django.contrib.gis.db.models.fields.PointField(spatial_index=False, srid=4326, verbose_name='Точка на карте')),
+                ('datetime', models.DateTimeField(verbose_name='Время точки')),
+                ('speed_kmh', models.FloatField(blank=True, null=True, verbose_name='Скорость, км/ч')),
+                ('updated_at', models.DateTimeField(auto_now=True, db_index=True, verbose_name='Обновлено')),
+            ],
+            options={
+                'verbose_name': 'Текущее положение',
+                'verbose_name_plural': 'Текущие положения',
+            },
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 4.1.7 on 2023-04-28 19:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('park', '0023_vehicleposition'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HeatmapState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_point_id', models.BigIntegerField(default=0, verbose_name='Последняя обработанная точка')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Обновлено')),
+            ],
+            options={
+                'verbose_name': 'Состояние тепловой карты',
+                'verbose_name_plural': 'Состояние тепловой карты',
+            },
+        ),
+        migrations.CreateModel(
+            name='HeatmapTile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='День (UTC)')),
+                ('zoom', models.SmallIntegerField(verbose_name='Масштаб')),
+                ('x', models.IntegerField()),
+                ('y', models.IntegerField()),
+                ('counts', models.BinaryField(verbose_name='Счётчики ячеек')),
+                ('total', models.BigIntegerField(default=0, verbose_name='Всего точек')),
+                ('enterprise', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='heatmap_tiles', to='park.enterprise', verbose_name='Предприятие')),
+            ],
+            options={
+                'verbose_name': 'Тайл тепловой карты',
+                'verbose_name_plural': 'Тайлы тепловой карты',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='heatmaptile',
+            constraint=models.UniqueConstraint(fields=('enterprise', 'zoom', 'x', 'y', 'day'), name='park_heatmaptile_tile_day'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.1.7 on 2023-04-30 12:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('park', '0024_heatmap'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='routepoint',
+            name='tier',
+            field=models.SmallIntegerField(choices=[(0, 'Исходная'), (1, 'Прореженная')], default=0, verbose_name='Уровень детализации'),
+        ),
+        migrations.CreateModel(
+            name='RetentionState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('downsampled_before', models.DateTimeField(blank=True, null=True, verbose_name='Прорежено до')),
+                ('running_since', models.DateTimeField(blank=True, null=True, verbose_name='Выполняется с')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Обновлено')),
+            ],
+            options={
+                'verbose_name': 'Состояние прореживания точек',
+                'verbose_name_plural': 'Состояние прореживания точек',
+            },
+        ),
+    ]
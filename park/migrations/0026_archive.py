@@ -0,0 +1,59 @@
+# Generated by Django 4.1.7 on 2023-05-02 10:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('park', '0025_retention'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='retentionstate',
+            name='archived_before',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='В архиве до'),
+        ),
+        migrations.CreateModel(
+            name='ArchivedMonth',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(verbose_name='Месяц')),
+                ('archive_path', models.CharField(max_length=255, verbose_name='Файл')),
+                ('point_count', models.BigIntegerField(default=0, verbose_name='Количество точек')),
+                ('size_bytes', models.BigIntegerField(default=0, verbose_name='Размер файла, байт')),
+                ('archived_at', models.DateTimeField(auto_now_add=True, verbose_name='Время архивации')),
+                ('purged_at', models.DateTimeField(blank=True, null=True, verbose_name='Время удаления из базы')),
+                ('enterprise', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_months', to='park.enterprise', verbose_name='Предприятие')),
+            ],
+            options={
+                'verbose_name': 'Архив точек за месяц',
+                'verbose_name_plural': 'Архивы точек за месяц',
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedTrack',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_ts', models.DateTimeField(verbose_name='Время первой точки')),
+                ('last_ts', models.DateTimeField(verbose_name='Время последней точки')),
+                ('point_count', models.IntegerField(default=0, verbose_name='Количество точек')),
+                ('archive', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tracks', to='park.archivedmonth', verbose_name='Архив')),
+                ('vehicle', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_tracks', to='park.vehicle', verbose_name='Транспортное средство')),
+            ],
+            options={
+                'verbose_name': 'Архивный трек',
+                'verbose_name_plural': 'Архивные треки',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='archivedmonth',
+            constraint=models.UniqueConstraint(fields=('enterprise', 'month'), name='park_archivedmonth_enterprise_month'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedtrack',
+            index=models.Index(fields=['vehicle', 'first_ts'], name='park_archivedtrack_vehicle_ts'),
+        ),
+    ]
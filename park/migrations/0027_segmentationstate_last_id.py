@@ -0,0 +1,18 @@
+# Generated by Django 4.1.7 on 2023-05-04 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('park', '0026_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='segmentationstate',
+            name='last_id',
+            field=models.BigIntegerField(blank=True, null=True, verbose_name='id последней обработанной точки'),
+        ),
+    ]
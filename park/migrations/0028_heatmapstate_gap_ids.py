@@ -0,0 +1,23 @@
+# Generated by Django 4.1.7 on 2023-05-04 11:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('park', '0027_segmentationstate_last_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='heatmapstate',
+            name='gap_ids',
+            field=models.JSONField(blank=True, default=list, verbose_name='Пропущенные id'),
+        ),
+        migrations.AddField(
+            model_name='heatmapstate',
+            name='late_point_count',
+            field=models.BigIntegerField(default=0, verbose_name='Дописано опоздавших точек'),
+        ),
+    ]
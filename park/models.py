@@ -2,7 +2,7 @@ import pytz
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator, MaxValueValidator
-from django.db import models
+from django.db import connections, models
 from django.urls import reverse
 from django.utils import timezone
 from django.utils.timezone import now
@@ -153,16 +153,68 @@ class Manager(models.Model):
         return self.user.username
 
 
+class RoutePointQuerySet(models.QuerySet):
+
+    def delete_without_signals(self, chunk_size=2000):
+        """
+        Удаление обычными DELETE по первичному ключу, по chunk_size точек на запрос, без загрузки точек
+        и сигналов post_delete на каждую из них. Для массовых удалений (прореживание, архивация),
+        которые сами сбрасывают кэши по своим окнам. Возвращает число удалённых точек.
+        """
+        connection = connections[self.db]
+        sql = 'DELETE FROM {0} WHERE {1} IN ({{0}})'.format(
+            connection.ops.quote_name(self.model._meta.db_table), connection.ops.quote_name(self.model._meta.pk.column))
+        ids = list(self.values_list('pk', flat=True))
+        deleted = 0
+        with connection.cursor() as cursor:
+            for start in range(0, len(ids), chunk_size):
+                chunk = ids[start:start + chunk_size]
+                cursor.execute(sql.format(', '.join(['%s'] * len(chunk))), chunk)
+                deleted += cursor.rowcount
+        return deleted
+
+
 class RoutePoint(geo_models.Model):
     vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE, null=False, blank=False,
                                 related_name='routepoints', verbose_name='Транспортное средство')
     point = geo_models.PointField(verbose_name='Точка на карте')
     datetime = models.DateTimeField(verbose_name='Время прохождения точки маршрута')
+    # Отдельный индекс по travel не нужен: его покрывает составной (travel, datetime)
+    travel = models.ForeignKey('Travel', on_delete=models.SET_NULL, null=True, blank=True, db_index=False,
+                               related_name='routepoints', verbose_name='Поездка')
+
+    RAW = 0
+    DOWNSAMPLED = 1
+    TIERS = (
+        (RAW, 'Исходная'),
+        (DOWNSAMPLED, 'Прореженная'),
+    )
+    # Старые сутки прореживаются (park.retention): оставшиеся точки помечаются DOWNSAMPLED и лежат
+    # в той же таблице, поэтому выборки треков читают их без изменений
+    tier = models.SmallIntegerField(choices=TIERS, default=RAW, verbose_name='Уровень детализации')
+
+    objects = RoutePointQuerySet.as_manager()
 
     class Meta:
-        ordering = ['vehicle']
+        # Без ordering по умолчанию: все выборки точек идут по (vehicle, datetime) и сортируются по времени явно
         verbose_name = 'Точка маршрута'
         verbose_name_plural = 'Точки маршрута'
+        indexes = [
+            models.Index(fields=['vehicle', 'datetime'], name='park_routepoint_vehicle_dt'),
+            models.Index(fields=['travel', 'datetime'], name='park_routepoint_travel_dt'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Время и координаты на момент чтения: сигнал сохранения сбрасывает кэши, только если они изменились
+        instance.loaded_track = instance.get_track_values()
+        return instance
+
+    def get_track_values(self):
+        # Через __dict__, чтобы не дочитывать отложенные (defer/only) поля
+        point = self.__dict__.get('point')
+        return self.__dict__.get('datetime'), getattr(point, 'coords', point)
 
     def __str__(self):
         return str(self.vehicle_id) + '' + str(self.point) + '' + str(self.datetime)
@@ -176,6 +228,16 @@ class Travel(models.Model):
                                 verbose_name='Автомобиль, на котором произошла поездка')
     begin = models.DateTimeField(verbose_name='Начало поездки')
     end = models.DateTimeField(verbose_name='Окончание поездки')
+    # Сводка по точкам поездки считается один раз при её закрытии (park.summaries), списки и отчёты
+    # берут её отсюда, не читая RoutePoint. summarized_at пуст, пока сводка не посчитана
+    distance_km = models.FloatField(null=True, blank=True, verbose_name='Пройденное расстояние, км')
+    point_count = models.IntegerField(default=0, verbose_name='Количество точек маршрута')
+    max_speed_kmh = models.FloatField(null=True, blank=True, verbose_name='Максимальная скорость, км/ч')
+    bbox = geo_models.PolygonField(null=True, blank=True, spatial_index=False,
+                                   verbose_name='Охватывающий прямоугольник')
+    start_point = geo_models.PointField(null=True, blank=True, spatial_index=False, verbose_name='Точка начала')
+    end_point = geo_models.PointField(null=True, blank=True, spatial_index=False, verbose_name='Точка окончания')
+    summarized_at = models.DateTimeField(null=True, blank=True, verbose_name='Время расчёта сводки')
 
     class Meta:
         ordering = ['vehicle']
@@ -188,6 +250,259 @@ class Travel(models.Model):
     def name(self):
         return '{0} - {1}'.format(self.begin.strftime("%Y-%m-%d %H:%M:%S"), self.end.strftime("%Y-%m-%d %H:%M:%S"))
 
+    @property
+    def duration(self):
+        return self.end - self.begin
+
+
+class DailyMileage(models.Model):
+    vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE, null=False, blank=False,
+                                related_name='daily_mileage', verbose_name='Транспортное средство')
+    day = models.DateField(verbose_name='День (UTC)')
+    km = models.FloatField(default=0, verbose_name='Пробег за день, км')
+    point_count = models.IntegerField(default=0, verbose_name='Количество точек маршрута')
+    first_ts = models.DateTimeField(verbose_name='Время первой точки')
+    last_ts = models.DateTimeField(verbose_name='Время последней точки')
+
+    class Meta:
+        ordering = ['vehicle', 'day']
+        verbose_name = 'Суточный пробег'
+        verbose_name_plural = 'Суточные пробеги'
+        constraints = [
+            models.UniqueConstraint(fields=['vehicle', 'day'], name='park_dailymileage_vehicle_day'),
+        ]
+
+    def __str__(self):
+        return '{0} {1}: {2} км'.format(self.vehicle_id, self.day, round(self.km, 2))
+
+
+class ReportJob(models.Model):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+    STATUSES = (
+        (PENDING, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Готов'),
+        (FAILED, 'Ошибка'),
+        (CANCELLED, 'Отменён'),
+    )
+    ACTIVE_STATUSES = (PENDING, RUNNING)
+
+    VEHICLE = 'vehicle'
+    ENTERPRISE = 'enterprise'
+    SCOPES = (
+        (VEHICLE, 'Автомобиль'),
+        (ENTERPRISE, 'Предприятие'),
+    )
+
+    key = models.CharField(max_length=64, db_index=True, verbose_name='Ключ параметров отчёта')
+    # Заполнен, пока задача в очереди или выполняется: уникальность не даёт запустить два одинаковых расчёта
+    active_key = models.CharField(max_length=64, unique=True, null=True, blank=True,
+                                  verbose_name='Ключ активной задачи')
+    scope = models.CharField(choices=SCOPES, max_length=10, verbose_name='По чему строится отчёт')
+    owner_id = models.BigIntegerField(verbose_name='Автомобиль или предприятие')
+    report_type = models.IntegerField(verbose_name='Тип отчёта')
+    begin = models.DateTimeField(verbose_name='Начало отчёта')
+    end = models.DateTimeField(verbose_name='Окончание отчёта')
+    status = models.CharField(choices=STATUSES, max_length=10, default=PENDING, verbose_name='Состояние')
+    result = models.JSONField(null=True, blank=True, verbose_name='Результат')
+    error = models.TextField(blank=True, default='', verbose_name='Ошибка')
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True,
+                                   related_name='report_jobs', verbose_name='Автор')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Создана')
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name='Начата')
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name='Завершена')
+
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = 'Задача на отчёт'
+        verbose_name_plural = 'Задачи на отчёты'
+
+    def __str__(self):
+        return '{0} {1} ({2})'.format(self.scope, self.owner_id, self.status)
+
+
+class SegmentationState(models.Model):
+    # Где остановилась нарезка поездок по точкам машины: следующий запуск продолжает после (last_ts, last_id)
+    vehicle = models.OneToOneField(Vehicle, on_delete=models.CASCADE, primary_key=True,
+                                   related_name='segmentation_state', verbose_name='Транспортное средство')
+    last_ts = models.DateTimeField(null=True, blank=True, verbose_name='Время последней обработанной точки')
+    last_id = models.BigIntegerField(null=True, blank=True, verbose_name='id последней обработанной точки')
+    last_lat = models.FloatField(null=True, blank=True)
+    last_lon = models.FloatField(null=True, blank=True)
+    # Место, где машина, возможно, стоит с anchor_ts
+    anchor_ts = models.DateTimeField(null=True, blank=True, verbose_name='Начало возможной стоянки')
+    anchor_lat = models.FloatField(null=True, blank=True)
+    anchor_lon = models.FloatField(null=True, blank=True)
+    travel = models.ForeignKey(Travel, on_delete=models.SET_NULL, null=True, blank=True, related_name='+',
+                               verbose_name='Незакрытая поездка')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Обновлено')
+
+    class Meta:
+        verbose_name = 'Состояние нарезки поездок'
+        verbose_name_plural = 'Состояния нарезки поездок'
+
+    def __str__(self):
+        return '{0}: {1}'.format(self.vehicle_id, self.last_ts)
+
+
+class GeocodeCache(models.Model):
+    # Координаты хранятся номером ячейки сетки: round(lat * 10 ** digits), чтобы сравнение было точным
+    provider = models.CharField(max_length=50, verbose_name='Сервис геокодирования')
+    digits = models.SmallIntegerField(verbose_name='Знаков после запятой в ячейке сетки')
+    lat_key = models.IntegerField(verbose_name='Широта ячейки')
+    lon_key = models.IntegerField(verbose_name='Долгота ячейки')
+    address = models.TextField(blank=True, default='', verbose_name='Адрес')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Получен')
+
+    class Meta:
+        verbose_name = 'Адрес точки'
+        verbose_name_plural = 'Адреса точек'
+        constraints = [
+            models.UniqueConstraint(fields=['provider', 'digits', 'lat_key', 'lon_key'],
+                                    name='park_geocodecache_cell'),
+        ]
+
+    def __str__(self):
+        return self.address
+
+
+class VehiclePosition(models.Model):
+    # Последняя известная точка машины, обновляется на всех путях записи RoutePoint (park.positions)
+    vehicle = models.OneToOneField(Vehicle, on_delete=models.CASCADE, primary_key=True, related_name='position',
+                                   verbose_name='Транспортное средство')
+    point = geo_models.PointField(spatial_index=False, verbose_name='Точка на карте')
+    datetime = models.DateTimeField(verbose_name='Время точки')
+    speed_kmh = models.FloatField(null=True, blank=True, verbose_name='Скорость, км/ч')
+    updated_at = models.DateTimeField(auto_now=True, db_index=True, verbose_name='Обновлено')
+
+    class Meta:
+        verbose_name = 'Текущее положение'
+        verbose_name_plural = 'Текущие положения'
+
+    def __str__(self):
+        return '{0}: {1}'.format(self.vehicle_id, self.datetime)
+
+
+class HeatmapTile(models.Model):
+    # Плотность точек маршрута в тайле XYZ за сутки (UTC): сетка bins x bins счётчиков uint32,
+    # сжатая zlib (см. park.heatmap)
+    enterprise = models.ForeignKey(Enterprise, on_delete=models.CASCADE, related_name='heatmap_tiles',
+                                   verbose_name='Предприятие')
+    day = models.DateField(verbose_name='День (UTC)')
+    zoom = models.SmallIntegerField(verbose_name='Масштаб')
+    x = models.IntegerField()
+    y = models.IntegerField()
+    counts = models.BinaryField(verbose_name='Счётчики ячеек')
+    total = models.BigIntegerField(default=0, verbose_name='Всего точек')
+
+    class Meta:
+        verbose_name = 'Тайл тепловой карты'
+        verbose_name_plural = 'Тайлы тепловой карты'
+        constraints = [
+            models.UniqueConstraint(fields=['enterprise', 'zoom', 'x', 'y', 'day'], name='park_heatmaptile_tile_day'),
+        ]
+
+    def __str__(self):
+        return '{0} {1}/{2}/{3} {4}'.format(self.enterprise_id, self.zoom, self.x, self.y, self.day)
+
+
+class HeatmapState(models.Model):
+    # Точки с id не больше last_point_id уже разложены по тайлам, кроме gap_ids - id, которых не было
+    # в таблице при разборе (их транзакция могла ещё не закоммититься). late_point_count - сколько
+    # таких точек дописано позже, вместе с last_point_id определяет версию тайлов
+    last_point_id = models.BigIntegerField(default=0, verbose_name='Последняя обработанная точка')
+    gap_ids = models.JSONField(default=list, blank=True, verbose_name='Пропущенные id')
+    late_point_count = models.BigIntegerField(default=0, verbose_name='Дописано опоздавших точек')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Обновлено')
+
+    class Meta:
+        verbose_name = 'Состояние тепловой карты'
+        verbose_name_plural = 'Состояние тепловой карты'
+
+    def __str__(self):
+        return str(self.last_point_id)
+
+
+class RetentionState(models.Model):
+    # Точки раньше downsampled_before прорежены; пробеги и сводки поездок за это время
+    # больше не пересчитываются по точкам. running_since - метка запущенного прореживания
+    downsampled_before = models.DateTimeField(null=True, blank=True, verbose_name='Прорежено до')
+    # Точки раньше archived_before перенесены из RoutePoint в архивные файлы (park.archive)
+    archived_before = models.DateTimeField(null=True, blank=True, verbose_name='В архиве до')
+    running_since = models.DateTimeField(null=True, blank=True, verbose_name='Выполняется с')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Обновлено')
+
+    class Meta:
+        verbose_name = 'Состояние прореживания точек'
+        verbose_name_plural = 'Состояние прореживания точек'
+
+    def __str__(self):
+        return str(self.downsampled_before)
+
+    @classmethod
+    def get_downsampled_before(cls):
+        return cls.objects.values_list('downsampled_before', flat=True).first()
+
+    @classmethod
+    def get_archived_before(cls):
+        return cls.objects.values_list('archived_before', flat=True).first()
+
+    @classmethod
+    def get_history_before(cls):
+        """Раньше этого момента точки в RoutePoint уже не полные: прорежены или перенесены в архив."""
+        bounds = cls.objects.values_list('downsampled_before', 'archived_before').first() or ()
+        bounds = [bound for bound in bounds if bound is not None]
+        return max(bounds) if bounds else None
+
+
+class ArchivedMonth(models.Model):
+    # Точки маршрута машин предприятия за календарный месяц (UTC), перенесённые в файл archive_path
+    # относительно settings.ARCHIVE_ROOT. purged_at пуст, пока точки не удалены из RoutePoint
+    enterprise = models.ForeignKey(Enterprise, on_delete=models.CASCADE, related_name='archived_months',
+                                   verbose_name='Предприятие')
+    month = models.DateField(verbose_name='Месяц')
+    archive_path = models.CharField(max_length=255, verbose_name='Файл')
+    point_count = models.BigIntegerField(default=0, verbose_name='Количество точек')
+    size_bytes = models.BigIntegerField(default=0, verbose_name='Размер файла, байт')
+    archived_at = models.DateTimeField(auto_now_add=True, verbose_name='Время архивации')
+    purged_at = models.DateTimeField(null=True, blank=True, verbose_name='Время удаления из базы')
+
+    class Meta:
+        verbose_name = 'Архив точек за месяц'
+        verbose_name_plural = 'Архивы точек за месяц'
+        constraints = [
+            models.UniqueConstraint(fields=['enterprise', 'month'], name='park_archivedmonth_enterprise_month'),
+        ]
+
+    def __str__(self):
+        return '{0} {1:%Y-%m}'.format(self.enterprise_id, self.month)
+
+
+class ArchivedTrack(models.Model):
+    # По какому файлу искать точки машины: машина могла сменить предприятие, поэтому не по её текущему
+    archive = models.ForeignKey(ArchivedMonth, on_delete=models.CASCADE, related_name='tracks',
+                                verbose_name='Архив')
+    vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE, related_name='archived_tracks',
+                                verbose_name='Транспортное средство')
+    first_ts = models.DateTimeField(verbose_name='Время первой точки')
+    last_ts = models.DateTimeField(verbose_name='Время последней точки')
+    point_count = models.IntegerField(default=0, verbose_name='Количество точек')
+
+    class Meta:
+        verbose_name = 'Архивный трек'
+        verbose_name_plural = 'Архивные треки'
+        indexes = [
+            models.Index(fields=['vehicle', 'first_ts'], name='park_archivedtrack_vehicle_ts'),
+        ]
+
+    def __str__(self):
+        return '{0}: {1} - {2}'.format(self.vehicle_id, self.first_ts, self.last_ts)
+
+
 # class Report(models.model):
 #
 #     TYPES = (
@@ -0,0 +1,37 @@
+import codecs
+import csv
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+
+class RoutePointCSVParser(BaseParser):
+    """
+    Пачка точек в CSV: строка заголовка с именами колонок (vehicle_id, lon, lat, ts), дальше по строке на точку.
+    Возвращает словарь колонок-списков, как и JSON-вариант {"vehicle_id": [...], "lon": [...], ...}.
+    """
+    media_type = 'text/csv'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        try:
+            reader = csv.reader(codecs.getreader(encoding)(stream))
+            header = next(reader, None)
+            if header is None:
+                return {}
+            header = [name.strip() for name in header]
+            columns = {name: [] for name in header}
+            appends = [columns[name].append for name in header]
+            for row in reader:
+                if not row:
+                    continue
+                if len(row) != len(header):
+                    # Строка с неверным числом полей не должна сдвигать колонки - отмечаем её пустыми значениями
+                    row = [''] * len(header)
+                for append, value in zip(appends, row):
+                    append(value)
+            return columns
+        except (UnicodeDecodeError, csv.Error) as exc:
+            raise ParseError('CSV parse error - %s' % str(exc))
@@ -0,0 +1,74 @@
+from django.contrib.gis.geos import Point
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .distance import total_distance
+from .models import RoutePoint, VehiclePosition
+
+
+def get_speed_kmh(previous_dt, previous_point, point_dt, point):
+    hours = (point_dt - previous_dt).total_seconds() / 3600
+    if hours <= 0:
+        return None
+    return total_distance([previous_point.y, point.y], [previous_point.x, point.x]) / hours
+
+
+def update_positions(route_points):
+    """
+    Обновляет последние известные положения машин по пачке новых точек. Положения всех машин пачки
+    читаются одним запросом под блокировкой; запоздавшие точки (старше сохранённого положения) не учитываются.
+    """
+    latest, previous = {}, {}
+    for route_point in sorted(route_points, key=lambda route_point: route_point.datetime):
+        if route_point.vehicle_id in latest:
+            previous[route_point.vehicle_id] = latest[route_point.vehicle_id]
+        latest[route_point.vehicle_id] = route_point
+    if not latest:
+        return 0
+
+    with transaction.atomic():
+        positions = VehiclePosition.objects.select_for_update().in_bulk(latest.keys())
+        created, updated = [], []
+        for vehicle_id, route_point in latest.items():
+            position = positions.get(vehicle_id)
+            if position is not None and position.datetime >= route_point.datetime:
+                continue
+            before = previous.get(vehicle_id)
+            if before is not None:
+                speed = get_speed_kmh(before.datetime, before.point, route_point.datetime, route_point.point)
+            elif position is not None:
+                speed = get_speed_kmh(position.datetime, position.point, route_point.datetime, route_point.point)
+            else:
+                speed = None
+
+            point = Point(route_point.point.x, route_point.point.y, srid=4326)
+            if position is None:
+                created.append(VehiclePosition(vehicle_id=vehicle_id, point=point, datetime=route_point.datetime,
+                                               speed_kmh=speed))
+            else:
+                position.point = point
+                position.datetime = route_point.datetime
+                position.speed_kmh = speed
+                updated.append(position)
+        VehiclePosition.objects.bulk_create(created, ignore_conflicts=True)
+        # bulk_update не вызывает auto_now, поэтому updated_at задаётся явно
+        now = timezone.now()
+        for position in updated:
+            position.updated_at = now
+        VehiclePosition.objects.bulk_update(updated, ['point', 'datetime', 'speed_kmh', 'updated_at'])
+    return len(created) + len(updated)
+
+
+def rebuild_positions(vehicle_ids=None):
+    """Заполняет положения по последним точкам, например после удаления точек или для старых данных."""
+    latest = RoutePoint.objects.values('vehicle_id').annotate(max_dt=Max('datetime'))
+    if vehicle_ids is not None:
+        latest = latest.filter(vehicle_id__in=vehicle_ids)
+    count = 0
+    for row in latest.iterator():
+        route_points = list(RoutePoint.objects.filter(vehicle_id=row['vehicle_id'], datetime__lte=row['max_dt'])
+                            .order_by('-datetime')[:2])
+        VehiclePosition.objects.filter(vehicle_id=row['vehicle_id']).delete()
+        count += update_positions(route_points)
+    return count
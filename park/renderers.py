@@ -0,0 +1,28 @@
+from rest_framework.renderers import JSONRenderer, BaseRenderer
+
+from .encoding import TrackColumns, to_polyline_data, to_binary
+
+
+class PolylineRenderer(JSONRenderer):
+    """Трек как Google Encoded Polyline и дельты времени. Выбирается по ?format=polyline или Accept."""
+    media_type = 'application/vnd.autopark.polyline+json'
+    format = 'polyline'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, TrackColumns):
+            data = to_polyline_data(data)
+        return super().render(data, accepted_media_type, renderer_context)
+
+
+class BinaryTrackRenderer(BaseRenderer):
+    """Трек как колонки float64/int64 little-endian, см. park.encoding.to_binary."""
+    media_type = 'application/vnd.autopark.track'
+    format = 'binary'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, TrackColumns):
+            return to_binary(data)
+        # Ошибки отдаются обычным JSON
+        return JSONRenderer().render(data, accepted_media_type, renderer_context)
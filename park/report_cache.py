@@ -0,0 +1,142 @@
+import datetime
+import hashlib
+import os
+
+from django.core.cache import caches
+from django.utils import timezone
+
+from autopark import settings
+
+VEHICLE = 'vehicle'
+ENTERPRISE = 'enterprise'
+
+
+class ReportCache:
+    """
+    Кэш посчитанных отчётов. Запись ищется по (машина или предприятие, вариант расчёта, начало, конец)
+    и версиям суток окна: у каждого владельца на каждые сутки UTC свой счётчик в кэше.
+    Изменение точек или поездок увеличивает счётчики затронутых суток, поэтому отчёты, в окно которых
+    попало изменение, больше не находятся, а их записи уходят по времени жизни.
+    Вариант для отчётов - их тип, для упрощённых треков - допуск или зум.
+    Счётчики общие для всех процессов только в общем кэше (Redis, Memcached): с кэшем в памяти процесса
+    приём точек в одном процессе не сбрасывал бы отчёты в другом, это проверяет park.checks.
+    """
+
+    def __init__(self, alias, prefix='report', timeout=None, enabled=True):
+        self.alias = alias
+        self.prefix = prefix
+        self.timeout = timeout
+        self.enabled = enabled
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    @staticmethod
+    def normalize(dt):
+        # Наивные даты ORM трактует в TIME_ZONE проекта, окна кэша должны совпадать с ними
+        if timezone.is_naive(dt):
+            return timezone.make_aware(dt, timezone.get_default_timezone())
+        return dt
+
+    def make_key(self, scope, owner_id, variant, begin, end):
+        """Ключ запроса без версий: по нему же задачи на отчёты (park.jobs) находят одинаковые запросы."""
+        begin, end = self.normalize(begin), self.normalize(end)
+        raw = '{0}:{1}:{2}:{3}:{4}'.format(scope, owner_id, variant, begin.isoformat(), end.isoformat())
+        return '{0}:{1}'.format(self.prefix, hashlib.md5(raw.encode()).hexdigest())
+
+    def make_version_keys(self, scope, owner_id, begin, end):
+        begin = self.normalize(begin).astimezone(datetime.timezone.utc).date()
+        end = self.normalize(end).astimezone(datetime.timezone.utc).date()
+        return ['{0}:version:{1}:{2}:{3}'.format(self.prefix, scope, owner_id, begin + datetime.timedelta(days=days))
+                for days in range((end - begin).days + 1)]
+
+    def get_versions(self, version_keys):
+        versions = self.cache.get_many(version_keys)
+        missing = [key for key in version_keys if key not in versions]
+        if missing:
+            # Новый счётчик начинается со случайного значения: если старый был вытеснен из кэша, записи,
+            # сохранённые при его прежних значениях, не найдутся снова
+            for key in missing:
+                self.cache.add(key, int.from_bytes(os.urandom(6), 'little'), timeout=None)
+            versions.update(self.cache.get_many(missing))
+        return [versions.get(key) for key in version_keys]
+
+    def make_entry_key(self, scope, owner_id, variant, begin, end):
+        versions = self.get_versions(self.make_version_keys(scope, owner_id, begin, end))
+        raw = '{0}:{1}'.format(self.make_key(scope, owner_id, variant, begin, end), ','.join(map(str, versions)))
+        return '{0}:entry:{1}'.format(self.prefix, hashlib.md5(raw.encode()).hexdigest())
+
+    def get(self, scope, owner_id, variant, begin, end):
+        if not self.enabled:
+            return None
+        data = self.cache.get(self.make_entry_key(scope, owner_id, variant, begin, end))
+        self.count('hits' if data is not None else 'misses')
+        return data
+
+    def get_or_set(self, scope, owner_id, variant, begin, end, compute):
+        if not self.enabled:
+            return compute()
+        # Версии читаются до расчёта: если данные окна изменятся во время расчёта, результат ляжет
+        # под старыми версиями, и его никто не прочитает
+        key = self.make_entry_key(scope, owner_id, variant, begin, end)
+        data = self.cache.get(key)
+        self.count('hits' if data is not None else 'misses')
+        if data is None:
+            data = compute()
+            self.cache.set(key, data, timeout=self.timeout)
+        return data
+
+    def invalidate(self, scope, owner_id, begin, end):
+        """Сбрасывает отчёты владельца, окно которых пересекается с [begin, end]. Возвращает число суток."""
+        if not self.enabled:
+            return 0
+        count = 0
+        for key in self.make_version_keys(scope, owner_id, begin, end):
+            try:
+                self.cache.incr(key)
+            except ValueError:
+                # Счётчика нет - нет и записей с ним: новый счётчик начнётся с другого значения
+                continue
+            count += 1
+        return count
+
+    def invalidate_vehicle(self, vehicle_id, enterprise_id, begin, end):
+        count = self.invalidate(VEHICLE, vehicle_id, begin, end)
+        if enterprise_id is not None:
+            count += self.invalidate(ENTERPRISE, enterprise_id, begin, end)
+        return count
+
+    def invalidate_vehicles(self, vehicle_ids, begin, end):
+        """То же для набора машин (None - для всех), предприятия подтягиваются одним запросом."""
+        from .models import Vehicle
+
+        vehicles = Vehicle.objects.all() if vehicle_ids is None else Vehicle.objects.filter(id__in=vehicle_ids)
+        return sum(self.invalidate_vehicle(vehicle_id, enterprise_id, begin, end)
+                   for vehicle_id, enterprise_id in vehicles.values_list('id', 'enterprise_id'))
+
+    def count(self, name):
+        key = '{0}:stats:{1}'.format(self.prefix, name)
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            if not self.cache.add(key, 1, timeout=None):
+                self.cache.incr(key)
+
+    def stats(self):
+        values = self.cache.get_many(['{0}:stats:hits'.format(self.prefix), '{0}:stats:misses'.format(self.prefix)])
+        hits = values.get('{0}:stats:hits'.format(self.prefix), 0)
+        misses = values.get('{0}:stats:misses'.format(self.prefix), 0)
+        return {
+            'enabled': self.enabled,
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': round(hits / (hits + misses), 4) if hits + misses else None,
+        }
+
+
+report_cache = ReportCache(settings.REPORT_CACHE_ALIAS, timeout=settings.REPORT_CACHE_TIMEOUT,
+                           enabled=settings.REPORT_CACHE_ENABLED)
+track_cache = ReportCache(settings.REPORT_CACHE_ALIAS, prefix='track', timeout=settings.REPORT_CACHE_TIMEOUT,
+                          enabled=settings.REPORT_CACHE_ENABLED)
+caches_by_window = (report_cache, track_cache)
@@ -1,13 +1,21 @@
+import multiprocessing
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
 from enum import Enum
+
+import django
 from django.db.models import Min, Max
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, time, timezone
 from dateutil import relativedelta
 from pprint import pprint
-from geopy.distance import geodesic
-from itertools import pairwise
+import numpy as np
 import requests
 
-from .models import Vehicle, Travel, RoutePoint, Enterprise
+from autopark import settings
+from .distance import total_distance
+from .models import Vehicle, Travel, Enterprise, DailyMileage, RetentionState
+from .tracks import VehicleTrack, iter_vehicles_points
 
 
 class Report:
@@ -22,74 +30,265 @@ class Report:
         self.begin_report_dt = begin_report_dt
         self.finish_report_dt = finish_report_dt
 
+    def get_time_delta(self):
+        if self.type == self.ReportType.DAILY:
+            return relativedelta.relativedelta(days=1)
+        elif self.type == self.ReportType.MONTHLY:
+            return relativedelta.relativedelta(months=1)
+        return relativedelta.relativedelta(years=1)
+
+    def get_period_start(self, dt):
+        dt = dt.replace(hour=0, minute=0, second=0, microsecond=0)
+        if self.type == self.ReportType.MONTHLY:
+            dt = dt.replace(day=1)
+        elif self.type == self.ReportType.YEARLY:
+            dt = dt.replace(month=1, day=1)
+        return dt
+
+
+class ReportCancelled(Exception):
+    pass
+
 
 class TrackReport(Report):
+    # Сколько строк забирать из курсора за один раз
+    chunk_size = 2000
 
-    def __init__(self, report_type, begin_report_dt, finish_report_dt):
+    def __init__(self, report_type, begin_report_dt, finish_report_dt, is_cancelled=None):
         super().__init__(report_type, begin_report_dt, finish_report_dt)
+        # Вызывается раз в chunk_size точек: если вернул True, расчёт прерывается ReportCancelled
+        self.is_cancelled = is_cancelled
 
-    def generate_full_enterprise_report(self, enterprise_id):
+    def check_cancelled(self, route_points):
+        if self.is_cancelled is None:
+            yield from route_points
+            return
+        for number, route_point in enumerate(route_points):
+            if number % self.chunk_size == 0 and self.is_cancelled():
+                raise ReportCancelled()
+            yield route_point
 
+    def generate_full_enterprise_report(self, enterprise_id, workers=None):
+        """
+        Отчёт по всем машинам предприятия: поездки и точки забираются несколькими общими запросами,
+        а пробег по каждой машине считается в пуле процессов.
+        """
         enterprise = Enterprise.objects.get(pk=enterprise_id)
-        vehicles = Vehicle.objects.filter(enterprise=enterprise)
+        vehicles = Vehicle.objects.filter(enterprise=enterprise).select_related('manufacturer', 'model')
+        vehicle_names = {vehicle.id: str(vehicle) for vehicle in vehicles}
 
-        report_data = {}
-        for vehicle in vehicles:
-            data = self.generate_report(vehicle.id)
-            if data:
-                report_data[str(vehicle)] = data
+        windows = {
+            row['vehicle_id']: (row['min_dt'], row['max_dt'])
+            for row in Travel.objects.filter(
+                vehicle__enterprise=enterprise,
+                begin__gt=self.begin_report_dt,
+                end__lt=self.finish_report_dt
+            ).values('vehicle_id').annotate(min_dt=Min('begin'), max_dt=Max('end'))
+        }
+        if not windows:
+            return {}
+
+        if self.type != self.ReportType.DAILY:
+            results = self.get_enterprise_rollup_rows(windows)
+            return {name: results[vehicle_id] for vehicle_id, name in vehicle_names.items() if results.get(vehicle_id)}
+
+        rollup_results = {}
+        downsampled_before = RetentionState.get_downsampled_before()
+        if downsampled_before is not None:
+            # Прореженные сутки - по суточным агрегатам: по оставшимся точкам пробег вышел бы меньше
+            rollup_results = self.get_enterprise_rollup_rows({
+                vehicle_id: (min_dt, min(max_dt, downsampled_before))
+                for vehicle_id, (min_dt, max_dt) in windows.items() if min_dt < downsampled_before
+            })
+            windows = {vehicle_id: (max(min_dt, downsampled_before), max_dt)
+                       for vehicle_id, (min_dt, max_dt) in windows.items() if max_dt > downsampled_before}
+            if not windows:
+                return {name: rollup_results[vehicle_id] for vehicle_id, name in vehicle_names.items()
+                        if rollup_results.get(vehicle_id)}
+
+        # Точки из таблицы и из архива одним упорядоченным по (vehicle_id, datetime) потоком
+        route_points = self.check_cancelled(iter_vehicles_points(
+            sorted(windows.keys()),
+            min(min_dt for min_dt, _ in windows.values()),
+            max(max_dt for _, max_dt in windows.values()),
+            chunk_size=self.chunk_size
+        ))
 
+        workers = settings.REPORT_WORKERS if workers is None else workers
+        results = {}
+        if workers > 1:
+            # В очереди пула не больше двух треков на процесс, остальные ещё не прочитаны из курсора
+            executor = get_report_executor(workers)
+            pending = deque()
+            for vehicle_id, track in self.group_by_vehicle(route_points, windows):
+                pending.append((vehicle_id, executor.submit(get_vehicle_mileage_rows, self.type.value,
+                                                            *windows[vehicle_id], *track)))
+                if len(pending) >= workers * 2:
+                    vehicle_id, future = pending.popleft()
+                    results[vehicle_id] = future.result()
+            for vehicle_id, future in pending:
+                results[vehicle_id] = future.result()
+        else:
+            for vehicle_id, track in self.group_by_vehicle(route_points, windows):
+                results[vehicle_id] = get_vehicle_mileage_rows(self.type.value, *windows[vehicle_id], *track)
+
+        report_data = {}
+        for vehicle_id, name in vehicle_names.items():
+            rows = rollup_results.get(vehicle_id, []) + results.get(vehicle_id, [])
+            if rows:
+                report_data[name] = rows
         return report_data
 
+    def get_enterprise_rollup_rows(self, windows):
+        daily_rows = DailyMileage.objects.filter(
+            vehicle_id__in=windows.keys(),
+            day__gte=min(min_dt for min_dt, _ in windows.values()).date(),
+            day__lte=max(max_dt for _, max_dt in windows.values()).date()
+        ).order_by('vehicle_id', 'day').values_list('vehicle_id', 'day', 'km', 'point_count')
+
+        tracks = defaultdict(list)
+        for vehicle_id, day, km, point_count in daily_rows:
+            min_dt, max_dt = windows[vehicle_id]
+            if min_dt.date() <= day <= max_dt.date():
+                tracks[vehicle_id].append((day, km, point_count))
+        return {vehicle_id: self.get_rollup_rows(rows, *windows[vehicle_id]) for vehicle_id, rows in tracks.items()}
+
+    @staticmethod
+    def group_by_vehicle(route_points, windows):
+        """Разбивает упорядоченный по (vehicle_id, datetime) поток точек на треки отдельных машин."""
+        current_id = None
+        datetimes, lats, lons = [], [], []
+        for vehicle_id, point_dt, lat, lon in route_points:
+            if vehicle_id != current_id:
+                if datetimes:
+                    yield current_id, (datetimes, np.array(lats), np.array(lons))
+                current_id = vehicle_id
+                datetimes, lats, lons = [], [], []
+            min_dt, max_dt = windows[vehicle_id]
+            if min_dt < point_dt < max_dt:
+                datetimes.append(point_dt)
+                lats.append(lat)
+                lons.append(lon)
+        if datetimes:
+            yield current_id, (datetimes, np.array(lats), np.array(lons))
+
     def generate_report(self, vehicle_id):
         if self.type not in self.ReportType:
             self.stdout.write(self.style.ERROR('Illegal report type was sent. Change to daily.'))
             self.type = self.ReportType.DAILY
 
-        vehicle = Vehicle.objects.get(pk=vehicle_id)
-        # print('Got vehicle: {0}!'.format(vehicle))
-
-        travels = Travel.objects.filter(
-                vehicle=vehicle,
+        dates = Travel.objects.filter(
+                vehicle_id=vehicle_id,
                 begin__gt=self.begin_report_dt,
                 end__lt=self.finish_report_dt
-            )
-        # print('Got travels: {0}!'.format(travels))
-        if len(travels) == 0:
+            ).aggregate(min_dt=Min('begin'), max_dt=Max('end'))
+        if dates['min_dt'] is None:
             return {}
 
-        vehicle_with_dates = travels.values('vehicle_id').annotate(min_dt=Min('begin'), max_dt=Max('end'))
-        # print('Got vehicle with dates: {0}!'.format(vehicle_with_dates))
+        if self.type != self.ReportType.DAILY:
+            # Месячные и годовые отчёты собираются из суточных агрегатов, сырые точки не читаются
+            return self.get_vehicle_rollup_rows(vehicle_id, dates['min_dt'], dates['max_dt'])
+
+        report_data = []
+        min_dt = dates['min_dt']
+        downsampled_before = RetentionState.get_downsampled_before()
+        if downsampled_before is not None and min_dt < downsampled_before:
+            # Прореженные сутки - по суточным агрегатам: по оставшимся точкам пробег вышел бы меньше
+            rollup_end = min(dates['max_dt'], downsampled_before)
+            report_data = self.get_vehicle_rollup_rows(vehicle_id, min_dt, rollup_end)
+            if rollup_end == dates['max_dt']:
+                return report_data
+            min_dt = downsampled_before
+
+        # Все точки машины за отчётный период (из таблицы и архива) одним потоком, по мере чтения
+        # раскладываем по периодам
+        route_points = self.check_cancelled(
+            VehicleTrack(vehicle_id, min_dt, dates['max_dt']).iter_points(chunk_size=self.chunk_size)
+        )
+        return report_data + self.get_mileage_rows(route_points, min_dt, dates['max_dt'])
 
-        route_points = RoutePoint.objects.filter(
-            vehicle_id__in=vehicle_with_dates.values('vehicle_id'),
-            datetime__gt=vehicle_with_dates.values('min_dt'),
-            datetime__lt=vehicle_with_dates.values('max_dt')
-        ).order_by('datetime')
-        # print('Got route_points: {0}!'.format(route_points))
+    def get_vehicle_rollup_rows(self, vehicle_id, min_dt, max_dt):
+        daily_rows = DailyMileage.objects.filter(
+            vehicle_id=vehicle_id,
+            day__gte=min_dt.date(),
+            day__lte=max_dt.date()
+        ).order_by('day').values_list('day', 'km', 'point_count')
+        return self.get_rollup_rows(daily_rows, min_dt, max_dt)
+
+    def get_mileage_rows(self, route_points, min_dt, max_dt):
+        """Строки [начало, конец, км] по упорядоченным по времени тройкам (datetime, lat, lon)."""
+        time_delta = self.get_time_delta()
+        begining = min_dt
+        ending = self.get_period_start(begining) + time_delta
 
         report_data = []
-        begining = vehicle_with_dates[0]['min_dt']
+        period_points = []
+        for point_dt, lat, lon in route_points:
+            while point_dt >= ending:
+                self.append_period(report_data, begining, ending, *self.measure_points(period_points))
+                period_points = []
+                begining = ending
+                ending += time_delta
+            period_points.append((lat, lon))
 
-        if self.type == self.ReportType.DAILY:
-            time_delta = relativedelta.relativedelta(days=1)
-            ending = begining.replace(hour=0, minute=0, second=0, microsecond=0) + time_delta
-        elif self.type == self.ReportType.MONTHLY:
-            time_delta = relativedelta.relativedelta(months=1)
-            ending = begining.replace(day=1, hour=0, minute=0, second=0, microsecond=0) + time_delta
-        else:
-            time_delta = relativedelta.relativedelta(years=1)
-            ending = begining.replace(month=0, day=0, hour=0, minute=0, second=0, microsecond=0) + time_delta
+        if begining < max_dt:
+            self.append_period(report_data, begining, ending, *self.measure_points(period_points))
+        return report_data
 
-        while begining < vehicle_with_dates[0]['max_dt']:
-            points_for_period = route_points.filter(datetime__gt=begining, datetime__lt=ending).order_by('datetime').\
-                values_list('point')
+    def get_rollup_rows(self, daily_rows, min_dt, max_dt):
+        """Строки [начало, конец, км] по упорядоченным по дню суточным агрегатам (day, km, point_count)."""
+        time_delta = self.get_time_delta()
+        begining = min_dt
+        ending = self.get_period_start(begining) + time_delta
 
-            if len(points_for_period) >= 2:
-                report_data.append([str(begining), str(ending-relativedelta.relativedelta(seconds=1)),
-                                    round(sum(geodesic(point1, point2).km for point1, point2 in
-                                              pairwise(points_for_period)), 2)])
-            begining = ending
-            ending += time_delta
+        report_data = []
+        period_km, period_point_count = 0, 0
+        for day, km, point_count in daily_rows:
+            day_dt = datetime.combine(day, time(), tzinfo=timezone.utc)
+            while day_dt >= ending:
+                self.append_period(report_data, begining, ending, period_km, period_point_count)
+                period_km, period_point_count = 0, 0
+                begining = ending
+                ending += time_delta
+            period_km += km
+            period_point_count += point_count
 
+        if begining < max_dt:
+            self.append_period(report_data, begining, ending, period_km, period_point_count)
         return report_data
+
+    @staticmethod
+    def measure_points(period_points):
+        if len(period_points) < 2:
+            return 0, len(period_points)
+        lats, lons = zip(*period_points)
+        return total_distance(lats, lons), len(period_points)
+
+    @staticmethod
+    def append_period(report_data, begining, ending, km, point_count):
+        if point_count >= 2:
+            report_data.append([str(begining), str(ending - relativedelta.relativedelta(seconds=1)), round(km, 2)])
+
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def get_report_executor(workers):
+    """
+    Общий на процесс пул для расчёта отчётов. Процессы запускаются через forkserver (или spawn), а не fork:
+    отчёты считаются и в потоках фоновых задач, а fork многопоточного процесса может зависнуть
+    на чужой блокировке и копирует открытые соединения с базой.
+    """
+    with _executors_lock:
+        if workers not in _executors:
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            _executors[workers] = ProcessPoolExecutor(max_workers=workers, initializer=django.setup,
+                                                      mp_context=multiprocessing.get_context(method))
+        return _executors[workers]
+
+
+def get_vehicle_mileage_rows(report_type, min_dt, max_dt, datetimes, lats, lons):
+    # Вызывается в процессах пула, поэтому только вычисления, без обращений к базе
+    report = TrackReport(report_type, min_dt, max_dt)
+    return report.get_mileage_rows(zip(datetimes, lats.tolist(), lons.tolist()), min_dt, max_dt)
@@ -0,0 +1,164 @@
+import logging
+import threading
+import time
+from datetime import timedelta
+
+import numpy as np
+from django.db import close_old_connections
+from django.db.models import Min, Q
+from django.utils import timezone
+
+from autopark import settings
+from .distance import segment_distances
+from .models import DailyMileage, RetentionState, RoutePoint, Travel
+from .report_cache import caches_by_window
+from .rollups import get_day_bounds, get_utc_day
+from .simplify import simplify_track
+from .summaries import summarize_travels
+
+logger = logging.getLogger(__name__)
+
+
+def select_kept(timestamps, lats, lons, travel_ids, interval, tolerance):
+    """
+    Маска точек, которые остаются после прореживания упорядоченного по времени трека:
+    первая точка каждого интервала interval секунд, точки, нужные для формы линии с допуском tolerance
+    метров (упрощение считается отдельно по каждой поездке), и первая и последняя точки каждой поездки.
+    """
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    keep = np.zeros(timestamps.size, dtype=bool)
+    if not timestamps.size:
+        return keep
+    buckets = np.floor(timestamps / interval)
+    keep[0] = True
+    keep[1:] |= buckets[1:] != buckets[:-1]
+
+    travel_ids = np.asarray([-1 if travel_id is None else travel_id for travel_id in travel_ids], dtype=np.int64)
+    bounds = np.concatenate(([0], np.flatnonzero(travel_ids[1:] != travel_ids[:-1]) + 1, [timestamps.size]))
+    for begin, end in zip(bounds[:-1], bounds[1:]):
+        keep[begin:end] |= simplify_track(lats[begin:end], lons[begin:end], tolerance=tolerance)
+    return keep
+
+
+def downsample_vehicle_day(vehicle_id, day, interval, tolerance, batch_size, pause=0):
+    """
+    Прореживает точки машины за сутки UTC. Перед удалением точек запоминает по ним суточный пробег
+    и сводки ещё не посчитанных поездок, чтобы расстояния после прореживания не изменились.
+    Удаляет пачками по batch_size в отдельных коротких транзакциях. Возвращает (осталось, удалено).
+    """
+    begin, end = get_day_bounds(day)
+    rows = list(RoutePoint.objects.filter(vehicle_id=vehicle_id, datetime__gte=begin, datetime__lt=end)
+                .order_by('datetime').values_list('id', 'datetime', 'point', 'travel_id', 'tier'))
+    if not rows:
+        return 0, 0
+    ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    timestamps = np.fromiter((row[1].timestamp() for row in rows), dtype=np.float64, count=len(rows))
+    lats = np.fromiter((row[2].y for row in rows), dtype=np.float64, count=len(rows))
+    lons = np.fromiter((row[2].x for row in rows), dtype=np.float64, count=len(rows))
+    raw = np.fromiter((row[4] == RoutePoint.RAW for row in rows), dtype=bool, count=len(rows))
+
+    travel_ids = {row[3] for row in rows if row[3] is not None}
+    summarize_travels(Travel.objects.filter(id__in=travel_ids, summarized_at__isnull=True))
+    if raw.all():
+        # Повторный запуск по уже начатым суткам пробег не трогает: часть точек могла быть удалена
+        DailyMileage.objects.update_or_create(vehicle_id=vehicle_id, day=day, defaults={
+            'km': float(segment_distances(lats, lons).sum()), 'point_count': len(rows),
+            'first_ts': rows[0][1], 'last_ts': rows[-1][1],
+        })
+
+    keep = select_kept(timestamps, lats, lons, [row[3] for row in rows], interval, tolerance)
+    marked, dropped = ids[keep & raw].tolist(), ids[~keep].tolist()
+    for start in range(0, len(marked), batch_size):
+        RoutePoint.objects.filter(id__in=marked[start:start + batch_size]).update(tier=RoutePoint.DOWNSAMPLED)
+    for start in range(0, len(dropped), batch_size):
+        RoutePoint.objects.filter(id__in=dropped[start:start + batch_size]).delete_without_signals()
+        if pause:
+            time.sleep(pause)
+    return int(keep.sum()), len(dropped)
+
+
+def claim_run():
+    """Отмечает начало прореживания. Не даёт двум процессам прореживать одновременно, кроме зависших запусков."""
+    state = RetentionState.objects.first() or RetentionState.objects.create()
+    stale = timezone.now() - timedelta(seconds=settings.RETENTION_RUN_TIMEOUT)
+    claimed = RetentionState.objects.filter(pk=state.pk).filter(
+        Q(running_since__isnull=True) | Q(running_since__lt=stale)
+    ).update(running_since=timezone.now())
+    return state if claimed else None
+
+
+def run_retention(raw_days=None, interval=None, tolerance=None, batch_size=None, pause=None, max_days=None,
+                  stdout=None):
+    """
+    Прореживает сутки, которые старше raw_days дней и ещё не прорежены, по порядку, начиная с самых старых.
+    После каждых суток сдвигает RetentionState.downsampled_before, поэтому прерванный запуск
+    продолжается с тех же суток. Возвращает (обработано суток, удалено точек) или None,
+    если прореживание уже выполняется другим процессом.
+    """
+    raw_days = settings.RETENTION_RAW_DAYS if raw_days is None else raw_days
+    interval = interval or settings.RETENTION_INTERVAL_SECONDS
+    tolerance = settings.RETENTION_TOLERANCE_M if tolerance is None else tolerance
+    batch_size = batch_size or settings.RETENTION_DELETE_BATCH
+    pause = settings.RETENTION_BATCH_PAUSE if pause is None else pause
+    if not raw_days:
+        return 0, 0
+
+    state = claim_run()
+    if state is None:
+        return None
+    days, deleted = 0, 0
+    try:
+        # Последние сутки, целиком старше raw_days дней
+        last_day = get_utc_day(timezone.now() - timedelta(days=raw_days)) - timedelta(days=1)
+        if state.downsampled_before is not None:
+            day = get_utc_day(state.downsampled_before)
+        else:
+            # Суточные пробеги ведутся на всех путях записи точек, поэтому сутки и машины с точками
+            # берутся из них, а не из таблицы точек
+            day = DailyMileage.objects.aggregate(first_day=Min('day'))['first_day']
+            if day is None:
+                return 0, 0
+
+        while day <= last_day and (max_days is None or days < max_days):
+            vehicles = list(DailyMileage.objects.filter(day=day).values_list('vehicle_id', 'vehicle__enterprise_id'))
+            day_deleted = 0
+            for vehicle_id, _ in vehicles:
+                day_deleted += downsample_vehicle_day(vehicle_id, day, interval, tolerance, batch_size, pause)[1]
+            begin, end = get_day_bounds(day)
+            RetentionState.objects.filter(pk=state.pk).update(downsampled_before=end)
+            for vehicle_id, enterprise_id in vehicles:
+                for cache in caches_by_window:
+                    cache.invalidate_vehicle(vehicle_id, enterprise_id, begin, end)
+            if stdout is not None:
+                stdout.write('%s: %d route points deleted' % (day, day_deleted))
+            days += 1
+            deleted += day_deleted
+            day += timedelta(days=1)
+    finally:
+        RetentionState.objects.filter(pk=state.pk).update(running_since=None)
+    return days, deleted
+
+
+def start_retention_scheduler(interval_hours=None):
+    """
+    Хук для планировщика в процессе сервера: раз в interval_hours часов запускает run_retention
+    в фоновом потоке. 0 - не запускать (прореживание вызывается командой apply_retention из cron).
+    """
+    interval_hours = settings.RETENTION_SCHEDULE_HOURS if interval_hours is None else interval_hours
+    if not interval_hours:
+        return None
+
+    def loop():
+        while True:
+            try:
+                run_retention()
+            except Exception:
+                # Ошибка одного запуска не останавливает планировщик, следующий продолжит с тех же суток
+                logger.exception('Route point retention failed')
+            finally:
+                close_old_connections()
+            time.sleep(interval_hours * 3600)
+
+    thread = threading.Thread(target=loop, name='route-point-retention', daemon=True)
+    thread.start()
+    return thread
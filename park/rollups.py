@@ -0,0 +1,182 @@
+import datetime
+from collections import defaultdict
+from operator import attrgetter
+
+from django.db import transaction
+
+from .distance import segment_distances, total_distance
+from .models import DailyMileage, RetentionState, RoutePoint
+
+
+def get_utc_day(dt):
+    return dt.astimezone(datetime.timezone.utc).date()
+
+
+def get_day_bounds(day):
+    begin = datetime.datetime.combine(day, datetime.time(), tzinfo=datetime.timezone.utc)
+    return begin, begin + datetime.timedelta(days=1)
+
+
+def register_route_point(route_point):
+    """
+    Добавляет одну новую точку к суточному пробегу её машины, не перечитывая весь день: читаются
+    только соседние точки суток. Точка в середине дня заменяет отрезок prev-next на prev-p-next.
+    """
+    day = get_utc_day(route_point.datetime)
+    with transaction.atomic():
+        mileage, created = DailyMileage.objects.select_for_update().get_or_create(
+            vehicle_id=route_point.vehicle_id, day=day,
+            defaults={'km': 0, 'point_count': 1, 'first_ts': route_point.datetime, 'last_ts': route_point.datetime}
+        )
+        if created:
+            return
+
+        begin, end = get_day_bounds(day)
+        day_points = RoutePoint.objects.filter(
+            vehicle_id=route_point.vehicle_id, datetime__gte=begin, datetime__lt=end
+        ).exclude(pk=route_point.pk)
+        # Точка с тем же временем, что у уже сохранённой, идёт после неё, как при пересчёте по (vehicle, datetime)
+        previous = following = None
+        if route_point.datetime >= mileage.first_ts:
+            previous = day_points.filter(datetime__lte=route_point.datetime).order_by('-datetime', '-id')\
+                .values_list('point', flat=True).first()
+        if route_point.datetime < mileage.last_ts:
+            following = day_points.filter(datetime__gt=route_point.datetime).order_by('datetime')\
+                .values_list('point', flat=True).first()
+        if previous is None and following is None:
+            # Точек суток в таблице нет, хотя пробег записан (например, их удалили) - пересчёт дня
+            rebuild_daily_mileage(day, day, [route_point.vehicle_id])
+            return
+
+        point = route_point.point
+        if previous is not None:
+            mileage.km += total_distance([previous.y, point.y], [previous.x, point.x])
+        if following is not None:
+            mileage.km += total_distance([point.y, following.y], [point.x, following.x])
+        if previous is not None and following is not None:
+            mileage.km -= total_distance([previous.y, following.y], [previous.x, following.x])
+        mileage.point_count += 1
+        mileage.first_ts = min(mileage.first_ts, route_point.datetime)
+        mileage.last_ts = max(mileage.last_ts, route_point.datetime)
+        mileage.save(update_fields=['km', 'point_count', 'first_ts', 'last_ts'])
+
+
+def rebuild_daily_mileage(begin_day, end_day, vehicle_ids=None, chunk_size=2000):
+    """
+    Пересчитывает суточные пробеги за дни [begin_day, end_day] по сырым точкам маршрута.
+    Прореженные и архивные сутки пропускаются: их пробег посчитан до прореживания или архивации,
+    а по оставшимся в таблице точкам вышел бы меньше.
+    """
+    history_before = RetentionState.get_history_before()
+    if history_before is not None:
+        begin_day = max(begin_day, get_utc_day(history_before))
+        if begin_day > end_day:
+            return 0
+    begin, _ = get_day_bounds(begin_day)
+    _, end = get_day_bounds(end_day)
+    route_points = RoutePoint.objects.filter(datetime__gte=begin, datetime__lt=end)
+    mileages = DailyMileage.objects.filter(day__gte=begin_day, day__lte=end_day)
+    if vehicle_ids is not None:
+        route_points = route_points.filter(vehicle_id__in=vehicle_ids)
+        mileages = mileages.filter(vehicle_id__in=vehicle_ids)
+
+    route_points = route_points.order_by('vehicle_id', 'datetime').values_list('vehicle_id', 'datetime', 'point')
+    rows = [
+        DailyMileage(vehicle_id=vehicle_id, day=day, km=float(segment_distances(lats, lons).sum()),
+                     point_count=len(datetimes), first_ts=datetimes[0], last_ts=datetimes[-1])
+        for (vehicle_id, day), (datetimes, lats, lons) in group_by_day(route_points.iterator(chunk_size=chunk_size))
+    ]
+
+    with transaction.atomic():
+        mileages.delete()
+        DailyMileage.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+def refresh_daily_mileage(route_points):
+    """
+    Дописывает пачку новых точек к суточным пробегам, как register_route_point - одиночную: точки
+    до первой и после последней посчитанной продлевают пробег от крайней сохранённой точки суток.
+    Сутки, в середину которых попала точка пачки, пересчитываются целиком (в пачке таких точек может
+    быть много подряд). Нужен там, где точки пишутся через bulk_create, вызывается после записи.
+    """
+    groups = defaultdict(list)
+    for route_point in route_points:
+        groups[(route_point.vehicle_id, get_utc_day(route_point.datetime))].append(route_point)
+    if not groups:
+        return
+
+    with transaction.atomic():
+        mileages = DailyMileage.objects.select_for_update().filter(
+            vehicle_id__in={vehicle_id for vehicle_id, _ in groups}, day__in={day for _, day in groups}
+        )
+        mileages = {(mileage.vehicle_id, mileage.day): mileage for mileage in mileages}
+        created, extended, rebuild_days = [], [], defaultdict(set)
+        for (vehicle_id, day), points in groups.items():
+            points.sort(key=attrgetter('datetime'))
+            mileage = mileages.get((vehicle_id, day))
+            if mileage is None:
+                created.append(DailyMileage(vehicle_id=vehicle_id, day=day, km=get_km(points), point_count=len(points),
+                                            first_ts=points[0].datetime, last_ts=points[-1].datetime))
+            elif any(mileage.first_ts <= point.datetime <= mileage.last_ts for point in points):
+                rebuild_days[day].add(vehicle_id)
+            else:
+                extended.append((mileage, points))
+
+        end_points = get_end_points([mileage for mileage, _ in extended])
+        updated = []
+        for mileage, points in extended:
+            before = [point for point in points if point.datetime < mileage.first_ts]
+            after = [point for point in points if point.datetime > mileage.last_ts]
+            first = end_points.get((mileage.vehicle_id, mileage.first_ts))
+            last = end_points.get((mileage.vehicle_id, mileage.last_ts))
+            if before and first is None or after and last is None:
+                rebuild_days[mileage.day].add(mileage.vehicle_id)
+                continue
+            if before:
+                mileage.km += get_km(before + [first])
+                mileage.first_ts = before[0].datetime
+            if after:
+                mileage.km += get_km([last] + after)
+                mileage.last_ts = after[-1].datetime
+            mileage.point_count += len(points)
+            updated.append(mileage)
+
+        DailyMileage.objects.bulk_update(updated, ['km', 'point_count', 'first_ts', 'last_ts'], batch_size=1000)
+        DailyMileage.objects.bulk_create(created, batch_size=1000)
+        for day, vehicle_ids in rebuild_days.items():
+            rebuild_daily_mileage(day, day, vehicle_ids)
+
+
+def get_km(route_points):
+    return total_distance([route_point.point.y for route_point in route_points],
+                          [route_point.point.x for route_point in route_points])
+
+
+def get_end_points(mileages):
+    """Сохранённые крайние точки суток одним запросом: {(vehicle_id, datetime): RoutePoint}."""
+    if not mileages:
+        return {}
+    route_points = RoutePoint.objects.filter(
+        vehicle_id__in={mileage.vehicle_id for mileage in mileages},
+        datetime__in={dt for mileage in mileages for dt in (mileage.first_ts, mileage.last_ts)},
+    ).only('vehicle_id', 'datetime', 'point')
+    return {(route_point.vehicle_id, route_point.datetime): route_point for route_point in route_points}
+
+
+def group_by_day(route_points):
+    """Группирует упорядоченный поток (vehicle_id, datetime, point) по машине и суткам UTC."""
+    current_key = None
+    datetimes, lats, lons = [], [], []
+    for vehicle_id, point_dt, point in route_points:
+        key = (vehicle_id, get_utc_day(point_dt))
+        if key != current_key:
+            if datetimes:
+                yield current_key, (datetimes, lats, lons)
+            current_key = key
+            datetimes, lats, lons = [], [], []
+        datetimes.append(point_dt)
+        lats.append(point.y)
+        lons.append(point.x)
+    if datetimes:
+        yield current_key, (datetimes, lats, lons)
@@ -0,0 +1,199 @@
+import hashlib
+import json
+import math
+import os
+import tempfile
+import zlib
+from collections import namedtuple
+
+import numpy as np
+import requests
+from django.utils.module_loading import import_string
+
+from autopark import settings
+from .distance import HAVERSINE, segment_distances
+
+# Маршрут в формате GraphHopper: координаты [lon, lat], детали time - тройки [с точки, до точки, мс]
+# и полное время в пути, мс
+Route = namedtuple('Route', ['coordinates', 'times', 'time'])
+
+# Километров в градусе широты и в градусе долготы на экваторе
+KM_PER_DEGREE_LAT = 110.574
+KM_PER_DEGREE_LON = 111.320
+
+
+class Router:
+    """Построение маршрута между двумя точками [lon, lat]. cacheable - стоит ли держать перед ним дисковый кэш."""
+    name = None
+    cacheable = False
+
+    def route(self, coord_from, coord_to):
+        raise NotImplementedError
+
+    def get_params(self):
+        """Параметры, от которых зависит маршрут, кроме самих точек: входят в ключ кэша."""
+        return {}
+
+
+class GraphHopperRouter(Router):
+    name = 'graphhopper'
+    cacheable = True
+
+    def __init__(self, url=None, key=None, vehicle='car', timeout=60):
+        self.url = url or settings.GRAPHHOPPER_URL
+        self.key = key or settings.GRAPHHOPPER_KEY
+        self.vehicle = vehicle
+        self.timeout = timeout
+        if not self.key:
+            raise ValueError('GRAPHHOPPER_KEY is not set')
+
+    def get_params(self):
+        return {'url': self.url, 'vehicle': self.vehicle}
+
+    def route(self, coord_from, coord_to):
+        payload = {
+            'points': [coord_from, coord_to],
+            'details': ['time'],
+            'vehicle': self.vehicle,
+            'locale': 'en',
+            'instructions': False,
+            'calc_points': True,
+            'points_encoded': False,
+        }
+        response = requests.post(self.url, json=payload, params={'key': self.key}, timeout=self.timeout)
+        response.raise_for_status()
+        path = response.json()['paths'][0]
+        return Route(path['points']['coordinates'], path['details']['time'], path['time'])
+
+
+class SyntheticRouter(Router):
+    """
+    Маршрут без сети: извилистая линия между точками с шагом около step_km. Форма и скорости зависят только
+    от координат концов, поэтому один и тот же маршрут получается одинаковым в любом процессе.
+    Путь на 15-25% длиннее прямой, как у дорог между городами. У концов - городские скорости,
+    в пути - трасса с замедлениями в населённых пунктах через каждые 40-120 км.
+    """
+    name = 'synthetic'
+
+    def __init__(self, step_km=0.25, city_km=8.0, city_speed=35.0, highway_speed=90.0, town_speed=50.0):
+        self.step_km = step_km
+        self.city_km = city_km
+        self.city_speed = city_speed
+        self.highway_speed = highway_speed
+        self.town_speed = town_speed
+
+    def get_params(self):
+        return dict(vars(self))
+
+    def get_rng(self, coord_from, coord_to):
+        key = json.dumps([[round(c, 6) for c in coord_from], [round(c, 6) for c in coord_to]])
+        return np.random.default_rng(int.from_bytes(hashlib.sha256(key.encode()).digest()[:8], 'little'))
+
+    def route(self, coord_from, coord_to):
+        rng = self.get_rng(coord_from, coord_to)
+        (lon1, lat1), (lon2, lat2) = coord_from, coord_to
+        cos_lat = math.cos(math.radians((lat1 + lat2) / 2))
+        east_km = (lon2 - lon1) * KM_PER_DEGREE_LON * cos_lat
+        north_km = (lat2 - lat1) * KM_PER_DEGREE_LAT
+        straight_km = math.hypot(east_km, north_km)
+        if straight_km < self.step_km:
+            return Route([list(coord_from), list(coord_to)], [[0, 1, 0]], 0)
+
+        # Отклонение от прямой поперёк направления: несколько гармоник, равных нулю на концах
+        count = int(math.ceil(straight_km * 1.2 / self.step_km)) + 1
+        t = np.linspace(0, 1, count)
+        harmonics = np.arange(1, 9)
+        amplitudes = straight_km * 0.12 / harmonics ** 1.5 * rng.uniform(-1, 1, harmonics.size)
+        offset_km = (amplitudes * np.sin(np.pi * np.outer(t, harmonics))).sum(axis=1)
+        # Мелкие повороты дороги: сглаженный шум в сотни метров, тоже нулевой на концах
+        wiggle = np.convolve(rng.normal(0, 1.2, count), np.ones(9) / 9, mode='same')
+        offset_km += wiggle * np.sin(np.pi * t)
+
+        perp_east, perp_north = -north_km / straight_km, east_km / straight_km
+        lons = lon1 + t * (lon2 - lon1) + offset_km * perp_east / (KM_PER_DEGREE_LON * cos_lat)
+        lats = lat1 + t * (lat2 - lat1) + offset_km * perp_north / KM_PER_DEGREE_LAT
+        lons[0], lats[0], lons[-1], lats[-1] = lon1, lat1, lon2, lat2
+
+        distances = segment_distances(lats, lons, HAVERSINE)
+        travelled = np.concatenate(([0.0], np.cumsum(distances)))
+        total = travelled[-1]
+        middle = (travelled[:-1] + travelled[1:]) / 2
+
+        # Скорость на отрезках: трасса с медленными колебаниями, населённые пункты по пути, город у концов
+        speeds = self.highway_speed * (1 + 0.12 * np.sin(2 * np.pi * middle / rng.uniform(30, 80) +
+                                                         rng.uniform(0, 2 * np.pi)))
+        town = rng.uniform(0, 80)
+        while town < total:
+            speeds[(middle >= town) & (middle < town + rng.uniform(2, 6))] = self.town_speed
+            town += rng.uniform(40, 120)
+        near_end = (middle < self.city_km) | (middle > total - self.city_km)
+        speeds[near_end] = self.city_speed
+        speeds *= rng.uniform(0.9, 1.1, speeds.size)
+
+        times = np.rint(distances / speeds * 3600000).astype(np.int64)
+        coordinates = np.column_stack((np.round(lons, 6), np.round(lats, 6))).tolist()
+        details = [[index, index + 1, ms] for index, ms in enumerate(times.tolist())]
+        return Route(coordinates, details, int(times.sum()))
+
+
+class CachedRouter(Router):
+    """
+    Дисковый кэш перед другим маршрутизатором. Файл маршрута адресуется хэшем запроса: имени маршрутизатора,
+    его параметров и точек, поэтому кэш можно копировать между машинами и делить между процессами.
+    """
+
+    def __init__(self, router, cache_dir):
+        self.router = router
+        self.cache_dir = cache_dir
+        self.name = router.name
+        self.hits = 0
+        self.misses = 0
+
+    def get_params(self):
+        return self.router.get_params()
+
+    def get_key(self, coord_from, coord_to):
+        request = {'router': self.router.name, 'params': self.router.get_params(),
+                   'points': [list(coord_from), list(coord_to)]}
+        return hashlib.sha256(json.dumps(request, sort_keys=True).encode()).hexdigest()
+
+    def get_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.json.z')
+
+    def route(self, coord_from, coord_to):
+        path = self.get_path(self.get_key(coord_from, coord_to))
+        try:
+            with open(path, 'rb') as file:
+                route = Route(*json.loads(zlib.decompress(file.read())))
+        except FileNotFoundError:
+            pass
+        else:
+            self.hits += 1
+            return route
+
+        self.misses += 1
+        route = self.router.route(coord_from, coord_to)
+        # Через временный файл: параллельный процесс не прочитает недописанный маршрут
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        descriptor, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(descriptor, 'wb') as file:
+                file.write(zlib.compress(json.dumps(list(route)).encode()))
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return route
+
+
+def get_router(router=None, cache_dir=None):
+    """
+    Маршрутизатор по пути к классу (по умолчанию ROUTING_ROUTER). Маршрутизаторы с cacheable получают
+    дисковый кэш в cache_dir (по умолчанию ROUTING_CACHE_DIR, пустая строка - без кэша).
+    """
+    instance = import_string(router or settings.ROUTING_ROUTER)()
+    if cache_dir is None:
+        cache_dir = settings.ROUTING_CACHE_DIR
+    if instance.cacheable and cache_dir:
+        return CachedRouter(instance, cache_dir)
+    return instance
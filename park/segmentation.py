@@ -0,0 +1,127 @@
+import math
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Q
+
+from autopark import settings
+from .distance import EARTH_RADIUS_KM
+from .models import RoutePoint, SegmentationState, Travel
+from .summaries import summarize_travel
+
+START = 'start'
+CLOSE = 'close'
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    # Скалярный вариант park.distance.haversine: точки приходят по одной, numpy здесь только мешает
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(a, 1.0)))
+
+
+class TripSegmenter:
+    """
+    Нарезка потока точек одной машины на поездки. Машина стоит, пока точки не уходят от «якоря» дальше
+    stop_radius_km; поездка начинается с последней точки перед уходом от якоря и заканчивается, когда машина
+    простояла у нового якоря stop_duration, или когда точки не приходили дольше max_gap.
+    Всё состояние хранится в полях state (SegmentationState), поэтому обработку можно продолжить
+    с любого места.
+    """
+
+    def __init__(self, state, stop_radius_km, stop_duration, max_gap):
+        self.state = state
+        self.stop_radius_km = stop_radius_km
+        self.stop_duration = stop_duration
+        self.max_gap = max_gap
+        self.in_trip = state.travel_id is not None
+        self.count = 0
+
+    def set_anchor(self, point_dt, lat, lon):
+        self.state.anchor_ts, self.state.anchor_lat, self.state.anchor_lon = point_dt, lat, lon
+
+    def feed(self, route_points):
+        """Принимает упорядоченные по времени тройки (datetime, lat, lon), отдаёт события (START|CLOSE, время)."""
+        state = self.state
+        for point_dt, lat, lon in route_points:
+            if state.last_ts is None:
+                self.set_anchor(point_dt, lat, lon)
+            elif point_dt - state.last_ts > self.max_gap:
+                # Долгое молчание трекера: поездка, если была, закончилась на последней точке до разрыва
+                if self.in_trip:
+                    self.in_trip = False
+                    yield CLOSE, state.last_ts
+                self.set_anchor(point_dt, lat, lon)
+            elif haversine_km(state.anchor_lat, state.anchor_lon, lat, lon) > self.stop_radius_km:
+                if not self.in_trip:
+                    self.in_trip = True
+                    yield START, state.last_ts
+                self.set_anchor(point_dt, lat, lon)
+            elif self.in_trip and point_dt - state.anchor_ts >= self.stop_duration:
+                # Машина простояла достаточно: поездка закончилась в момент прибытия к якорю
+                self.in_trip = False
+                yield CLOSE, state.anchor_ts
+            state.last_ts, state.last_lat, state.last_lon = point_dt, lat, lon
+            self.count += 1
+
+
+def get_segmenter_options(stop_radius_m=None, stop_minutes=None, max_gap_minutes=None):
+    return {
+        'stop_radius_km': (settings.SEGMENT_STOP_RADIUS_M if stop_radius_m is None else stop_radius_m) / 1000,
+        'stop_duration': timedelta(
+            minutes=settings.SEGMENT_STOP_MINUTES if stop_minutes is None else stop_minutes),
+        'max_gap': timedelta(
+            minutes=settings.SEGMENT_MAX_GAP_MINUTES if max_gap_minutes is None else max_gap_minutes),
+    }
+
+
+def get_segmenter_points(state, route_points, chunk_size):
+    """Тройки (datetime, lat, lon) для TripSegmenter; id последней отданной точки запоминается в state."""
+    for point_id, point_dt, point in route_points.iterator(chunk_size=chunk_size):
+        state.last_id = point_id
+        yield point_dt, point.y, point.x
+
+
+def segment_vehicle(vehicle_id, batch_points=50000, chunk_size=2000, **options):
+    """
+    Дорезает поездки машины по точкам, пришедшим после прошлого запуска. Точки обрабатываются порциями
+    по batch_points, каждая порция - отдельная транзакция вместе с сохранением состояния.
+    Возвращает (обработано точек, создано поездок, закрыто поездок).
+    """
+    options = get_segmenter_options(**options)
+    processed, created, closed = 0, 0, 0
+    while True:
+        with transaction.atomic():
+            state, _ = SegmentationState.objects.select_for_update().get_or_create(vehicle_id=vehicle_id)
+            route_points = RoutePoint.objects.filter(vehicle_id=vehicle_id)
+            if state.last_ts is not None:
+                # Порции идут по (datetime, id): точки с тем же временем, что у последней обработанной,
+                # не теряются на границе порций
+                after = Q(datetime__gt=state.last_ts)
+                if state.last_id is not None:
+                    after |= Q(datetime=state.last_ts, id__gt=state.last_id)
+                route_points = route_points.filter(after)
+            route_points = route_points.order_by('datetime', 'id').values_list('id', 'datetime', 'point')[:batch_points]
+
+            travel = state.travel
+            segmenter = TripSegmenter(state, **options)
+            for event, event_dt in segmenter.feed(get_segmenter_points(state, route_points, chunk_size)):
+                if event == START:
+                    travel = Travel.objects.create(vehicle_id=vehicle_id, begin=event_dt, end=event_dt)
+                    created += 1
+                else:
+                    travel.end = event_dt
+                    travel.save()
+                    summarize_travel(travel)
+                    travel = None
+                    closed += 1
+
+            if travel is not None and state.last_ts is not None and state.last_ts > travel.end:
+                # Незакрытая поездка растёт вместе с треком, точки к ней привязывает сигнал сохранения
+                travel.end = state.last_ts
+                travel.save()
+            state.travel = travel
+            state.save()
+        processed += segmenter.count
+        if segmenter.count < batch_points:
+            return processed, created, closed
@@ -1,11 +1,33 @@
 import datetime
+from functools import lru_cache
 
 import pytz
 from rest_framework import serializers
 from rest_framework_gis.serializers import GeoFeatureModelSerializer
 
 from autopark import settings
-from park.models import Vehicle, Manufacturer, Model, Enterprise, RoutePoint, Travel
+from park.models import Vehicle, Manufacturer, Model, Enterprise, RoutePoint, Travel, ReportJob
+
+
+@lru_cache(maxsize=None)
+def get_tzinfo(timezone_name):
+    return pytz.timezone(timezone_name)
+
+
+class EnterpriseTimezoneMixin:
+    """
+    Часовой пояс предприятия для вывода дат. Если он известен заранее (один автомобиль на весь запрос),
+    его передают в context['timezone'], иначе берётся из предприятия, подтянутого через select_related.
+    """
+
+    def get_enterprise(self, instance):
+        return instance.vehicle.enterprise
+
+    def get_enterprise_tz(self, instance):
+        if 'timezone' in self.context:
+            return self.context['timezone']
+        enterprise = self.get_enterprise(instance)
+        return get_tzinfo(enterprise.timezone if enterprise else settings.TIME_ZONE)
 
 
 class ManufacturerSerializer(serializers.ModelSerializer):
@@ -29,7 +51,7 @@ class EnterpriseSerializer(serializers.ModelSerializer):
         fields = ('id', )
 
 
-class VehicleSerializer(serializers.ModelSerializer):
+class VehicleSerializer(EnterpriseTimezoneMixin, serializers.ModelSerializer):
     manufacturer = serializers.PrimaryKeyRelatedField(many=False, queryset=Manufacturer.objects.all())
     model = serializers.PrimaryKeyRelatedField(many=False, queryset=Model.objects.all())
     cost = serializers.IntegerField()
@@ -63,8 +85,11 @@ class VehicleSerializer(serializers.ModelSerializer):
         vehicle.save()
         return vehicle
 
+    def get_enterprise(self, instance):
+        return instance.enterprise
+
     def to_representation(self, instance):
-        ent_tz = pytz.timezone(instance.enterprise.timezone)
+        ent_tz = self.get_enterprise_tz(instance)
         buy_datetime = instance.buy_datetime.astimezone(ent_tz)
         ret = super().to_representation(instance)
         ret['buy_datetime'] = str(buy_datetime)
@@ -78,14 +103,14 @@ class VehicleSerializer(serializers.ModelSerializer):
         return data
 
 
-class RoutePointSerializer(serializers.ModelSerializer):
+class RoutePointSerializer(EnterpriseTimezoneMixin, serializers.ModelSerializer):
 
     class Meta:
         model = RoutePoint
         fields = ['point', 'datetime']
 
     def to_representation(self, instance):
-        ent_tz = pytz.timezone(instance.vehicle.enterprise.timezone)
+        ent_tz = self.get_enterprise_tz(instance)
         point_datetime = instance.datetime.astimezone(ent_tz)
         ret = super().to_representation(instance)
         ret['datetime'] = str(point_datetime)
@@ -99,7 +124,7 @@ class RoutePointSerializer(serializers.ModelSerializer):
         return data
 
 
-class GeoRoutePointSerializer(GeoFeatureModelSerializer):
+class GeoRoutePointSerializer(EnterpriseTimezoneMixin, GeoFeatureModelSerializer):
 
     class Meta:
         model = RoutePoint
@@ -107,7 +132,7 @@ class GeoRoutePointSerializer(GeoFeatureModelSerializer):
         fields = ['datetime',]
 
     def to_representation(self, instance):
-        ent_tz = pytz.timezone(instance.vehicle.enterprise.timezone)
+        ent_tz = self.get_enterprise_tz(instance)
         point_datetime = instance.datetime.astimezone(ent_tz)
         ret = super().to_representation(instance)
         ret['datetime'] = str(point_datetime)
@@ -121,14 +146,14 @@ class GeoRoutePointSerializer(GeoFeatureModelSerializer):
         return data
 
 
-class TravelSerializer(serializers.ModelSerializer):
+class TravelSerializer(EnterpriseTimezoneMixin, serializers.ModelSerializer):
 
     class Meta:
         model = Travel
         fields = ['vehicle', 'begin', 'end']
 
     def to_representation(self, instance):
-        ent_tz = pytz.timezone(instance.vehicle.enterprise.timezone)
+        ent_tz = self.get_enterprise_tz(instance)
         travel_begin = instance.begin.astimezone(ent_tz)
         travel_end = instance.end.astimezone(ent_tz)
         ret = super().to_representation(instance)
@@ -144,3 +169,36 @@ class TravelSerializer(serializers.ModelSerializer):
         if data['end']:
             data['end'] = data['end'].astimezone(local_tz)
         return data
+
+
+class TravelSummarySerializer(EnterpriseTimezoneMixin, serializers.ModelSerializer):
+
+    class Meta:
+        model = Travel
+        fields = ['id', 'vehicle', 'begin', 'end', 'distance_km', 'point_count', 'max_speed_kmh']
+
+    def to_representation(self, instance):
+        ent_tz = self.get_enterprise_tz(instance)
+        ret = super().to_representation(instance)
+        ret['begin'] = str(instance.begin.astimezone(ent_tz))
+        ret['end'] = str(instance.end.astimezone(ent_tz))
+        ret['duration_s'] = int(instance.duration.total_seconds())
+        # Геометрия отдаётся списками [lon, lat], bbox - [min_lon, min_lat, max_lon, max_lat]
+        ret['bbox'] = list(instance.bbox.extent) if instance.bbox else None
+        ret['start_point'] = list(instance.start_point.coords) if instance.start_point else None
+        ret['end_point'] = list(instance.end_point.coords) if instance.end_point else None
+        return ret
+
+
+class ReportJobSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = ReportJob
+        fields = ['id', 'scope', 'owner_id', 'report_type', 'begin', 'end', 'status', 'error', 'created_at',
+                  'started_at', 'finished_at']
+
+    def to_representation(self, instance):
+        ret = super().to_representation(instance)
+        if instance.status == ReportJob.DONE:
+            ret['result'] = instance.result
+        return ret
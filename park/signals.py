@@ -0,0 +1,96 @@
+import threading
+
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import RoutePoint, Travel, Vehicle
+from .report_cache import caches_by_window
+from .positions import update_positions
+from .rollups import register_route_point
+from .summaries import SUMMARY_FIELDS
+from .travels import find_travel_id, link_travel_points
+
+
+def get_enterprise_id(instance):
+    if type(instance).vehicle.is_cached(instance):
+        return instance.vehicle.enterprise_id
+    return Vehicle.objects.filter(pk=instance.vehicle_id).values_list('enterprise_id', flat=True).first()
+
+
+def invalidate_vehicle_caches(vehicle_id, enterprise_id, begin, end):
+    for cache in caches_by_window:
+        cache.invalidate_vehicle(vehicle_id, enterprise_id, begin, end)
+
+
+# Суточные пробеги по правке и удалению точек не пересчитываются (иначе каскадное удаление машины
+# пересчитывало бы сутки на каждую точку) - после них нужна команда rebuild_mileage. Кэши отчётов
+# и треков сбрасываются всегда.
+@receiver(post_save, sender=RoutePoint)
+def route_point_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    loaded = getattr(instance, 'loaded_track', None)
+    instance.loaded_track = instance.get_track_values()
+    if created:
+        if instance.travel_id is None:
+            instance.travel_id = find_travel_id(instance.vehicle_id, instance.datetime)
+            if instance.travel_id is not None:
+                RoutePoint.objects.filter(pk=instance.pk).update(travel_id=instance.travel_id)
+        register_route_point(instance)
+        update_positions([instance])
+    elif loaded == instance.loaded_track:
+        # Время и координаты не менялись (например, сменилась поездка или уровень детализации)
+        return
+    # Перенесённая во времени точка меняет и старое, и новое окно
+    datetimes = {instance.datetime}
+    if loaded is not None and loaded[0] is not None:
+        datetimes.add(loaded[0])
+    enterprise_id = get_enterprise_id(instance)
+    for point_dt in datetimes:
+        invalidate_vehicle_caches(instance.vehicle_id, enterprise_id, point_dt, point_dt)
+
+
+_deleted = threading.local()
+
+
+@receiver(post_delete, sender=RoutePoint)
+def route_point_deleted(sender, instance, origin=None, **kwargs):
+    # Удаление машины или выборки точек присылает сигнал на каждую точку: окна машин копятся по источнику
+    # удаления, и кэши сбрасываются один раз после коммита
+    pending = getattr(_deleted, 'pending', None)
+    if origin is None or pending is None or pending[0] is not origin:
+        windows = {}
+        _deleted.pending = (origin, windows)
+        transaction.on_commit(lambda: flush_deleted_route_points(windows))
+    else:
+        windows = pending[1]
+    window = windows.get(instance.vehicle_id)
+    if window is None:
+        windows[instance.vehicle_id] = [get_enterprise_id(instance), instance.datetime, instance.datetime]
+    else:
+        window[1], window[2] = min(window[1], instance.datetime), max(window[2], instance.datetime)
+
+
+def flush_deleted_route_points(windows):
+    pending = getattr(_deleted, 'pending', None)
+    if pending is not None and pending[1] is windows:
+        _deleted.pending = None
+    for vehicle_id, (enterprise_id, begin, end) in windows.items():
+        invalidate_vehicle_caches(vehicle_id, enterprise_id, begin, end)
+
+
+@receiver(post_save, sender=Travel)
+def travel_saved(sender, instance, raw=False, update_fields=None, **kwargs):
+    # Точки могут прийти раньше, чем создана поездка, поэтому привязка делается и со стороны поездки.
+    # Сохранение одной сводки границы поездки не меняет - перепривязывать нечего
+    if raw or (update_fields is not None and set(update_fields) <= set(SUMMARY_FIELDS)):
+        return
+    link_travel_points(instance)
+
+
+@receiver(post_save, sender=Travel)
+@receiver(post_delete, sender=Travel)
+def travel_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        invalidate_vehicle_caches(instance.vehicle_id, get_enterprise_id(instance), instance.begin, instance.end)
@@ -0,0 +1,93 @@
+import numpy as np
+
+from .distance import EARTH_RADIUS_KM
+
+EARTH_CIRCUMFERENCE_M = 40075016.686
+TILE_SIZE = 256
+MAX_ZOOM = 22
+
+
+def project(lats, lons):
+    """Равнопромежуточная проекция вокруг средней широты трека, метры. Для упрощения линии этого достаточно."""
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    scale = EARTH_RADIUS_KM * 1000 * np.pi / 180
+    cos_lat = np.cos(np.radians(lats.mean())) if lats.size else 1.0
+    return lons * scale * cos_lat, lats * scale
+
+
+def zoom_tolerance(zoom, lat, pixels=1.0):
+    """Сколько метров занимает pixels пикселей на карте с данным зумом на широте lat."""
+    zoom = min(max(int(zoom), 0), MAX_ZOOM)
+    return pixels * EARTH_CIRCUMFERENCE_M * np.cos(np.radians(lat)) / (TILE_SIZE * 2 ** zoom)
+
+
+def douglas_peucker(xs, ys, tolerance):
+    """
+    Маска точек, которые остаются после упрощения линии алгоритмом Дугласа-Пекера.
+    Все отрезки одного уровня разбиения обрабатываются одной векторной операцией.
+    """
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+    keep = np.zeros(xs.size, dtype=bool)
+    if xs.size == 0:
+        return keep
+    keep[0] = keep[-1] = True
+
+    starts = np.array([0])
+    ends = np.array([xs.size - 1])
+    while starts.size:
+        counts = ends - starts - 1
+        starts, ends, counts = starts[counts > 0], ends[counts > 0], counts[counts > 0]
+        if not starts.size:
+            break
+
+        # Номера отрезков и индексы их внутренних точек одним плоским массивом
+        segment_ids = np.repeat(np.arange(starts.size), counts)
+        offsets = np.cumsum(counts) - counts
+        indices = starts[segment_ids] + 1 + np.arange(counts.sum()) - offsets[segment_ids]
+
+        x1, y1 = xs[starts][segment_ids], ys[starts][segment_ids]
+        dx, dy = xs[ends][segment_ids] - x1, ys[ends][segment_ids] - y1
+        length_sq = dx * dx + dy * dy
+        with np.errstate(invalid='ignore', divide='ignore'):
+            t = np.where(length_sq > 0, ((xs[indices] - x1) * dx + (ys[indices] - y1) * dy) / length_sq, 0)
+        t = np.clip(t, 0, 1)
+        distances = np.hypot(xs[indices] - (x1 + t * dx), ys[indices] - (y1 + t * dy))
+
+        max_distances = np.maximum.reduceat(distances, offsets)
+        is_max = distances == max_distances[segment_ids]
+        _, first_max = np.unique(segment_ids[is_max], return_index=True)
+        farthest = indices[np.flatnonzero(is_max)[first_max]]
+
+        split = max_distances > tolerance
+        farthest = farthest[split]
+        keep[farthest] = True
+        starts = np.concatenate((starts[split], farthest))
+        ends = np.concatenate((farthest, ends[split]))
+    return keep
+
+
+def simplify_track(lats, lons, tolerance=None, zoom=None):
+    """
+    Маска упрощения трека. tolerance - допуск в метрах, либо zoom - уровень карты,
+    тогда допуск равен размеру одного пикселя на средней широте трека.
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    if tolerance is None:
+        if zoom is None or lats.size == 0:
+            return np.ones(lats.size, dtype=bool)
+        tolerance = zoom_tolerance(zoom, lats.mean())
+    xs, ys = project(lats, lons)
+    return douglas_peucker(xs, ys, tolerance)
+
+
+def simplify_route_points(route_points, tolerance=None, zoom=None):
+    """id точек маршрута, оставшихся после упрощения. route_points - queryset точек одного трека."""
+    ids, lats, lons = [], [], []
+    for point_id, point in route_points.order_by('datetime').values_list('id', 'point').iterator(chunk_size=2000):
+        ids.append(point_id)
+        lats.append(point.y)
+        lons.append(point.x)
+    keep = simplify_track(lats, lons, tolerance, zoom)
+    return np.asarray(ids, dtype=np.int64)[keep].tolist()
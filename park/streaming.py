@@ -0,0 +1,55 @@
+import json
+
+from rest_framework.fields import DateTimeField
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework_gis.fields import GeometryField
+
+
+def dumps(data):
+    # Те же параметры, что у JSONRenderer по умолчанию, чтобы поток совпадал с обычным ответом побайтно
+    ret = json.dumps(data, cls=JSONEncoder, ensure_ascii=False, allow_nan=False, separators=(',', ':'))
+    return ret.replace('\u2028', '\\u2028').replace('\u2029', '\\u2029')
+
+
+def stream_route_points(route_points, ent_tz, geojson=False, chunk_size=2000):
+    """
+    Отдаёт точки маршрута кусками JSON по мере чтения из базы. Формат совпадает с
+    RoutePointSerializer (массив) или GeoRoutePointSerializer (FeatureCollection).
+    """
+    rows = route_points.values_list('point', 'datetime').iterator(chunk_size=chunk_size)
+    return stream_point_rows(rows, ent_tz, geojson=geojson, chunk_size=chunk_size)
+
+
+def stream_point_rows(rows, ent_tz, geojson=False, chunk_size=2000):
+    """То же для любого упорядоченного потока пар (point, datetime), например из архива."""
+    geometry_field = GeometryField()
+    datetime_field = DateTimeField()
+
+    if geojson:
+        yield '{"type":"FeatureCollection","features":['
+    else:
+        yield '['
+
+    items = []
+    first_chunk = True
+    for point, point_dt in rows:
+        local_dt = str(point_dt.astimezone(ent_tz))
+        if geojson:
+            item = {
+                'type': 'Feature',
+                'geometry': geometry_field.to_representation(point),
+                'properties': {'datetime': datetime_field.to_representation(point_dt)},
+                'datetime': local_dt,
+            }
+        else:
+            item = {'point': geometry_field.to_representation(point), 'datetime': local_dt}
+        items.append(dumps(item))
+
+        if len(items) >= chunk_size:
+            yield ('' if first_chunk else ',') + ','.join(items)
+            items = []
+            first_chunk = False
+
+    if items:
+        yield ('' if first_chunk else ',') + ','.join(items)
+    yield ']}' if geojson else ']'
@@ -0,0 +1,85 @@
+import numpy as np
+from django.contrib.gis.geos import Point, Polygon
+from django.utils import timezone
+
+from .distance import segment_distances
+from .models import RetentionState, RoutePoint, Travel
+
+SUMMARY_FIELDS = ('distance_km', 'point_count', 'max_speed_kmh', 'bbox', 'start_point', 'end_point',
+                  'summarized_at')
+
+
+def apply_summary(travel, datetimes, lats, lons):
+    """Заполняет сводные поля поездки по упорядоченным по времени точкам её трека."""
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    travel.point_count = len(lats)
+    travel.summarized_at = timezone.now()
+    if not travel.point_count:
+        travel.distance_km = 0
+        travel.max_speed_kmh = None
+        travel.bbox = travel.start_point = travel.end_point = None
+        return travel
+
+    distances = segment_distances(lats, lons)
+    travel.distance_km = float(distances.sum())
+    hours = np.array([(end - begin).total_seconds() for begin, end in zip(datetimes, datetimes[1:])]) / 3600
+    # Отрезки с нулевой длительностью (дубли по времени) скорость не определяют
+    moving = hours > 0
+    travel.max_speed_kmh = float((distances[moving] / hours[moving]).max()) if moving.any() else None
+    travel.bbox = Polygon.from_bbox((lons.min(), lats.min(), lons.max(), lats.max()))
+    travel.bbox.srid = 4326
+    travel.start_point = Point(lons[0], lats[0], srid=4326)
+    travel.end_point = Point(lons[-1], lats[-1], srid=4326)
+    return travel
+
+
+def summarize_travel(travel, save=True):
+    """Считает сводку одной поездки, например при её закрытии."""
+    datetimes, lats, lons = [], [], []
+    for point_dt, point in RoutePoint.objects.filter(travel=travel).order_by('datetime')\
+            .values_list('datetime', 'point').iterator(chunk_size=2000):
+        datetimes.append(point_dt)
+        lats.append(point.y)
+        lons.append(point.x)
+    apply_summary(travel, datetimes, lats, lons)
+    if save:
+        travel.save(update_fields=SUMMARY_FIELDS)
+    return travel
+
+
+def summarize_travels(travels, chunk_size=2000, batch_size=500):
+    """
+    Пересчитывает сводки набора поездок: точки всех поездок читаются одним упорядоченным потоком
+    по индексу (travel, datetime), поездки сохраняются через bulk_update. Возвращает число поездок.
+    """
+    # Сводки поездок, начавшихся в прореженные или архивные сутки, посчитаны раньше и не пересчитываются
+    history_before = RetentionState.get_history_before()
+    travels = {travel.id: travel for travel in travels
+               if history_before is None or travel.summarized_at is None or travel.begin >= history_before}
+    if not travels:
+        return 0
+    route_points = RoutePoint.objects.filter(travel_id__in=travels.keys()).order_by('travel_id', 'datetime')\
+        .values_list('travel_id', 'datetime', 'point').iterator(chunk_size=chunk_size)
+
+    current_id = None
+    empty = set(travels)
+    datetimes, lats, lons = [], [], []
+    for travel_id, point_dt, point in route_points:
+        if travel_id != current_id:
+            if current_id is not None:
+                apply_summary(travels[current_id], datetimes, lats, lons)
+            current_id = travel_id
+            empty.discard(travel_id)
+            datetimes, lats, lons = [], [], []
+        datetimes.append(point_dt)
+        lats.append(point.y)
+        lons.append(point.x)
+    if current_id is not None:
+        apply_summary(travels[current_id], datetimes, lats, lons)
+
+    # Поездки без единой точки получают пустую сводку
+    for travel_id in empty:
+        apply_summary(travels[travel_id], [], [], [])
+    Travel.objects.bulk_update(travels.values(), SUMMARY_FIELDS, batch_size=batch_size)
+    return len(travels)
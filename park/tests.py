@@ -1,3 +1,51 @@
+import asyncio
+import io
+import os
+import tempfile
+from datetime import date, datetime, timedelta, timezone
+from unittest import mock
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.contrib.gis.geos import Point
+from django.db.models import Max
+from django.db import IntegrityError, OperationalError, connection
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase, TestCase
+from django.db.models.signals import post_delete
+from django.test.utils import CaptureQueriesContext
+from geopy.distance import geodesic
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from autopark import settings
+from park.archive import fetch_vehicle_month, run_archive
+from park.report_cache import ReportCache, VEHICLE, ENTERPRISE
+from park.reports import ReportCancelled, TrackReport
+from park.encoding import decode_polyline, from_binary
+from park.distance import segment_distances, cumulative_distances, total_distance, haversine, HAVERSINE, VINCENTY
+from park.fleet_index import FleetPositions
+from park.geocoding import Geocoder, OfflineProvider
+from park.ingest import IngestError, ingest_route_points
+from park.jobs import submit_report_job, cancel_report_job, run_report_job, refresh_report_job, is_job_stopped
+from park.heatmap import BINS, update_heatmaps, get_tile_counts, get_bins, get_watermark
+from park.models import Enterprise, Vehicle, RoutePoint, Travel, GeocodeCache, HeatmapTile, DailyMileage, \
+    ArchivedMonth, Driver, Manufacturer, Model, ReportJob, VehiclePosition, HeatmapState
+from park.parsers import RoutePointCSVParser
+from park.positions import update_positions
+from park.retention import run_retention
+from park.routing import CachedRouter, SyntheticRouter
+from park.rollups import rebuild_daily_mileage, refresh_daily_mileage
+from park.simplify import douglas_peucker, simplify_route_points, simplify_track
+from park.summaries import summarize_travel, summarize_travels
+from park.tracks import VehicleTrack
+from park.travels import assign_travels
+from park.write_buffer import WriteBehindBuffer, BufferFull
+from park.segmentation import get_segmenter_options, segment_vehicle
+from park.streaming import stream_route_points
+from park.serializers import VehicleSerializer, RoutePointSerializer, GeoRoutePointSerializer, TravelSerializer, \
+    get_tzinfo
+
 # from django.test import TestCase
 #
 # from park.models import Driver, Vehicle, Manufacturer, Model, Enterprise
@@ -54,3 +102,1222 @@
 #             if len(car.drivers) > 1:
 #                 car.active_driver = choice(car.drivers)
 #                 car.save()
+
+
+class DistanceKernelTest(SimpleTestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(2023)
+        self.lats = rng.uniform(-80, 80, 500)
+        self.lons = rng.uniform(-180, 180, 500)
+        self.expected = np.array([geodesic((lat1, lon1), (lat2, lon2)).km for lat1, lon1, lat2, lon2 in
+                                  zip(self.lats[:-1], self.lons[:-1], self.lats[1:], self.lons[1:])])
+
+    def test_vincenty_matches_geopy(self):
+        distances = segment_distances(self.lats, self.lons, VINCENTY)
+        np.testing.assert_allclose(distances, self.expected, rtol=0, atol=1e-6)
+
+    def test_haversine_within_spherical_error(self):
+        distances = segment_distances(self.lats, self.lons, HAVERSINE)
+        np.testing.assert_allclose(distances, self.expected, rtol=6e-3)
+
+    def test_nearly_antipodal_points(self):
+        distance = segment_distances([0, 0.5], [0, 179.7], VINCENTY)[0]
+        self.assertAlmostEqual(distance, geodesic((0, 0), (0.5, 179.7)).km, places=6)
+
+    def test_cumulative_and_total(self):
+        cumulative = cumulative_distances(self.lats, self.lons)
+        self.assertEqual(cumulative.shape, self.lats.shape)
+        self.assertEqual(cumulative[0], 0)
+        self.assertAlmostEqual(cumulative[-1], total_distance(self.lats, self.lons))
+        self.assertAlmostEqual(total_distance(self.lats, self.lons), self.expected.sum(), places=4)
+
+    def test_degenerate_tracks(self):
+        self.assertEqual(total_distance([], []), 0)
+        self.assertEqual(total_distance([57.8], [28.3]), 0)
+        self.assertEqual(total_distance([57.8, 57.8], [28.3, 28.3]), 0)
+        self.assertEqual(len(cumulative_distances([], [])), 0)
+
+
+class SerializerQueryCountTest(TestCase):
+    points_per_vehicle = 25
+
+    @classmethod
+    def setUpTestData(cls):
+        start = datetime(2023, 3, 1, 9, tzinfo=timezone.utc)
+        cls.enterprises = [
+            Enterprise.objects.create(name='Автопарк', city='Псков', country='Россия', timezone='Europe/Moscow'),
+            Enterprise.objects.create(name='Таксопарк', city='Омск', country='Россия', timezone='Asia/Omsk'),
+        ]
+        cls.vehicles = [
+            Vehicle.objects.create(cost=100000, odometer=1000, year=2020, color='серый', number_plate='A%03dAA' % i,
+                                   enterprise=cls.enterprises[i % 2])
+            for i in range(4)
+        ]
+        RoutePoint.objects.bulk_create([
+            RoutePoint(vehicle=vehicle, point=Point(28.3 + i * 0.001, 57.8),
+                       datetime=start + timedelta(seconds=30 * i))
+            for vehicle in cls.vehicles for i in range(cls.points_per_vehicle)
+        ])
+        Travel.objects.bulk_create([
+            Travel(vehicle=vehicle, begin=start + timedelta(days=day), end=start + timedelta(days=day, hours=2))
+            for vehicle in cls.vehicles for day in range(5)
+        ])
+
+    def test_route_points_with_request_timezone(self):
+        vehicle = self.vehicles[0]
+        route_points = RoutePoint.objects.filter(vehicle=vehicle)
+        context = {'timezone': get_tzinfo(vehicle.enterprise.timezone)}
+        with self.assertNumQueries(1):
+            data = RoutePointSerializer(route_points, many=True, context=context).data
+        self.assertEqual(len(data), self.points_per_vehicle)
+        self.assertTrue(data[0]['datetime'].endswith('+03:00'))
+        with self.assertNumQueries(1):
+            data = GeoRoutePointSerializer(route_points, many=True, context=context).data
+        self.assertEqual(len(data['features']), self.points_per_vehicle)
+
+    def test_route_points_of_many_vehicles(self):
+        route_points = RoutePoint.objects.select_related('vehicle__enterprise')
+        with self.assertNumQueries(1):
+            data = RoutePointSerializer(route_points, many=True).data
+        self.assertEqual(len(data), self.points_per_vehicle * len(self.vehicles))
+        self.assertEqual({row['datetime'][-6:] for row in data}, {'+03:00', '+06:00'})
+
+    def test_travels(self):
+        with self.assertNumQueries(1):
+            data = TravelSerializer(Travel.objects.select_related('vehicle__enterprise'), many=True).data
+        self.assertEqual(len(data), 5 * len(self.vehicles))
+
+    def test_vehicles(self):
+        with self.assertNumQueries(1):
+            data = VehicleSerializer(Vehicle.objects.select_related('enterprise', 'active_driver'), many=True).data
+        self.assertEqual(len(data), len(self.vehicles))
+
+
+class GeocoderTest(TestCase):
+
+    def setUp(self):
+        self.provider = OfflineProvider()
+        self.geocoder = Geocoder(self.provider, digits=3, lru_size=100, workers=2, rate=0)
+
+    def test_points_in_one_cell_are_geocoded_once(self):
+        addresses = self.geocoder.reverse_many([(57.81931, 28.33241), (57.81949, 28.33238), (56.83801, 60.59747)])
+        self.assertEqual(self.provider.calls, 2)
+        self.assertEqual(addresses[(57.81931, 28.33241)], addresses[(57.81949, 28.33238)])
+        self.assertEqual(GeocodeCache.objects.count(), 2)
+
+    def test_lru_and_table_hits(self):
+        self.geocoder.reverse(57.81931, 28.33241)
+        with self.assertNumQueries(0):
+            self.geocoder.reverse(57.81931, 28.33241)
+
+        # Новый процесс с пустым LRU берёт адрес из таблицы, а не из сервиса
+        geocoder = Geocoder(self.provider, digits=3, lru_size=100, workers=2, rate=0)
+        with self.assertNumQueries(1):
+            address = geocoder.reverse(57.81931, 28.33241)
+        self.assertEqual(address, '57.81900, 28.33200')
+        self.assertEqual(self.provider.calls, 1)
+
+
+class HeatmapTest(TestCase):
+
+    def setUp(self):
+        self.enterprise = Enterprise.objects.create(name='Автопарк', city='Псков', country='Россия',
+                                                    timezone='Europe/Moscow')
+        self.vehicle = Vehicle.objects.create(cost=100000, odometer=1000, year=2020, color='серый',
+                                              number_plate='A001AA', enterprise=self.enterprise)
+        self.start = datetime(2023, 3, 1, 9, tzinfo=timezone.utc)
+
+    def add_points(self, count):
+        RoutePoint.objects.bulk_create([
+            RoutePoint(vehicle=self.vehicle, point=Point(28.33241, 57.81931), datetime=self.start + timedelta(seconds=i))
+            for i in range(count)
+        ])
+
+    def test_update_processes_only_new_points(self):
+        self.add_points(10)
+        self.assertEqual(update_heatmaps([9]), 10)
+        self.assertEqual(update_heatmaps([9]), 0)
+        self.add_points(5)
+        self.assertEqual(update_heatmaps([9]), 5)
+
+        xs, ys = get_bins(np.array([57.81931]), np.array([28.33241]), 9)
+        x, y = int(xs[0]) // BINS, int(ys[0]) // BINS
+        self.assertEqual(HeatmapTile.objects.count(), 1)
+        counts, total = get_tile_counts(self.enterprise.id, 9, x, y, self.start.date(), self.start.date())
+        self.assertEqual(total, 15)
+        self.assertEqual(counts[(int(ys[0]) % BINS) * BINS + int(xs[0]) % BINS], 15)
+
+    def hold_back_points(self):
+        # Две точки из середины пачки как будто ещё в незакоммиченной транзакции: их id уже выданы
+        self.add_points(10)
+        ids = list(RoutePoint.objects.order_by('id').values_list('id', flat=True))[3:5]
+        late = list(RoutePoint.objects.filter(id__in=ids))
+        RoutePoint.objects.filter(id__in=ids).delete()
+        return late
+
+    def test_late_committed_points_are_added(self):
+        late = self.hold_back_points()
+        self.assertEqual(update_heatmaps([9]), 8)
+        watermark = get_watermark()
+        self.assertEqual(HeatmapState.objects.get().gap_ids, [point.id for point in late])
+
+        RoutePoint.objects.bulk_create(late)
+        self.assertEqual(update_heatmaps([9]), 2)
+        self.assertEqual(update_heatmaps([9]), 0)
+        self.assertNotEqual(get_watermark(), watermark)
+        self.assertEqual(HeatmapState.objects.get().gap_ids, [])
+        self.assertEqual(HeatmapTile.objects.get().total, 10)
+
+    def test_gaps_outside_the_window_are_forgotten(self):
+        late = self.hold_back_points()
+        self.assertEqual(update_heatmaps([9], gap_window=3), 8)
+        self.assertEqual(HeatmapState.objects.get().gap_ids, [])
+        RoutePoint.objects.bulk_create(late)
+        self.assertEqual(update_heatmaps([9], gap_window=3), 0)
+        self.assertEqual(HeatmapTile.objects.get().total, 8)
+
+
+class RetentionTest(TestCase):
+
+    def setUp(self):
+        enterprise = Enterprise.objects.create(name='Автопарк', city='Псков', country='Россия',
+                                               timezone='Europe/Moscow')
+        self.vehicle = Vehicle.objects.create(cost=100000, odometer=1000, year=2020, color='серый',
+                                              number_plate='A001AA', enterprise=enterprise)
+        start = datetime.now(timezone.utc).replace(hour=6, minute=0, second=0, microsecond=0) - timedelta(days=200)
+        self.travel = Travel.objects.create(vehicle=self.vehicle, begin=start, end=start + timedelta(hours=2))
+        # Два часа точек раз в 30 секунд по слегка извилистой линии
+        RoutePoint.objects.bulk_create([
+            RoutePoint(vehicle=self.vehicle, travel=self.travel, datetime=start + timedelta(seconds=30 * i),
+                       point=Point(28.3 + i * 0.0005, 57.8 + 0.00005 * np.sin(i / 3)))
+            for i in range(240)
+        ])
+        rebuild_daily_mileage(start.date(), start.date())
+        summarize_travels([self.travel])
+
+    def test_downsampling_keeps_distances(self):
+        km = DailyMileage.objects.get(vehicle=self.vehicle).km
+        distance = Travel.objects.get(pk=self.travel.pk).distance_km
+
+        days, deleted = run_retention(raw_days=90, interval=600, tolerance=20, batch_size=50, pause=0)
+        self.assertGreater(deleted, 200)
+        self.assertFalse(RoutePoint.objects.filter(tier=RoutePoint.RAW).exists())
+
+        # Повторный пересчёт пробегов и сводок по оставшимся точкам прореженные сутки не трогает
+        rebuild_daily_mileage(self.travel.begin.date(), self.travel.begin.date())
+        summarize_travels(Travel.objects.all())
+        self.assertAlmostEqual(DailyMileage.objects.get(vehicle=self.vehicle).km, km)
+        self.assertAlmostEqual(Travel.objects.get(pk=self.travel.pk).distance_km, distance)
+
+
+class ArchiveTest(TestCase):
+
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        patcher = mock.patch.object(settings, 'ARCHIVE_ROOT', root.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        enterprise = Enterprise.objects.create(name='Автопарк', city='Псков', country='Россия',
+                                               timezone='Europe/Moscow')
+        self.vehicle = Vehicle.objects.create(cost=100000, odometer=1000, year=2020, color='серый',
+                                              number_plate='A001AA', enterprise=enterprise)
+        today = datetime.now(timezone.utc)
+        self.old = datetime(today.year - 2, today.month, 3, 8, tzinfo=timezone.utc)
+        self.recent = today - timedelta(days=1)
+        RoutePoint.objects.bulk_create([
+            RoutePoint(vehicle=self.vehicle, datetime=start + timedelta(seconds=30 * i),
+                       point=Point(28.3 + i * 0.0005, 57.8 + i * 0.0001))
+            for start in (self.old, self.recent) for i in range(100)
+        ])
+        rebuild_daily_mileage(self.old.date(), self.recent.date())
+
+    def test_archived_points_are_read_transparently(self):
+        begin, end = self.old - timedelta(days=1), self.recent + timedelta(days=1)
+        expected = list(VehicleTrack(self.vehicle.id, begin, end).iter_points())
+
+        months, deleted = run_archive(after_months=12, pause=0)
+        self.assertEqual(deleted, 100)
+        self.assertEqual(RoutePoint.objects.count(), 100)
+        self.assertEqual(ArchivedMonth.objects.get().point_count, 100)
+
+        track = VehicleTrack(self.vehicle.id, begin, end)
+        self.assertEqual(len(track.archived_tracks), 1)
+        points = list(track.iter_points())
+        self.assertEqual([point_dt for point_dt, _, _ in points], [point_dt for point_dt, _, _ in expected])
+        np.testing.assert_allclose([point[1:] for point in points], [point[1:] for point in expected], atol=1e-7)
+
+    def test_only_archived_days_are_invalidated(self):
+        # Машина без точек в архивируемом месяце не читается и не сбрасывается
+        Vehicle.objects.create(cost=100000, odometer=1000, year=2020, color='серый', number_plate='A002AA',
+                               enterprise=self.vehicle.enterprise)
+        cache = mock.Mock()
+        with mock.patch('park.archive.caches_by_window', [cache]), \
+                mock.patch('park.archive.fetch_vehicle_month', wraps=fetch_vehicle_month) as fetch:
+            self.assertEqual(run_archive(after_months=12, pause=0)[1], 100)
+        self.assertEqual(fetch.call_count, 1)
+        day = datetime(self.old.year, self.old.month, self.old.day, tzinfo=timezone.utc)
+        cache.invalidate_vehicle.assert_called_once_with(self.vehicle.id, self.vehicle.enterprise_id, day, day)
+
+
+class RouterTest(SimpleTestCase):
+    coord_from, coord_to = [28.332460, 57.819274], [32.045287, 54.782635]
+
+    def test_synthetic_route_is_deterministic_and_plausible(self):
+        route = SyntheticRouter().route(self.coord_from, self.coord_to)
+        self.assertEqual(route, SyntheticRouter().route(self.coord_from, self.coord_to))
+        self.assertEqual(route.coordinates[0], self.coord_from)
+        self.assertEqual(route.coordinates[-1], self.coord_to)
+        self.assertEqual(route.times[-1][1], len(route.coordinates) - 1)
+        self.assertEqual(sum(ms for _, _, ms in route.times), route.time)
+
+        lons, lats = np.array(route.coordinates).T
+        km = total_distance(lats, lons, HAVERSINE)
+        straight_km = total_distance([lats[0], lats[-1]], [lons[0], lons[-1]], HAVERSINE)
+        self.assertTrue(1.05 < km / straight_km < 1.5)
+        self.assertTrue(50 < km / (route.time / 3600000) < 100)
+
+    def test_cache_serves_route_without_router(self):
+        router = mock.Mock(wraps=SyntheticRouter(), name='router')
+        router.name = 'synthetic'
+        router.get_params.return_value = {}
+        with tempfile.TemporaryDirectory() as cache_dir:
+            route = CachedRouter(router, cache_dir).route(self.coord_from, self.coord_to)
+            cached = CachedRouter(router, cache_dir)
+            self.assertEqual(cached.route(self.coord_from, self.coord_to), route)
+            self.assertEqual(router.route.call_count, 1)
+            self.assertEqual(cached.hits, 1)
+
+
+class GenerateRandomObjectsTest(TestCase):
+    def setUp(self):
+        self.enterprise = Enterprise.objects.create(name='Автопарк', city='Псков', country='Россия')
+        Manufacturer.objects.create(title='Лада')
+        Model.objects.create(title='Веста')
+
+    def generate(self, seed):
+        call_command('generate_random_objects', self.enterprise.id, car_number=30, driver_number=95, batch=20,
+                     seed=seed, stdout=open(os.devnull, 'w'))
+
+    def test_objects_are_linked_within_enterprise(self):
+        self.generate(seed=1)
+        self.assertEqual(Vehicle.objects.filter(enterprise=self.enterprise, model__title='Веста').count(), 30)
+        self.assertEqual(Driver.objects.filter(enterprise=self.enterprise).count(), 95)
+        self.assertEqual(Driver.objects.filter(car__isnull=True).count(), 10)
+        self.assertFalse(Driver.objects.exclude(car__isnull=True).exclude(car__enterprise=self.enterprise).exists())
+        for vehicle in Vehicle.objects.prefetch_related('drivers'):
+            drivers = list(vehicle.drivers.all())
+            if drivers:
+                self.assertIn(vehicle.active_driver, drivers)
+            else:
+                self.assertIsNone(vehicle.active_driver)
+
+    def test_seed_reproduces_objects(self):
+        self.generate(seed=7)
+        first = list(Driver.objects.order_by('id').values_list('last_name', 'age'))
+        Vehicle.objects.all().delete()
+        Driver.objects.all().delete()
+        self.generate(seed=7)
+        self.assertEqual(list(Driver.objects.order_by('id').values_list('last_name', 'age')), first)
+
+
+class TrackReportTest(TestCase):
+    """Точки идут вдоль меридиана, поэтому пробег за период равен длине дуги между крайними широтами."""
+    lon = 28.3
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.enterprise = Enterprise.objects.create(name='Автопарк', city='Псков', country='Россия')
+        cls.vehicle = Vehicle.objects.create(cost=100000, odometer=1000, year=2020, color='серый',
+                                             number_plate='A001AA', enterprise=cls.enterprise)
+        cls.add_day(cls.vehicle, datetime(2023, 1, 30, tzinfo=timezone.utc), [57.0, 57.1, 57.3])
+        cls.add_day(cls.vehicle, datetime(2023, 2, 2, tzinfo=timezone.utc), [57.3, 57.4, 57.5])
+        cls.add_day(cls.vehicle, datetime(2024, 1, 5, tzinfo=timezone.utc), [58.0, 58.2, 58.5])
+        # Вторая машина предприятия - для отчёта по всему предприятию
+        other = Vehicle.objects.create(cost=100000, odometer=1000, year=2021, color='серый', number_plate='A002AA',
+                                       enterprise=cls.enterprise)
+        cls.add_day(other, datetime(2023, 1, 30, tzinfo=timezone.utc), [56.0, 56.2, 56.3])
+        cls.add_day(other, datetime(2023, 3, 1, tzinfo=timezone.utc), [56.3, 56.1])
+        rebuild_daily_mileage(date(2023, 1, 1), date(2024, 12, 31))
+
+    @classmethod
+    def add_day(cls, vehicle, day, lats):
+        Travel.objects.create(vehicle=vehicle, begin=day + timedelta(hours=10), end=day + timedelta(hours=12))
+        RoutePoint.objects.bulk_create([
+            RoutePoint(vehicle=vehicle, datetime=day + timedelta(hours=10, minutes=30 * (i + 1)),
+                       point=Point(cls.lon, lat))
+            for i, lat in enumerate(lats)
+        ])
+
+    def arc(self, lat1, lat2):
+        return geodesic((lat1, self.lon), (lat2, self.lon)).km
+
+    def get_track_report(self, report_type):
+        return TrackReport(report_type, datetime(2023, 1, 1, tzinfo=timezone.utc),
+                           datetime(2025, 1, 1, tzinfo=timezone.utc))
+
+    def get_report(self, report_type):
+        return self.get_track_report(report_type).generate_report(self.vehicle.id)
+
+    def assertRows(self, rows, expected):
+        self.assertEqual([row[:2] for row in rows], [row[:2] for row in expected])
+        np.testing.assert_allclose([row[2] for row in rows], [row[2] for row in expected], atol=0.006)
+
+    def test_daily(self):
+        self.assertRows(self.get_report(TrackReport.ReportType.DAILY.value), [
+            ['2023-01-30 10:00:00+00:00', '2023-01-30 23:59:59+00:00', self.arc(57.0, 57.3)],
+            ['2023-02-02 00:00:00+00:00', '2023-02-02 23:59:59+00:00', self.arc(57.3, 57.5)],
+            ['2024-01-05 00:00:00+00:00', '2024-01-05 23:59:59+00:00', self.arc(58.0, 58.5)],
+        ])
+
+    def test_monthly(self):
+        self.assertRows(self.get_report(TrackReport.ReportType.MONTHLY.value), [
+            ['2023-01-30 10:00:00+00:00', '2023-01-31 23:59:59+00:00', self.arc(57.0, 57.3)],
+            ['2023-02-01 00:00:00+00:00', '2023-02-28 23:59:59+00:00', self.arc(57.3, 57.5)],
+            ['2024-01-01 00:00:00+00:00', '2024-01-31 23:59:59+00:00', self.arc(58.0, 58.5)],
+        ])
+
+    def test_yearly(self):
+        self.assertRows(self.get_report(TrackReport.ReportType.YEARLY.value), [
+            ['2023-01-30 10:00:00+00:00', '2023-12-31 23:59:59+00:00', self.arc(57.0, 57.5)],
+            ['2024-01-01 00:00:00+00:00', '2024-12-31 23:59:59+00:00', self.arc(58.0, 58.5)],
+        ])
+
+    def test_cancelled_report_stops(self):
+        checks = []
+        report = TrackReport(TrackReport.ReportType.DAILY.value, datetime(2023, 1, 1, tzinfo=timezone.utc),
+                             datetime(2025, 1, 1, tzinfo=timezone.utc), is_cancelled=lambda: checks.append(1) or True)
+        with self.assertRaises(ReportCancelled):
+            report.generate_report(self.vehicle.id)
+        with self.assertRaises(ReportCancelled):
+            report.generate_full_enterprise_report(self.enterprise.id, workers=1)
+        self.assertEqual(len(checks), 2)
+
+    def test_enterprise_report_in_pool_matches_serial(self):
+        report = self.get_track_report(TrackReport.ReportType.DAILY.value)
+        serial = report.generate_full_enterprise_report(self.enterprise.id, workers=1)
+        self.assertEqual(len(serial), 2)
+        self.assertEqual(report.generate_full_enterprise_report(self.enterprise.id, workers=2), serial)
+
+
+class DailyMileageTest(TestCase):
+
+    def setUp(self):
+        enterprise = Enterprise.objects.create(name='Автопарк', city='Псков', country='Россия')
+        self.vehicle = Vehicle.objects.create(cost=100000, odometer=1000, year=2020, color='серый',
+                                              number_plate='A001AA', enterprise=enterprise)
+        # Трек через полночь UTC; одна точка приходит с опозданием в середину уже посчитанного дня
+        start = datetime(2023, 3, 1, 23, 40, tzinfo=timezone.utc)
+        self.points = [(start + timedelta(minutes=2 * i), 57.8 + 0.003 * i, 28.3 + 0.002 * (i % 4))
+                       for i in range(20)]
+        self.late = self.points.pop(15)
+
+    def get_rows(self):
+        return list(DailyMileage.objects.order_by('day').values_list('day', 'km', 'point_count', 'first_ts', 'last_ts'))
+
+    def assertSameRows(self, rows, expected):
+        self.assertEqual([row[:1] + row[2:] for row in rows], [row[:1] + row[2:] for row in expected])
+        np.testing.assert_allclose([row[1] for row in rows], [row[1] for row in expected], rtol=1e-9)
+
+    def test_incremental_and_full_rebuild_agree(self):
+        # Одиночные точки: сигнал сохранения дописывает их к суточному пробегу по одной
+        for point_dt, lat, lon in self.points + [self.late]:
+            RoutePoint.objects.create(vehicle=self.vehicle, datetime=point_dt, point=Point(lon, lat))
+        registered = self.get_rows()
+        self.assertEqual([row[2] for row in registered], [10, 10])
+
+        DailyMileage.objects.all().delete()
+        refresh_daily_mileage(list(RoutePoint.objects.all()))
+        self.assertSameRows(self.get_rows(), registered)
+
+        DailyMileage.objects.all().delete()
+        rebuild_daily_mileage(date(2023, 3, 1), date(2023, 3, 2))
+        self.assertSameRows(self.get_rows(), registered)
+
+    def test_point_in_the_middle_of_the_day_is_added_incrementally(self):
+        for point_dt, lat, lon in self.points:
+            RoutePoint.objects.create(vehicle=self.vehicle, datetime=point_dt, point=Point(lon, lat))
+        with mock.patch('park.rollups.rebuild_daily_mileage') as rebuild:
+            point_dt, lat, lon = self.late
+            RoutePoint.objects.create(vehicle=self.vehicle, datetime=point_dt, point=Point(lon, lat))
+            # Точка с тем же временем, что у уже сохранённой
+            point_dt, lat, lon = self.points[12]
+            RoutePoint.objects.create(vehicle=self.vehicle, datetime=point_dt, point=Point(lon + 0.01, lat))
+        rebuild.assert_not_called()
+        registered = self.get_rows()
+        self.assertEqual([row[2] for row in registered], [10, 11])
+
+        DailyMileage.objects.all().delete()
+        rebuild_daily_mileage(date(2023, 3, 1), date(2023, 3, 2))
+        self.assertSameRows(self.get_rows(), registered)
+
+
+class ReportCacheTest(SimpleTestCase):
+
+    def setUp(self):
+        self.cache = ReportCache('default', prefix='test-report', enabled=True)
+        self.cache.cache.clear()
+        self.day = datetime(2023, 3, 1, tzinfo=timezone.utc)
+        self.calls = 0
+
+    def compute(self):
+        self.calls += 1
+        return [self.calls]
+
+    def get(self, scope, owner_id, begin_days, end_days):
+        return self.cache.get_or_set(scope, owner_id, 'daily', self.day + timedelta(days=begin_days),
+                                     self.day + timedelta(days=end_days), self.compute)
+
+    def test_invalidation_by_window_overlap(self):
+        self.assertEqual(self.get(VEHICLE, 1, 0, 2), [1])
+        self.assertEqual(self.get(VEHICLE, 1, 5, 6), [2])
+        self.assertEqual(self.get(VEHICLE, 2, 0, 2), [3])
+        self.assertEqual(self.get(ENTERPRISE, 7, 0, 6), [4])
+
+        # Изменение в сутках 1 машины 1 сбрасывает только её пересекающийся отчёт и отчёт её предприятия
+        changed = self.day + timedelta(days=1, hours=12)
+        self.assertEqual(self.cache.invalidate_vehicle(1, 7, changed, changed), 2)
+        self.assertEqual(self.get(VEHICLE, 1, 0, 2), [5])
+        self.assertEqual(self.get(VEHICLE, 1, 5, 6), [2])
+        self.assertEqual(self.get(VEHICLE, 2, 0, 2), [3])
+        self.assertEqual(self.get(ENTERPRISE, 7, 0, 6), [6])
+
+        # Сутки, отчётов по которым ещё не считали, сбрасывать нечего
+        self.assertEqual(self.cache.invalidate(VEHICLE, 1, self.day + timedelta(days=10),
+                                               self.day + timedelta(days=11)), 0)
+
+    def test_stats(self):
+        self.get(VEHICLE, 1, 0, 2)
+        self.get(VEHICLE, 1, 0, 2)
+        self.get(VEHICLE, 1, 0, 2)
+        self.assertEqual(self.cache.stats(), {'enabled': True, 'hits': 2, 'misses': 1, 'hit_ratio': 0.6667})
+
+    def test_disabled_cache_computes_every_time(self):
+        self.cache.enabled = False
+        self.assertEqual(self.get(VEHICLE, 1, 0, 2), [1])
+        self.assertEqual(self.get(VEHICLE, 1, 0, 2), [2])
+        self.assertEqual(self.cache.invalidate(VEHICLE, 1, self.day, self.day), 0)
+        self.assertEqual(self.cache.stats()['hits'], 0)
+
+
+class ReportJobTest(TestCase):
+    """Пул задач подменён: задачи не уходят в потоки, run_report_job вызывается в тесте явно."""
+
+    def setUp(self):
+        self.executor = mock.Mock()
+        for patcher in (mock.patch('park.jobs.get_executor', return_value=self.executor),
+                        mock.patch.dict('park.jobs._futures', clear=True),
+                        # Закрытие соединений после задачи оборвало бы транзакцию теста
+                        mock.patch('park.jobs.connections')):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.begin = datetime(2023, 3, 1, tzinfo=timezone.utc)
+        self.end = datetime(2023, 4, 1, tzinfo=timezone.utc)
+
+    def submit(self, owner_id=1):
+        with self.captureOnCommitCallbacks(execute=True):
+            return submit_report_job(ReportJob.VEHICLE, owner_id, TrackReport.ReportType.DAILY.value, self.begin,
+                                     self.end)
+
+    def test_job_is_started_after_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            job, _ = submit_report_job(ReportJob.VEHICLE, 1, TrackReport.ReportType.DAILY.value, self.begin, self.end)
+        self.executor.submit.assert_not_called()
+        for callback in callbacks:
+            callback()
+        self.executor.submit.assert_called_once_with(run_report_job, job.id)
+
+    def test_same_report_is_deduplicated(self):
+        job, created = self.submit()
+        self.assertTrue(created)
+        self.assertEqual(self.submit(), (job, False))
+        self.assertTrue(self.submit(owner_id=2)[1])
+        self.assertEqual(self.executor.submit.call_count, 2)
+
+        # Завершённая задача ключ не держит: тот же отчёт считается заново
+        with mock.patch('park.jobs.compute_report', return_value=[['a', 'b', 1.0]]):
+            run_report_job(job.id)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.active_key, job.result), (ReportJob.DONE, None, [['a', 'b', 1.0]]))
+        self.assertTrue(self.submit()[1])
+
+    def test_cancel(self):
+        job, _ = self.submit()
+        future = self.executor.submit.return_value
+        self.assertTrue(cancel_report_job(job))
+        future.cancel.assert_called_once_with()
+        self.assertFalse(cancel_report_job(job))
+
+        # Отменённая задача не запускается, а её ключ свободен для нового запроса
+        with mock.patch('park.jobs.compute_report') as compute_report:
+            run_report_job(job.id)
+        compute_report.assert_not_called()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.active_key), (ReportJob.CANCELLED, None))
+        self.assertTrue(self.submit()[1])
+
+    def test_running_job_stops_after_cancel(self):
+        job, _ = self.submit()
+
+        def cancel_while_running(running_job):
+            self.assertFalse(is_job_stopped(running_job.id))
+            cancel_report_job(running_job)
+            # Так расчёт видит отмену между порциями точек (TrackReport.is_cancelled)
+            self.assertTrue(is_job_stopped(running_job.id))
+            raise ReportCancelled()
+
+        with mock.patch('park.jobs.compute_report', side_effect=cancel_while_running):
+            run_report_job(job.id)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.result, job.error), (ReportJob.CANCELLED, None, ''))
+
+    def test_lost_job_expires_when_polled(self):
+        job, _ = self.submit()
+        self.assertEqual(refresh_report_job(job).status, ReportJob.PENDING)
+        lost_at = datetime.now(timezone.utc) - timedelta(seconds=settings.REPORT_JOB_TIMEOUT + 1)
+        ReportJob.objects.filter(pk=job.pk).update(status=ReportJob.RUNNING, created_at=lost_at)
+        job.refresh_from_db()
+        job = refresh_report_job(job)
+        self.assertEqual((job.status, job.active_key), (ReportJob.FAILED, None))
+        self.assertEqual(job.error, 'Job was lost or timed out.')
+
+
+class IngestTest(TestCase):
+
+    def setUp(self):
+        enterprise = Enterprise.objects.create(name='Автопарк', city='Псков', country='Россия')
+        self.vehicle = Vehicle.objects.create(cost=100000, odometer=1000, year=2020, color='серый',
+                                              number_plate='A001AA', enterprise=enterprise)
+        self.future = (datetime.now(timezone.utc) + timedelta(days=1)).isoformat()
+
+    def test_json_batch_with_rejected_rows(self):
+        vehicle_id = self.vehicle.id
+        result = ingest_route_points({'points': [
+            [vehicle_id, 28.3, 57.8, '2023-03-01T10:00:00Z'],
+            ['abc', 28.3, 57.8, '2023-03-01T10:01:00Z'],
+            [vehicle_id, 200, 57.8, '2023-03-01T10:02:00Z'],
+            [vehicle_id, 28.3, 'x', '2023-03-01T10:03:00Z'],
+            [vehicle_id, 28.3, 57.8, 'yesterday'],
+            [vehicle_id, 28.3, 57.8, self.future],
+            [vehicle_id + 1000, 28.3, 57.8, '2023-03-01T10:04:00Z'],
+            [vehicle_id, 28.3],
+            [vehicle_id, 28.31, 57.81, 1677665100],
+        ]})
+        self.assertEqual(result, {'received': 9, 'created': 2, 'rejected': 7, 'errors': [
+            {'row': 1, 'error': 'invalid vehicle_id'},
+            {'row': 2, 'error': 'invalid lon'},
+            {'row': 3, 'error': 'invalid lat'},
+            {'row': 4, 'error': 'invalid ts'},
+            {'row': 5, 'error': 'ts is in the future'},
+            {'row': 6, 'error': 'unknown vehicle or access denied'},
+            {'row': 7, 'error': 'invalid vehicle_id'},
+        ]})
+        self.assertEqual(list(RoutePoint.objects.order_by('datetime').values_list('datetime', flat=True)), [
+            datetime(2023, 3, 1, 10, tzinfo=timezone.utc), datetime(2023, 3, 1, 10, 5, tzinfo=timezone.utc),
+        ])
+
+        # Пачка, в которой не прошла ни одна строка, ничего не пишет
+        result = ingest_route_points({'vehicle_id': [vehicle_id], 'lon': [28.3], 'lat': [95], 'ts': [1677665400]})
+        self.assertEqual(result, {'received': 1, 'created': 0, 'rejected': 1,
+                                  'errors': [{'row': 0, 'error': 'invalid lat'}]})
+        self.assertEqual(RoutePoint.objects.count(), 2)
+
+    def test_csv_batch_with_rejected_rows(self):
+        body = '\n'.join([
+            'vehicle_id,lon,lat,ts',
+            '{0},28.3,57.8,2023-03-01T10:00:00'.format(self.vehicle.id),
+            '{0},28.3,57.8'.format(self.vehicle.id),
+            '{0},28.3,57.8,{1}'.format(self.vehicle.id, self.future),
+            '{0},28.31,57.81,1677665100'.format(self.vehicle.id),
+        ])
+        data = RoutePointCSVParser().parse(io.BytesIO(body.encode()))
+        self.assertEqual(ingest_route_points(data), {'received': 4, 'created': 2, 'rejected': 2, 'errors': [
+            {'row': 1, 'error': 'invalid vehicle_id'},
+            {'row': 2, 'error': 'ts is in the future'},
+        ]})
+        mileage = DailyMileage.objects.get(vehicle=self.vehicle)
+        self.assertEqual(mileage.point_count, 2)
+
+        # Следующая пачка продлевает суточный пробег, а не пересчитывает его
+        data = RoutePointCSVParser().parse(io.BytesIO(
+            'vehicle_id,lon,lat,ts\n{0},28.32,57.82,1677665400\n'.format(self.vehicle.id).encode()
+        ))
+        self.assertEqual(ingest_route_points(data)['created'], 1)
+        mileage.refresh_from_db()
+        self.assertEqual(mileage.point_count, 3)
+        self.assertAlmostEqual(mileage.km, geodesic((57.8, 28.3), (57.81, 28.31)).km +
+                               geodesic((57.81, 28.31), (57.82, 28.32)).km, places=5)
+
+    def test_missing_columns_and_too_large_batch(self):
+        with self.assertRaisesMessage(IngestError, 'Missing columns: ts'):
+            ingest_route_points({'vehicle_id': [], 'lon': [], 'lat': []})
+        with mock.patch.object(settings, 'INGEST_MAX_BATCH', 1), \
+                self.assertRaisesMessage(IngestError, 'Batch is too large: 2 points, at most 1 allowed'):
+            ingest_route_points([[self.vehicle.id, 28.3, 57.8, 1677665100]] * 2)
+
+
+class WriteBehindBufferTest(SimpleTestCase):
+    """Запись в базу подменена: проверяется только очередь буфера."""
+
+    def setUp(self):
+        patcher = mock.patch('park.write_buffer.flush_points')
+        self.flush_points = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.buffer = WriteBehindBuffer(max_points=10, flush_size=100, flush_interval=60, retry_delay=0,
+                                        max_retries=2)
+
+    def batch(self, count):
+        return np.arange(count), np.full(count, 28.3), np.full(count, 57.8), np.arange(count, dtype=np.float64)
+
+    def get_flushed(self):
+        return [len(call_args.args[0]) for call_args in self.flush_points.call_args_list]
+
+    async def test_full_buffer_rejects_batches(self):
+        self.assertEqual(self.buffer.put(*self.batch(8)), 8)
+        with self.assertRaisesMessage(BufferFull, 'Ingest buffer is full'):
+            self.buffer.put(*self.batch(3))
+        self.assertEqual(self.buffer.put(*self.batch(2)), 2)
+        stats = self.buffer.get_stats()
+        self.assertEqual((stats['accepted'], stats['rejected'], stats['buffered']), (10, 3, 10))
+        await self.buffer.close(timeout=5)
+
+    async def test_close_drains_buffer(self):
+        self.buffer.put(*self.batch(4))
+        self.buffer.put(*self.batch(3))
+        self.assertEqual(self.get_flushed(), [])
+
+        await self.buffer.close(timeout=5)
+        self.assertEqual(self.get_flushed(), [7])
+        stats = self.buffer.get_stats()
+        self.assertEqual((stats['flushed'], stats['buffered']), (7, 0))
+        with self.assertRaisesMessage(BufferFull, 'Server is shutting down'):
+            self.buffer.put(*self.batch(1))
+
+    async def test_small_batches_are_flushed_by_interval(self):
+        # После первого сброса буфер пуст, и следующая неполная пачка всё равно уходит по flush_interval
+        self.buffer.flush_interval = 0.05
+        for flushed in ([4], [4, 3]):
+            self.buffer.put(*self.batch(flushed[-1]))
+            for _ in range(100):
+                if self.get_flushed() == flushed:
+                    break
+                await asyncio.sleep(0.01)
+            self.assertEqual(self.get_flushed(), flushed)
+        self.assertEqual(self.buffer.get_stats()['buffered'], 0)
+        await self.buffer.close(timeout=5)
+
+    async def test_failed_batches_are_retried_or_dropped(self):
+        # Сбой соединения повторяется не больше max_retries раз, ошибка данных отбрасывает пачку сразу
+        self.flush_points.side_effect = [OperationalError, None, IntegrityError,
+                                         OperationalError, OperationalError, OperationalError]
+        self.assertTrue(await self.buffer.flush(self.batch(1)))
+        self.assertFalse(await self.buffer.flush(self.batch(2)))
+        self.assertFalse(await self.buffer.flush(self.batch(3)))
+        self.assertEqual(self.get_flushed(), [1, 1, 2, 3, 3, 3])
+        stats = self.buffer.get_stats()
+        self.assertEqual((stats['flushed'], stats['dropped'], stats['failures'], stats['buffered']), (1, 5, 5, 0))
+
+
+class SegmentationTest(TestCase):
+    options = {'stop_radius_m': 100, 'stop_minutes': 5, 'max_gap_minutes': 30}
+
+    def setUp(self):
+        enterprise = Enterprise.objects.create(name='Автопарк', city='Псков', country='Россия')
+        self.vehicles = [
+            Vehicle.objects.create(cost=100000, odometer=1000, year=2020, color='серый', number_plate=number_plate,
+                                   enterprise=enterprise)
+            for number_plate in ('A001AA', 'A002AA')
+        ]
+        # Точки раз в минуту: стоянка, поездка на север, стоянка, час без точек и начало второй поездки
+        start = datetime(2023, 3, 1, 8, tzinfo=timezone.utc)
+        lats = [57.8] * 5 + [57.8 + 0.005 * i for i in range(1, 11)] + [57.85] * 10
+        self.track = [(start + timedelta(minutes=i), lat) for i, lat in enumerate(lats)]
+        self.track += [(start + timedelta(minutes=85 + i), 57.85 + 0.005 * i) for i in range(5)]
+        self.trips = [(self.track[4][0], self.track[14][0]), (self.track[25][0], self.track[29][0])]
+
+    def add_points(self, vehicle, track):
+        RoutePoint.objects.bulk_create([RoutePoint(vehicle=vehicle, datetime=point_dt, point=Point(28.3, lat))
+                                        for point_dt, lat in track])
+
+    def get_trips(self, vehicle):
+        return list(Travel.objects.filter(vehicle=vehicle).order_by('begin').values_list('begin', 'end'))
+
+    def test_trips_do_not_depend_on_batches(self):
+        # Порции по 4 точки режут трек и на стоянке, и посреди поездки
+        batched, single = self.vehicles
+        self.add_points(batched, self.track)
+        self.assertEqual(segment_vehicle(batched.id, batch_points=4, **self.options), (30, 2, 1))
+        self.add_points(single, self.track)
+        self.assertEqual(segment_vehicle(single.id, **self.options), (30, 2, 1))
+        self.assertEqual(self.get_trips(batched), self.trips)
+        self.assertEqual(self.get_trips(single), self.trips)
+
+    def test_trip_continues_with_new_points(self):
+        vehicle = self.vehicles[0]
+        self.add_points(vehicle, self.track[:17])
+        self.assertEqual(segment_vehicle(vehicle.id, **self.options), (17, 1, 0))
+        self.assertEqual(self.get_trips(vehicle), [(self.track[4][0], self.track[16][0])])
+
+        self.add_points(vehicle, self.track[17:])
+        self.assertEqual(segment_vehicle(vehicle.id, **self.options), (13, 1, 1))
+        self.assertEqual(self.get_trips(vehicle), self.trips)
+        self.assertEqual(segment_vehicle(vehicle.id, **self.options), (0, 0, 0))
+
+    def test_same_timestamp_points_across_batches(self):
+        # Каждая точка трека приходит дважды с одним временем; порции по 3 точки разрезают такие пары
+        batched, single = self.vehicles
+        self.add_points(batched, [point for point in self.track for _ in range(2)])
+        self.assertEqual(segment_vehicle(batched.id, batch_points=3, **self.options), (60, 2, 1))
+        self.add_points(single, [point for point in self.track for _ in range(2)])
+        self.assertEqual(segment_vehicle(single.id, **self.options), (60, 2, 1))
+        self.assertEqual(self.get_trips(batched), self.trips)
+        self.assertEqual(self.get_trips(single), self.trips)
+        self.assertEqual(segment_vehicle(batched.id, batch_points=3, **self.options), (0, 0, 0))
+
+    def test_zero_options_are_not_replaced_by_defaults(self):
+        options = get_segmenter_options(stop_radius_m=0, stop_minutes=0, max_gap_minutes=0)
+        self.assertEqual(options, {'stop_radius_km': 0, 'stop_duration': timedelta(0), 'max_gap': timedelta(0)})
+        with mock.patch.multiple(settings, SEGMENT_STOP_RADIUS_M=150, SEGMENT_STOP_MINUTES=7,
+                                 SEGMENT_MAX_GAP_MINUTES=40):
+            self.assertEqual(get_segmenter_options(), {'stop_radius_km': 0.15, 'stop_duration': timedelta(minutes=7),
+                                                       'max_gap': timedelta(minutes=40)})
+
+
+class PositionsTest(TestCase):
+
+    def setUp(self):
+        enterprise = Enterprise.objects.create(name='Автопарк', city='Псков', country='Россия')
+        self.vehicles = [
+            Vehicle.objects.create(cost=100000, odometer=1000, year=2020, color='серый', number_plate=number_plate,
+                                   enterprise=enterprise)
+            for number_plate in ('A001AA', 'A002AA')
+        ]
+        self.start = datetime(2023, 3, 1, 8, tzinfo=timezone.utc)
+
+    def route_point(self, vehicle, minutes, lat):
+        return RoutePoint(vehicle=vehicle, datetime=self.start + timedelta(minutes=minutes), point=Point(28.3, lat))
+
+    def get_position(self, vehicle):
+        position = VehiclePosition.objects.get(vehicle=vehicle)
+        return position.datetime, position.point.y, position.speed_kmh
+
+    def test_positions_follow_latest_points(self):
+        first, second = self.vehicles
+        # Скорость первой машины - по предыдущей точке той же пачки, у второй точка одна, и скорости нет
+        self.assertEqual(update_positions([self.route_point(first, 6, 57.81), self.route_point(second, 0, 57.9),
+                                           self.route_point(first, 0, 57.8)]), 2)
+        position_dt, lat, speed = self.get_position(first)
+        self.assertEqual((position_dt, lat), (self.start + timedelta(minutes=6), 57.81))
+        self.assertAlmostEqual(speed, geodesic((57.8, 28.3), (57.81, 28.3)).km * 10, places=3)
+        self.assertEqual(self.get_position(second), (self.start, 57.9, None))
+
+        # Запоздавшая точка положение не двигает
+        self.assertEqual(update_positions([self.route_point(first, 3, 57.805)]), 0)
+        self.assertEqual(self.get_position(first)[:2], (self.start + timedelta(minutes=6), 57.81))
+
+        # Скорость по одиночной новой точке считается от сохранённого положения
+        self.assertEqual(update_positions([self.route_point(second, 60, 58.0)]), 1)
+        position_dt, lat, speed = self.get_position(second)
+        self.assertEqual((position_dt, lat), (self.start + timedelta(hours=1), 58.0))
+        self.assertAlmostEqual(speed, geodesic((57.9, 28.3), (58.0, 28.3)).km, places=3)
+
+    def test_saved_point_moves_position(self):
+        vehicle = self.vehicles[0]
+        self.route_point(vehicle, 0, 57.8).save()
+        self.route_point(vehicle, 30, 57.85).save()
+        position_dt, lat, speed = self.get_position(vehicle)
+        self.assertEqual((position_dt, lat), (self.start + timedelta(minutes=30), 57.85))
+        self.assertAlmostEqual(speed, geodesic((57.8, 28.3), (57.85, 28.3)).km * 2, places=3)
+
+
+class FleetPositionsTest(SimpleTestCase):
+
+    def setUp(self):
+        self.positions = FleetPositions(
+            vehicle_ids=[1, 2, 3, 4], enterprise_ids=[10, 10, 20, 20],
+            lats=[57.80, 57.85, 57.90, 56.84], lons=[28.30, 28.35, 28.40, 60.60],
+            timestamps=[0, 0, 0, 0], speeds=[np.nan, 30, 60, 0],
+        )
+
+    def test_within_bbox(self):
+        self.assertEqual(self.positions.within_bbox(28.25, 57.75, 28.37, 57.88).tolist(), [0, 1])
+        self.assertEqual(self.positions.within_bbox(28.25, 57.75, 28.37, 57.88, enterprise_ids=[20]).tolist(), [])
+        self.assertEqual(self.positions.within_bbox(-180, -90, 180, 90, enterprise_ids=[20]).tolist(), [2, 3])
+        # Границы прямоугольника включаются
+        self.assertEqual(self.positions.within_bbox(28.3, 57.8, 28.3, 57.8).tolist(), [0])
+
+    def test_within_polygon(self):
+        square = [(28.2, 57.7), (28.5, 57.7), (28.5, 58.0), (28.2, 58.0)]
+        hole = [(28.33, 57.83), (28.37, 57.83), (28.37, 57.87), (28.33, 57.87), (28.33, 57.83)]
+        triangle = [(28.2, 57.7), (28.7, 57.7), (28.2, 58.0)]
+        self.assertEqual(self.positions.within_polygon([square]).tolist(), [0, 1, 2])
+        self.assertEqual(self.positions.within_polygon([square, hole]).tolist(), [0, 2])
+        self.assertEqual(self.positions.within_polygon([triangle]).tolist(), [0, 1])
+        self.assertEqual(self.positions.within_polygon([square], enterprise_ids=[10]).tolist(), [0, 1])
+
+    def test_nearest(self):
+        indices, distances = self.positions.nearest(57.8, 28.3, 2)
+        self.assertEqual(indices.tolist(), [0, 1])
+        np.testing.assert_allclose(distances, [0, haversine(57.8, 28.3, 57.85, 28.35)])
+
+        indices, distances = self.positions.nearest(56.84, 60.6, 10)
+        self.assertEqual(indices.tolist(), [3, 2, 1, 0])
+        self.assertTrue((np.diff(distances) > 0).all())
+
+        self.assertEqual(self.positions.nearest(57.8, 28.3, 1, enterprise_ids=[20])[0].tolist(), [2])
+        self.assertEqual(self.positions.nearest(57.8, 28.3, 0)[0].tolist(), [])
+        self.assertEqual(self.positions.nearest(57.8, 28.3, 3, enterprise_ids=[30])[0].tolist(), [])
+
+
+class GenerateTrackTest(TestCase):
+
+    def setUp(self):
+        self.enterprise = Enterprise.objects.create(name='Автопарк', city='Псков', country='Россия')
+        self.vehicle = Vehicle.objects.create(cost=100000, odometer=1000, year=2020, color='серый',
+                                              number_plate='A001AA', enterprise=self.enterprise)
+
+    def test_track_ends_before_end_and_resets_caches(self):
+        start = datetime(2023, 3, 1, 8, tzinfo=timezone.utc)
+        end = start + timedelta(days=6)
+        cache = mock.Mock()
+        # Одна пачка на все поездки: кэши сбрасываются одним окном от первой поездки до последней
+        with mock.patch('park.signals.caches_by_window', [cache]):
+            call_command('generate_track', str(self.vehicle.id), '--start', start.isoformat(),
+                         '--end', end.isoformat(), '--workers', '1', '--seed', '1', '--batch', '1000000',
+                         '--router', 'park.routing.SyntheticRouter', '--route-cache', '', stdout=io.StringIO())
+
+        travels = list(Travel.objects.filter(vehicle=self.vehicle).order_by('begin'))
+        self.assertTrue(travels)
+        self.assertEqual(travels[0].begin, start)
+        self.assertLessEqual(travels[-1].end, end)
+        self.assertLessEqual(RoutePoint.objects.aggregate(last=Max('datetime'))['last'], end)
+        cache.invalidate_vehicle.assert_any_call(self.vehicle.id, self.enterprise.id, travels[0].begin,
+                                                 travels[-1].end)
+
+
+class DouglasPeuckerTest(SimpleTestCase):
+
+    def reference(self, xs, ys, tolerance, first, last, keep):
+        """Обычная рекурсивная версия алгоритма для сверки."""
+        keep[first] = keep[last] = True
+        if last - first < 2:
+            return
+        dx, dy = xs[last] - xs[first], ys[last] - ys[first]
+        length_sq = dx * dx + dy * dy
+        best, farthest = -1.0, None
+        for i in range(first + 1, last):
+            t = ((xs[i] - xs[first]) * dx + (ys[i] - ys[first]) * dy) / length_sq if length_sq else 0
+            t = min(max(t, 0), 1)
+            distance = np.hypot(xs[i] - (xs[first] + t * dx), ys[i] - (ys[first] + t * dy))
+            if distance > best:
+                best, farthest = distance, i
+        if best > tolerance:
+            self.reference(xs, ys, tolerance, first, farthest, keep)
+            self.reference(xs, ys, tolerance, farthest, last, keep)
+
+    def test_known_polyline(self):
+        xs = [0, 1, 2, 3, 4, 5, 6]
+        ys = [0, 0.1, 3, 0.2, 0, -0.1, 0]
+        self.assertEqual(douglas_peucker(xs, ys, 1).tolist(), [True, False, True, True, False, False, True])
+        self.assertEqual(douglas_peucker(xs, ys, 0.15).tolist(), [True, True, True, True, False, True, True])
+
+    def test_matches_recursive_version(self):
+        rng = np.random.default_rng(1)
+        xs = np.cumsum(rng.uniform(0, 10, 500))
+        ys = np.cumsum(rng.normal(0, 5, 500))
+        for tolerance in (0.5, 5, 50):
+            expected = np.zeros(xs.size, dtype=bool)
+            self.reference(xs, ys, tolerance, 0, xs.size - 1, expected)
+            self.assertEqual(douglas_peucker(xs, ys, tolerance).tolist(), expected.tolist())
+
+    def test_endpoints_are_kept(self):
+        keep = douglas_peucker([0, 1, 2, 3], [0, 0.5, -0.5, 0], 100)
+        self.assertEqual(keep.tolist(), [True, False, False, True])
+
+    def test_short_tracks_are_unchanged(self):
+        for size in (0, 1, 2):
+            with self.subTest(size=size):
+                self.assertEqual(douglas_peucker(np.arange(size), np.zeros(size), 1).tolist(), [True] * size)
+                self.assertEqual(simplify_track(np.full(size, 57.8), np.arange(size), zoom=0).tolist(), [True] * size)
+
+
+class RoutePointsViewTest(TestCase):
+    url = '/park/api/routepoints/'
+
+    @classmethod
+    def setUpTestData(cls):
+        enterprise = Enterprise.objects.create(name='Автопарк', city='Псков', country='Россия',
+                                               timezone='Europe/Moscow')
+        cls.vehicle = Vehicle.objects.create(cost=100000, odometer=1000, year=2020, color='серый',
+                                             number_plate='A001AA', enterprise=enterprise)
+        cls.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        cls.start = datetime(2023, 3, 1, 9, tzinfo=timezone.utc)
+        cls.lats = [round(57.8 + 0.001 * i, 5) for i in range(20)]
+        cls.lons = [round(28.3 + 0.0005 * (i % 3), 5) for i in range(20)]
+        RoutePoint.objects.bulk_create([
+            RoutePoint(vehicle=cls.vehicle, datetime=cls.start + timedelta(minutes=i), point=Point(lon, lat))
+            for i, (lat, lon) in enumerate(zip(cls.lats, cls.lons))
+        ])
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get(self, **params):
+        params = dict({'id': self.vehicle.id, 'start': (self.start - timedelta(hours=1)).isoformat(),
+                       'end': (self.start + timedelta(hours=1)).isoformat()}, **params)
+        return self.client.get(self.url, params)
+
+    def test_polyline_round_trip(self):
+        response = self.get(format='polyline')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        lats, lons = decode_polyline(data['polyline'], data['precision'])
+        np.testing.assert_allclose(lats, self.lats, atol=1e-9)
+        np.testing.assert_allclose(lons, self.lons, atol=1e-9)
+        self.assertEqual(np.cumsum(data['timestamps']).tolist(),
+                         [int((self.start + timedelta(minutes=i)).timestamp()) for i in range(20)])
+        self.assertEqual(data['timezone'], 'Europe/Moscow')
+
+    def test_binary_round_trip(self):
+        response = self.get(format='binary')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/vnd.autopark.track')
+        lons, lats, timestamps = from_binary(response.content)
+        self.assertEqual(lats.tolist(), self.lats)
+        self.assertEqual(lons.tolist(), self.lons)
+        self.assertEqual(timestamps.tolist(), [int((self.start + timedelta(minutes=i)).timestamp()) for i in range(20)])
+
+    def test_empty_track_in_compact_formats(self):
+        start = (self.start + timedelta(days=1)).isoformat()
+        data = self.get(format='polyline', start=start, end=start).json()
+        self.assertEqual((data['polyline'], data['timestamps']), ('', []))
+        self.assertEqual(decode_polyline(data['polyline'])[0].size, 0)
+        lons, lats, timestamps = from_binary(self.get(format='binary', start=start, end=start).content)
+        self.assertEqual((lons.size, lats.size, timestamps.size), (0, 0, 0))
+
+    def assert_stream_matches_serializer(self, route_points):
+        ent_tz = get_tzinfo('Europe/Moscow')
+        for geojson, serializer_class in ((False, RoutePointSerializer), (True, GeoRoutePointSerializer)):
+            with self.subTest(geojson=geojson, count=route_points.count()):
+                expected = JSONRenderer().render(
+                    serializer_class(instance=route_points, many=True, context={'timezone': ent_tz}).data)
+                streamed = ''.join(stream_route_points(route_points, ent_tz, geojson=geojson, chunk_size=3))
+                self.assertEqual(streamed.encode('utf-8'), expected)
+
+    def test_stream_matches_serializers(self):
+        route_points = RoutePoint.objects.filter(vehicle=self.vehicle).order_by('datetime')
+        self.assert_stream_matches_serializer(route_points)
+        self.assert_stream_matches_serializer(route_points[:1])
+        self.assert_stream_matches_serializer(route_points.none())
+
+    def test_streamed_response_matches_regular_response(self):
+        for params in ({}, {'geojson': 1}):
+            with self.subTest(**params):
+                streamed = self.get(stream=1, **params)
+                self.assertEqual(b''.join(streamed.streaming_content), self.get(**params).content)
+
+    def test_bad_simplification_params(self):
+        for params in ({'tolerance': 'abc'}, {'zoom': '1.5'}, {'zoom': 'far'}):
+            with self.subTest(**params):
+                self.assertEqual(self.get(**params).status_code, 400)
+
+    def test_simplified_track_is_cached(self):
+        cache = ReportCache('default', prefix='test-track', enabled=True)
+        cache.cache.clear()
+        with mock.patch('park.views.track_cache', cache), \
+                mock.patch('park.views.simplify_route_points', wraps=simplify_route_points) as simplify:
+            first = self.get(tolerance=1000)
+            second = self.get(tolerance=1000)
+            self.get(zoom=0)
+        self.assertEqual(simplify.call_count, 2)
+        self.assertEqual(first.content, second.content)
+        # Зигзаг шириной ~60 м при допуске 1 км сводится к концам трека
+        self.assertEqual([point['datetime'] for point in first.json()],
+                         [str(self.start.astimezone(get_tzinfo('Europe/Moscow'))),
+                          str((self.start + timedelta(minutes=19)).astimezone(get_tzinfo('Europe/Moscow')))])
+
+
+class TravelLinkTest(TestCase):
+
+    def setUp(self):
+        enterprise = Enterprise.objects.create(name='Автопарк', city='Псков', country='Россия')
+        self.vehicle = Vehicle.objects.create(cost=100000, odometer=1000, year=2020, color='серый',
+                                              number_plate='A001AA', enterprise=enterprise)
+        self.start = datetime(2023, 3, 1, 9, tzinfo=timezone.utc)
+        RoutePoint.objects.bulk_create([
+            RoutePoint(vehicle=self.vehicle, point=Point(28.3 + 0.001 * i, 57.8), datetime=self.minute(i))
+            for i in range(10)
+        ])
+
+    def minute(self, minutes):
+        return self.start + timedelta(minutes=minutes)
+
+    def linked_minutes(self, travel):
+        return [int((point_dt - self.start).total_seconds() // 60)
+                for point_dt in RoutePoint.objects.filter(travel=travel).order_by('datetime')
+                .values_list('datetime', flat=True)]
+
+    def test_points_follow_travel_bounds(self):
+        travel = Travel.objects.create(vehicle=self.vehicle, begin=self.minute(2), end=self.minute(5))
+        self.assertEqual(self.linked_minutes(travel), [2, 3, 4, 5])
+
+        travel.begin, travel.end = self.minute(4), self.minute(7)
+        travel.save()
+        self.assertEqual(self.linked_minutes(travel), [4, 5, 6, 7])
+        self.assertEqual(RoutePoint.objects.filter(travel__isnull=True).count(), 6)
+
+        travel.delete()
+        self.assertFalse(RoutePoint.objects.filter(travel__isnull=False).exists())
+
+    def test_assign_travels_to_new_points(self):
+        travel = Travel.objects.create(vehicle=self.vehicle, begin=self.minute(2), end=self.minute(5))
+        other = Travel.objects.create(vehicle=self.vehicle, begin=self.minute(8), end=self.minute(9))
+        route_points = assign_travels([
+            RoutePoint(vehicle=self.vehicle, point=Point(28.3, 57.8), datetime=self.minute(minutes))
+            for minutes in (1, 2, 5, 6, 8.5)
+        ])
+        self.assertEqual([route_point.travel_id for route_point in route_points],
+                         [None, travel.id, travel.id, None, other.id])
+
+    def test_summary_save_does_not_relink(self):
+        travel = Travel.objects.create(vehicle=self.vehicle, begin=self.minute(2), end=self.minute(5))
+        with mock.patch('park.signals.link_travel_points') as link:
+            summarize_travel(travel)
+            travel.save()
+        self.assertEqual(link.call_count, 1)
+        self.assertEqual(Travel.objects.get(pk=travel.pk).point_count, 4)
+
+
+class TravelSummaryTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        enterprise = Enterprise.objects.create(name='Автопарк', city='Псков', country='Россия')
+        cls.vehicle = Vehicle.objects.create(cost=100000, odometer=1000, year=2020, color='серый',
+                                             number_plate='A001AA', enterprise=enterprise)
+        cls.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        cls.start = datetime(2023, 3, 1, 9, tzinfo=timezone.utc)
+        cls.travel = Travel.objects.create(vehicle=cls.vehicle, begin=cls.start, end=cls.start + timedelta(minutes=3))
+        # Поездки без точек, всего вместе с первой 21 - на две страницы
+        cls.empty = [
+            Travel.objects.create(vehicle=cls.vehicle, begin=cls.start + timedelta(hours=hours),
+                                  end=cls.start + timedelta(hours=hours, minutes=30))
+            for hours in range(1, 21)
+        ]
+        RoutePoint.objects.bulk_create([
+            RoutePoint(vehicle=cls.vehicle, travel=cls.travel, point=Point(lon, lat),
+                       datetime=cls.start + timedelta(minutes=minutes))
+            for lat, lon, minutes in ((57.8, 28.3, 0), (57.81, 28.3, 1), (57.81, 28.32, 3))
+        ])
+        summarize_travels(Travel.objects.all())
+
+    def test_summary_values(self):
+        travel = Travel.objects.get(pk=self.travel.pk)
+        first = geodesic((57.8, 28.3), (57.81, 28.3)).km
+        second = geodesic((57.81, 28.3), (57.81, 28.32)).km
+        self.assertEqual(travel.point_count, 3)
+        self.assertAlmostEqual(travel.distance_km, first + second, places=4)
+        self.assertAlmostEqual(travel.max_speed_kmh, max(first * 60, second * 30), places=2)
+        np.testing.assert_allclose(travel.bbox.extent, (28.3, 57.8, 28.32, 57.81))
+        np.testing.assert_allclose(travel.start_point.coords, (28.3, 57.8))
+        np.testing.assert_allclose(travel.end_point.coords, (28.32, 57.81))
+        self.assertIsNotNone(travel.summarized_at)
+
+        empty = Travel.objects.get(pk=self.empty[0].pk)
+        self.assertEqual((empty.point_count, empty.distance_km, empty.max_speed_kmh), (0, 0, None))
+        self.assertEqual((empty.bbox, empty.start_point, empty.end_point), (None, None, None))
+        self.assertIsNotNone(empty.summarized_at)
+
+    def test_paginated_endpoint(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        url = '/park/api/travel_summaries/'
+
+        data = client.get(url, {'id': self.vehicle.id}).json()
+        self.assertEqual((data['count'], data['num_pages'], data['page']), (21, 2, 1))
+        self.assertEqual(len(data['results']), 20)
+        summary = data['results'][0]
+        self.assertEqual((summary['id'], summary['point_count'], summary['duration_s']), (self.travel.id, 3, 180))
+        self.assertAlmostEqual(summary['distance_km'], Travel.objects.get(pk=self.travel.pk).distance_km)
+        np.testing.assert_allclose(summary['bbox'], [28.3, 57.8, 28.32, 57.81])
+        np.testing.assert_allclose(summary['start_point'], [28.3, 57.8])
+        np.testing.assert_allclose(summary['end_point'], [28.32, 57.81])
+        self.assertEqual((data['results'][1]['point_count'], data['results'][1]['bbox']), (0, None))
+
+        last = client.get(url, {'id': self.vehicle.id, 'page': 2}).json()
+        self.assertEqual([summary['id'] for summary in last['results']], [self.empty[-1].id])
+        self.assertEqual(client.get(url, {'id': self.vehicle.id, 'page': 99}).json()['page'], 2)
+        self.assertEqual(client.get(url, {'id': 'x'}).status_code, 400)
+
+
+class RoutePointDDLCommandTest(TestCase):
+    """partition_routepoints и benchmark_routepoints без --execute только печатают SQL, на любой базе."""
+
+    def call(self, name, *args):
+        out = io.StringIO()
+        with mock.patch.object(connection, 'vendor', 'postgresql'), CaptureQueriesContext(connection) as queries:
+            try:
+                call_command(name, *args, stdout=out)
+            finally:
+                self.ddl = [query['sql'] for query in queries
+                            if query['sql'].lstrip().upper().startswith(('ALTER', 'CREATE', 'DROP', 'INSERT'))]
+        return out.getvalue()
+
+    def test_partition_dry_run(self):
+        output = self.call('partition_routepoints', '--start', '2023-01')
+        self.assertIn('ADD PRIMARY KEY (`id`, `datetime`);', output)
+        self.assertIn('PARTITION BY RANGE COLUMNS(`datetime`)', output)
+        self.assertIn("PARTITION p202301 VALUES LESS THAN ('2023-02-01')", output)
+        self.assertIn('Dry run, nothing executed', output)
+        self.assertEqual(self.ddl, [])
+
+    def test_partition_execute_requires_mysql(self):
+        for args in (('--start', '2023-01', '--execute'), ('--extend',)):
+            with self.subTest(args=args), self.assertRaises(CommandError):
+                self.call('partition_routepoints', *args)
+            self.assertEqual(self.ddl, [])
+
+    def test_benchmark_dry_run(self):
+        output = self.call('benchmark_routepoints', '--points', '2500000', '--batch', '1000000')
+        self.assertIn('CREATE TABLE `park_routepoint_benchmark` LIKE `park_routepoint`;', output)
+        self.assertIn('insert 2500000 points in 3 INSERT ... SELECT statements', output)
+        self.assertIn('ADD INDEX `park_rp_bench_vehicle_dt` (`vehicle_id`, `datetime`);', output)
+        self.assertIn('Dry run, nothing executed', output)
+        self.assertEqual(self.ddl, [])
+
+    def test_benchmark_execute_requires_mysql(self):
+        with self.assertRaises(CommandError):
+            self.call('benchmark_routepoints', '--execute')
+        self.assertEqual(self.ddl, [])
+
+
+class RoutePointDeleteTest(TestCase):
+
+    def setUp(self):
+        enterprise = Enterprise.objects.create(name='Автопарк', city='Псков', country='Россия')
+        self.vehicles = [
+            Vehicle.objects.create(cost=100000, odometer=1000, year=2020, color='серый', number_plate=number_plate,
+                                   enterprise=enterprise)
+            for number_plate in ('A001AA', 'A002AA')
+        ]
+        start = datetime(2023, 3, 1, 9, tzinfo=timezone.utc)
+        RoutePoint.objects.bulk_create([
+            RoutePoint(vehicle=vehicle, point=Point(28.3, 57.8), datetime=start + timedelta(minutes=i))
+            for vehicle in self.vehicles for i in range(7)
+        ])
+
+    def test_delete_without_signals(self):
+        handler = mock.Mock()
+        post_delete.connect(handler, sender=RoutePoint)
+        self.addCleanup(post_delete.disconnect, handler, sender=RoutePoint)
+        with CaptureQueriesContext(connection) as queries:
+            deleted = RoutePoint.objects.filter(vehicle=self.vehicles[0]).delete_without_signals(chunk_size=3)
+        self.assertEqual(deleted, 7)
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('DELETE')]), 3)
+        handler.assert_not_called()
+        self.assertFalse(RoutePoint.objects.filter(vehicle=self.vehicles[0]).exists())
+        self.assertEqual(RoutePoint.objects.filter(vehicle=self.vehicles[1]).count(), 7)
+        self.assertEqual(RoutePoint.objects.none().delete_without_signals(), 0)
@@ -0,0 +1,102 @@
+import heapq
+from collections import defaultdict
+from functools import reduce
+from operator import and_
+
+import numpy as np
+from django.db.models import Q
+
+from .archive import ArchiveFile, from_timestamp, get_archive_path, to_timestamp
+from .models import ArchivedTrack, RoutePoint
+
+
+def get_archived_tracks(vehicle_ids, begin, end):
+    """Архивные окна машин, пересекающие интервал (begin, end): {vehicle_id: [ArchivedTrack по времени]}."""
+    tracks = defaultdict(list)
+    for track in ArchivedTrack.objects.filter(vehicle_id__in=vehicle_ids, first_ts__lt=end, last_ts__gt=begin)\
+            .select_related('archive').order_by('vehicle_id', 'first_ts'):
+        tracks[track.vehicle_id].append(track)
+    return tracks
+
+
+class VehicleTrack:
+    """
+    Точки машины за интервал (begin, end), где бы они ни лежали: окна, перенесённые в архив (ArchivedTrack),
+    читаются из файлов, остальное - из RoutePoint. Точки таблицы внутри архивных окон не читаются,
+    поэтому ещё не удалённые после архивации строки не дублируются.
+    """
+
+    def __init__(self, vehicle_id, begin, end, archived_tracks=None):
+        self.vehicle_id = vehicle_id
+        self.begin = begin
+        self.end = end
+        if archived_tracks is None:
+            archived_tracks = get_archived_tracks([vehicle_id], begin, end)[vehicle_id]
+        self.archived_tracks = archived_tracks
+
+    @property
+    def route_points(self):
+        """Точки этой машины из RoutePoint вне архивных окон, по времени."""
+        route_points = RoutePoint.objects.filter(vehicle_id=self.vehicle_id, datetime__gt=self.begin,
+                                                 datetime__lt=self.end)
+        if self.archived_tracks:
+            route_points = route_points.filter(reduce(and_, (
+                ~Q(datetime__range=(track.first_ts, track.last_ts)) for track in self.archived_tracks
+            )))
+        return route_points.order_by('datetime')
+
+    def get_segments(self):
+        """Куски интервала по порядку: ('table', после, до) и ('archive', ArchivedTrack), границы не включаются."""
+        lower = self.begin
+        for track in self.archived_tracks:
+            if track.first_ts > lower:
+                yield 'table', lower, min(track.first_ts, self.end)
+            yield 'archive', track
+            lower = max(lower, track.last_ts)
+        if lower < self.end:
+            yield 'table', lower, self.end
+
+    def iter_points(self, chunk_size=2000):
+        """Тройки (datetime, lat, lon) по возрастанию времени."""
+        begin_ts, end_ts = to_timestamp(self.begin), to_timestamp(self.end)
+        for segment in self.get_segments():
+            if segment[0] == 'archive':
+                points = ArchiveFile(get_archive_path(segment[1].archive)).read(self.vehicle_id, begin_ts, end_ts)
+                for timestamp, lat, lon in zip(points.timestamps.tolist(), points.lats.tolist(), points.lons.tolist()):
+                    yield from_timestamp(timestamp), lat, lon
+            else:
+                rows = RoutePoint.objects.filter(vehicle_id=self.vehicle_id, datetime__gt=segment[1],
+                                                 datetime__lt=segment[2])\
+                    .order_by('datetime').values_list('datetime', 'point').iterator(chunk_size=chunk_size)
+                for point_dt, point in rows:
+                    yield point_dt, point.y, point.x
+
+    def get_columns(self, chunk_size=2000):
+        """Колонки трека: время (секунды Unix, float), широты, долготы."""
+        timestamps, lats, lons = [], [], []
+        for point_dt, lat, lon in self.iter_points(chunk_size):
+            timestamps.append(point_dt.timestamp())
+            lats.append(lat)
+            lons.append(lon)
+        return (np.asarray(timestamps, dtype=np.float64), np.asarray(lats, dtype=np.float64),
+                np.asarray(lons, dtype=np.float64))
+
+
+def iter_vehicles_points(vehicle_ids, begin, end, chunk_size=2000):
+    """
+    Четвёрки (vehicle_id, datetime, lat, lon) по машинам и времени для набора машин. Машины без архивных
+    окон в интервале читаются одним общим запросом, остальные - через VehicleTrack.
+    """
+    archived = get_archived_tracks(vehicle_ids, begin, end)
+    plain_ids = [vehicle_id for vehicle_id in vehicle_ids if vehicle_id not in archived]
+    rows = RoutePoint.objects.filter(vehicle_id__in=plain_ids, datetime__gt=begin, datetime__lt=end)\
+        .order_by('vehicle_id', 'datetime').values_list('vehicle_id', 'datetime', 'point')\
+        .iterator(chunk_size=chunk_size)
+    table_rows = ((vehicle_id, point_dt, point.y, point.x) for vehicle_id, point_dt, point in rows)
+    archived_rows = (
+        (vehicle_id, point_dt, lat, lon)
+        for vehicle_id in sorted(archived)
+        for point_dt, lat, lon in VehicleTrack(vehicle_id, begin, end, archived[vehicle_id]).iter_points(chunk_size)
+    )
+    # Каждая машина целиком в одном из потоков, поэтому слияния по id машины достаточно
+    return heapq.merge(table_rows, archived_rows, key=lambda row: row[0])
@@ -0,0 +1,61 @@
+from bisect import bisect_right
+from collections import defaultdict
+
+from .models import RoutePoint, Travel
+
+# Точка принадлежит поездке, если её время попадает в [begin, end] включительно:
+# первая точка трека пишется ровно в момент начала поездки
+
+
+def get_travel_points(travel):
+    """Точки поездки по индексу (travel, datetime), без поиска по диапазону времени."""
+    return RoutePoint.objects.filter(travel=travel).order_by('datetime')
+
+
+def assign_travels(route_points):
+    """
+    Проставляет travel_id ещё не сохранённым точкам пачки. Поездки всех машин пачки, пересекающиеся
+    с её интервалом времени, читаются одним запросом, дальше поиск делением пополам.
+    """
+    if not route_points:
+        return route_points
+    vehicle_ids = {route_point.vehicle_id for route_point in route_points}
+    datetimes = [route_point.datetime for route_point in route_points]
+    travels = defaultdict(list)
+    for travel_id, vehicle_id, begin, end in Travel.objects.filter(
+        vehicle_id__in=vehicle_ids, begin__lte=max(datetimes), end__gte=min(datetimes)
+    ).order_by('vehicle_id', 'begin').values_list('id', 'vehicle_id', 'begin', 'end'):
+        travels[vehicle_id].append((begin, end, travel_id))
+
+    begins = {vehicle_id: [begin for begin, _, _ in rows] for vehicle_id, rows in travels.items()}
+    for route_point in route_points:
+        rows = travels.get(route_point.vehicle_id)
+        if not rows or route_point.travel_id is not None:
+            continue
+        index = bisect_right(begins[route_point.vehicle_id], route_point.datetime) - 1
+        if index >= 0 and route_point.datetime <= rows[index][1]:
+            route_point.travel_id = rows[index][2]
+    return route_points
+
+
+def find_travel_id(vehicle_id, point_dt):
+    return Travel.objects.filter(
+        vehicle_id=vehicle_id, begin__lte=point_dt, end__gte=point_dt
+    ).order_by('begin').values_list('id', flat=True).first()
+
+
+def link_travel_points(travel, relink=False):
+    """
+    Привязывает к поездке точки её машины из [begin, end] и отвязывает те, что после правки поездки
+    оказались вне интервала. Без relink уже привязанные к другим поездкам точки не трогаются.
+    Возвращает число привязанных точек.
+    """
+    RoutePoint.objects.filter(travel=travel).exclude(
+        datetime__gte=travel.begin, datetime__lte=travel.end
+    ).update(travel=None)
+    route_points = RoutePoint.objects.filter(
+        vehicle_id=travel.vehicle_id, datetime__gte=travel.begin, datetime__lte=travel.end
+    )
+    if not relink:
+        route_points = route_points.filter(travel__isnull=True)
+    return route_points.update(travel=travel)
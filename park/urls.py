@@ -7,8 +7,16 @@ from park import views
 urlpatterns = [
     path('api/vehicles/', views.VehicleInfoView.as_view()),
     path('api/routepoints/', views.RoutePointsInfoView.as_view()),
+    path('api/routepoints/buffered/', views.buffered_route_points),
     path('api/travels/', views.TravelInfoView.as_view()),
+    path('api/travel_summaries/', views.TravelSummaryView.as_view()),
+    path('api/fleet/', views.FleetSnapshotView.as_view()),
+    path('api/fleet/within/', views.FleetWithinView.as_view()),
+    path('api/fleet/nearest/', views.FleetNearestView.as_view()),
+    path('api/heatmap/<int:enterprise_id>/<int:zoom>/<int:x>/<int:y>/', views.HeatmapTileView.as_view()),
     path('api/get_report/', views.ReportInfoView.as_view()),
+    path('api/report_jobs/', views.ReportJobView.as_view()),
+    path('api/report_cache_stats/', views.ReportCacheStatsView.as_view()),
     path('api/get_token', obtain_auth_token),
     path('management', views.management, name='management'),
     re_path(r'enterprise/(?P<id>\d+)$', views.enterprise, name='enterprise'),
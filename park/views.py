@@ -1,20 +1,24 @@
+import io
 import json
 
+import numpy as np
 import pytz
-import geocoder
 from pprint import pprint, pp
-from datetime import datetime
+from datetime import date, datetime, timedelta, timezone as dt_timezone
 
 from django.contrib.auth.decorators import login_required
+from django.contrib.gis.geos import GEOSGeometry, GEOSException, Point, Polygon
 from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
 from django.core.serializers import serialize
 from django.db.models import Q, F, Min, Max
-from django.http import Http404, HttpResponseRedirect
+from django.http import Http404, HttpResponseRedirect, StreamingHttpResponse, JsonResponse
 from django.shortcuts import render, get_object_or_404, redirect
 from django.utils import timezone
 from django.views.generic import DetailView
 from rest_framework import status, exceptions
+from rest_framework.exceptions import ParseError
 from rest_framework.parsers import JSONParser
+from rest_framework.settings import api_settings
 
 from rest_framework.response import Response
 from rest_framework.views import APIView
@@ -23,10 +27,26 @@ from rest_framework.serializers import Serializer
 
 from autopark import settings
 from .forms import VehicleForm, EnterpriseForm, GenerateTrackForm, ReportForm
-from .models import Vehicle, Manager, Enterprise, Driver, RoutePoint, Travel
+from .models import Vehicle, Manager, Enterprise, Driver, RoutePoint, Travel, ReportJob, VehiclePosition
+from .jobs import submit_report_job, cancel_report_job, refresh_report_job
 from .reports import TrackReport
+from .report_cache import report_cache, track_cache, VEHICLE, ENTERPRISE
+from .simplify import simplify_route_points, simplify_track
+from .travels import get_travel_points
+from .summaries import summarize_travels
+from .geocoding import get_geocoder
+from .heatmap import BINS as HEATMAP_BINS, get_tile_counts, get_watermark as get_heatmap_watermark
+from .fleet_index import fleet_index, get_positions_at, get_enterprise_timezones
 from .permissions import IsManagerPermission
-from .serializers import VehicleSerializer, RoutePointSerializer, GeoRoutePointSerializer, TravelSerializer
+from .encoding import TrackColumns, get_track_columns
+from .ingest import ingest_route_points, get_batch_columns, validate_route_points, IngestError
+from .write_buffer import ingest_buffer, get_token_principal, BufferFull
+from .parsers import RoutePointCSVParser
+from .renderers import PolylineRenderer, BinaryTrackRenderer
+from .streaming import stream_route_points, stream_point_rows
+from .tracks import VehicleTrack
+from .serializers import VehicleSerializer, RoutePointSerializer, GeoRoutePointSerializer, TravelSerializer, \
+    ReportJobSerializer, TravelSummarySerializer, get_tzinfo
 
 
 class VehicleInfoView(APIView):
@@ -53,6 +73,7 @@ class VehicleInfoView(APIView):
         else:
             print('Error in server logic, should have failed on "check_permissions" stage.')
             self.permission_denied(request, message='Error code: 401', code=401)
+        vehicles = vehicles.select_related('enterprise', 'active_driver')
 
         page = request.GET.get('page', 1)
         paginator = Paginator(vehicles, 20)
@@ -229,7 +250,9 @@ def set_timezone(request):
 
 class RoutePointsInfoView(APIView):
     permission_classes = (IsManagerPermission,)
-    parser_classes = (JSONParser, )
+    parser_classes = (JSONParser, RoutePointCSVParser)
+    renderer_classes = tuple(api_settings.DEFAULT_RENDERER_CLASSES) + (PolylineRenderer, BinaryTrackRenderer)
+    stream_chunk_size = 2000
 
     def check_permissions(self, request):
         for permission in self.get_permissions():
@@ -243,28 +266,129 @@ class RoutePointsInfoView(APIView):
 
     def get(self, request):
         vehicle = get_object_or_404(Vehicle, pk=request.GET['id'])
-        ent_tz = pytz.timezone(vehicle.enterprise.timezone)
+        ent_tz = get_tzinfo(vehicle.enterprise.timezone)
         start_date = datetime.fromisoformat(request.GET['start'])
         end_date = datetime.fromisoformat(request.GET['end'])
         geojs = request.GET.get('geojson', False)
+        stream = request.GET.get('stream', False)
 
         if request.user.is_superuser or Manager.objects.filter(user=request.user):
-            route_points = RoutePoint.objects.filter(
-                Q(vehicle=vehicle) &
-                Q(datetime__gt=start_date) &
-                Q(datetime__lt=end_date)
-            )
+            # Часть интервала может лежать в архиве, в route_points - только точки из таблицы
+            track = VehicleTrack(vehicle.id, start_date, end_date)
+            route_points = track.route_points
         else:
             print('Error in server logic, should have failed on "check_permissions" stage.')
             self.permission_denied(request, message='Error code: 401', code=401)
 
+        try:
+            tolerance = float(request.GET['tolerance']) if 'tolerance' in request.GET else None
+            zoom = int(request.GET['zoom']) if 'zoom' in request.GET else None
+        except ValueError:
+            raise exceptions.ValidationError(detail='Bad request. Error code: 400', code=400)
+        if track.archived_tracks:
+            return self.get_archived(request, track, vehicle, ent_tz, tolerance, zoom, bool(stream), bool(geojs))
+        if tolerance is not None or zoom is not None:
+            # Упрощённый трек кэшируется списком id оставшихся точек, сам ответ строится как обычно
+            variant = 'tolerance:{0}'.format(tolerance) if tolerance is not None else 'zoom:{0}'.format(zoom)
+            point_ids = track_cache.get_or_set(VEHICLE, vehicle.id, variant, start_date, end_date,
+                                               lambda: simplify_route_points(route_points, tolerance, zoom))
+            route_points = route_points.filter(pk__in=point_ids)
+
+        if request.accepted_renderer.format in (PolylineRenderer.format, BinaryTrackRenderer.format):
+            # Компактные форматы: колонки трека кодирует выбранный рендерер
+            return Response(get_track_columns(route_points, vehicle.enterprise.timezone))
+
+        if stream:
+            # Длинные треки отдаются потоком, без загрузки всех точек в память
+            return StreamingHttpResponse(
+                stream_route_points(route_points, ent_tz, geojson=bool(geojs), chunk_size=self.stream_chunk_size),
+                content_type='application/json'
+            )
+
         if not geojs:
-            serialized_route_points = RoutePointSerializer(instance=route_points, many=True)
+            serialized_route_points = RoutePointSerializer(instance=route_points, many=True,
+                                                           context={'timezone': ent_tz})
         else:
-            serialized_route_points = GeoRoutePointSerializer(instance=route_points, many=True)
+            serialized_route_points = GeoRoutePointSerializer(instance=route_points, many=True,
+                                                              context={'timezone': ent_tz})
 
         return Response(serialized_route_points.data)
 
+    def get_archived(self, request, track, vehicle, ent_tz, tolerance, zoom, stream, geojson):
+        """Тот же ответ для интервала, часть которого в архиве: трек собирается колонками, у точек нет id."""
+        timestamps, lats, lons = track.get_columns(chunk_size=self.stream_chunk_size)
+        if tolerance is not None or zoom is not None:
+            keep = simplify_track(lats, lons, tolerance, zoom)
+            timestamps, lats, lons = timestamps[keep], lats[keep], lons[keep]
+
+        if request.accepted_renderer.format in (PolylineRenderer.format, BinaryTrackRenderer.format):
+            return Response(TrackColumns(lats, lons, timestamps.astype(np.int64), vehicle.enterprise.timezone))
+
+        rows = ((Point(lon, lat, srid=4326), datetime.fromtimestamp(timestamp, dt_timezone.utc))
+                for timestamp, lat, lon in zip(timestamps.tolist(), lats.tolist(), lons.tolist()))
+        if stream:
+            return StreamingHttpResponse(
+                stream_point_rows(rows, ent_tz, geojson=geojson, chunk_size=self.stream_chunk_size),
+                content_type='application/json'
+            )
+
+        route_points = [RoutePoint(vehicle=vehicle, point=point, datetime=point_dt) for point, point_dt in rows]
+        serializer_class = GeoRoutePointSerializer if geojson else RoutePointSerializer
+        return Response(serializer_class(instance=route_points, many=True, context={'timezone': ent_tz}).data)
+
+    def post(self, request):
+        # Пачка точек телеметрии: строки с ошибками отклоняются, остальные сохраняются одной транзакцией
+        try:
+            result = ingest_route_points(request.data, request.user)
+        except IngestError as error:
+            raise exceptions.ValidationError(detail='{0}. Error code: 400'.format(error), code=400)
+        if result['received'] and not result['created']:
+            return Response(result, status=status.HTTP_400_BAD_REQUEST)
+        return Response(result, status=status.HTTP_201_CREATED if result['created'] else status.HTTP_200_OK)
+
+
+async def buffered_route_points(request):
+    """
+    Асинхронный приём точек: пачка проверяется, кладётся в буфер отложенной записи и сразу подтверждается.
+    В базу её пишет фоновый флашер, при переполненном буфере отвечаем 503 с Retry-After.
+    """
+    auth = request.headers.get('Authorization', '').split()
+    if len(auth) != 2 or auth[0].lower() != 'token':
+        return JsonResponse({'detail': 'Error code: 401'}, status=status.HTTP_401_UNAUTHORIZED)
+    principal = await get_token_principal(auth[1])
+    if principal is None:
+        return JsonResponse({'detail': 'Error code: 401'}, status=status.HTTP_401_UNAUTHORIZED)
+
+    if request.method == 'GET':
+        return JsonResponse(ingest_buffer.get_stats())
+    if request.method != 'POST':
+        return JsonResponse({'detail': 'Error code: 405'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    try:
+        if request.content_type == RoutePointCSVParser.media_type:
+            data = RoutePointCSVParser().parse(io.BytesIO(request.body))
+        else:
+            data = json.loads(request.body)
+        columns, total = get_batch_columns(data)
+    except (ValueError, ParseError) as error:
+        return JsonResponse({'detail': '{0}. Error code: 400'.format(error)}, status=status.HTTP_400_BAD_REQUEST)
+
+    _, allowed_vehicle_ids = principal
+    values, _, errors = validate_route_points(columns, allowed_vehicle_ids=allowed_vehicle_ids)
+    try:
+        accepted = ingest_buffer.put(*values)
+    except BufferFull as error:
+        response = JsonResponse({'detail': '{0}. Error code: 503'.format(error)},
+                                status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        response['Retry-After'] = max(int(ingest_buffer.flush_interval), 1)
+        return response
+    return JsonResponse({'received': total, 'accepted': accepted, 'rejected': len(errors), 'errors': errors},
+                        status=status.HTTP_202_ACCEPTED)
+
+
+# csrf_exempt в Django 4.1 превращает корутину в синхронную функцию, поэтому флаг ставится напрямую
+buffered_route_points.csrf_exempt = True
+
 
 class TravelInfoView(APIView):
     permission_classes = (IsManagerPermission,)
@@ -278,21 +402,249 @@ class TravelInfoView(APIView):
                 Q(end__lt=end_date)
             )
 
-        # for travel in travels:
-        vehicles_with_dates = travels.values('vehicle_id').annotate(min_dt=Min('begin'), max_dt=Max('end'))
+        if request.GET.get('addresses'):
+            return Response(self.get_travel_addresses(travels))
 
         route_points = RoutePoint.objects.filter(
-                vehicle_id__in=vehicles_with_dates.values('vehicle_id'),
-                datetime__gt=vehicles_with_dates.values('min_dt'),
-                datetime__lt=vehicles_with_dates.values('max_dt')
-            )
-
-        for route_point in route_points:
-            reversed_route_point = geocoder.geocodefarm(list(reversed(route_point.point.coords)), method='reverse')
+                travel__in=travels
+            ).select_related('vehicle__enterprise').order_by('travel_id', 'datetime')
 
         serialized_route_points = RoutePointSerializer(instance=route_points, many=True)
         return Response(serialized_route_points.data)
 
+    @staticmethod
+    def get_travel_addresses(travels):
+        # Геокодируются только начало и конец поездок из их сводок, точки маршрута не читаются
+        travels = list(travels.select_related('vehicle__enterprise'))
+        summarize_travels([travel for travel in travels if travel.summarized_at is None])
+        coordinates = [(point.y, point.x) for travel in travels for point in (travel.start_point, travel.end_point)
+                       if point is not None]
+        addresses = get_geocoder().reverse_many(coordinates)
+
+        data = []
+        for travel, travel_data in zip(travels, TravelSerializer(instance=travels, many=True).data):
+            travel_data['id'] = travel.id
+            for field in ('start', 'end'):
+                point = getattr(travel, field + '_point')
+                travel_data[field + '_address'] = addresses[(point.y, point.x)] if point is not None else None
+            data.append(travel_data)
+        return data
+
+
+class TravelSummaryView(APIView):
+    """Сводки поездок машины или предприятия постранично, только из Travel, без чтения точек."""
+    permission_classes = (IsManagerPermission,)
+    parser_classes = (JSONParser,)
+    page_size = 20
+
+    def check_permissions(self, request):
+        for permission in self.get_permissions():
+            if not permission.has_permission(request, self):
+                self.permission_denied(request, message='Error code: 401', code=401)
+
+    def get(self, request):
+        travels = Travel.objects.select_related('vehicle__enterprise')
+        try:
+            if 'id' in request.GET:
+                travels = travels.filter(vehicle_id=int(request.GET['id']))
+            if 'enterprise' in request.GET:
+                travels = travels.filter(vehicle__enterprise_id=int(request.GET['enterprise']))
+            if 'start' in request.GET:
+                travels = travels.filter(begin__gte=datetime.fromisoformat(request.GET['start']))
+            if 'end' in request.GET:
+                travels = travels.filter(end__lte=datetime.fromisoformat(request.GET['end']))
+        except ValueError:
+            raise exceptions.ValidationError(detail='Bad request. Error code: 400', code=400)
+        if not request.user.is_superuser:
+            enterprises = Manager.objects.filter(user=request.user)[0].enterprise.all()
+            travels = travels.filter(vehicle__enterprise__in=enterprises)
+        travels = travels.order_by('vehicle_id', 'begin')
+
+        paginator = Paginator(travels, self.page_size)
+        try:
+            page = paginator.page(request.GET.get('page', 1))
+        except PageNotAnInteger:
+            page = paginator.page(1)
+        except EmptyPage:
+            page = paginator.page(paginator.num_pages)
+        return Response({
+            'count': paginator.count,
+            'num_pages': paginator.num_pages,
+            'page': page.number,
+            'results': TravelSummarySerializer(instance=page, many=True).data,
+        })
+
+
+class FleetSnapshotView(APIView):
+    """
+    Текущее положение всех машин предприятий менеджера одним запросом к VehiclePosition.
+    С параметром since отдаются только положения, изменившиеся после него (для частого опроса карты).
+    """
+    permission_classes = (IsManagerPermission,)
+    parser_classes = (JSONParser,)
+
+    def check_permissions(self, request):
+        for permission in self.get_permissions():
+            if not permission.has_permission(request, self):
+                self.permission_denied(request, message='Error code: 401', code=401)
+
+    def get(self, request):
+        snapshot_time = timezone.now()
+        positions = VehiclePosition.objects.all()
+        try:
+            if 'enterprise' in request.GET:
+                positions = positions.filter(vehicle__enterprise_id=int(request.GET['enterprise']))
+            if 'since' in request.GET:
+                positions = positions.filter(updated_at__gt=datetime.fromisoformat(request.GET['since']))
+        except ValueError:
+            raise exceptions.ValidationError(detail='Bad request. Error code: 400', code=400)
+        if not request.user.is_superuser:
+            enterprises = Manager.objects.filter(user=request.user)[0].enterprise.all()
+            positions = positions.filter(vehicle__enterprise__in=enterprises)
+
+        rows = positions.values_list('vehicle_id', 'vehicle__enterprise_id', 'vehicle__number_plate',
+                                     'vehicle__enterprise__timezone', 'point', 'datetime', 'speed_kmh')
+        return Response({
+            'timestamp': snapshot_time.isoformat(),
+            'vehicles': [
+                {
+                    'vehicle': vehicle_id,
+                    'enterprise': enterprise_id,
+                    'number_plate': number_plate,
+                    'lon': point.x,
+                    'lat': point.y,
+                    'datetime': str(point_dt.astimezone(get_tzinfo(timezone_name or settings.TIME_ZONE))),
+                    'speed_kmh': round(speed, 1) if speed is not None else None,
+                }
+                for vehicle_id, enterprise_id, number_plate, timezone_name, point, point_dt, speed in rows
+            ],
+        })
+
+
+class FleetSpatialView(APIView):
+    """
+    Общая часть пространственных запросов по парку: без параметра at берутся текущие положения
+    из индекса в памяти, с ним - положения на этот момент из RoutePoint.
+    """
+    permission_classes = (IsManagerPermission,)
+    parser_classes = (JSONParser,)
+
+    def check_permissions(self, request):
+        for permission in self.get_permissions():
+            if not permission.has_permission(request, self):
+                self.permission_denied(request, message='Error code: 401', code=401)
+
+    def get_enterprise_ids(self, request):
+        enterprise_ids = None
+        if not request.user.is_superuser:
+            manager = Manager.objects.filter(user=request.user)[0]
+            enterprise_ids = set(manager.enterprise.values_list('id', flat=True))
+        if 'enterprise' in request.GET:
+            requested = {int(request.GET['enterprise'])}
+            enterprise_ids = requested if enterprise_ids is None else enterprise_ids & requested
+        return enterprise_ids
+
+    def get_positions(self, request, enterprise_ids, bbox=None):
+        if 'at' in request.GET:
+            return get_positions_at(datetime.fromisoformat(request.GET['at']), enterprise_ids, bbox)
+        return fleet_index.get_positions()
+
+
+class FleetWithinView(FleetSpatialView):
+    """Машины внутри прямоугольника (bbox=min_lon,min_lat,max_lon,max_lat) или многоугольника (polygon, WKT/GeoJSON)."""
+
+    def get(self, request):
+        try:
+            enterprise_ids = self.get_enterprise_ids(request)
+            if 'bbox' in request.GET:
+                bbox = tuple(float(value) for value in request.GET['bbox'].split(','))
+                if len(bbox) != 4:
+                    raise ValueError('bbox needs four numbers')
+                rings = None
+            else:
+                polygon = GEOSGeometry(request.GET['polygon'])
+                if not isinstance(polygon, Polygon):
+                    raise ValueError('polygon is expected')
+                bbox = polygon.extent
+                rings = [ring.coords for ring in polygon]
+            positions = self.get_positions(request, enterprise_ids, bbox)
+        except (KeyError, ValueError, GEOSException):
+            raise exceptions.ValidationError(detail='Bad request. Error code: 400', code=400)
+
+        if rings is None:
+            indices = positions.within_bbox(*bbox, enterprise_ids=enterprise_ids)
+        else:
+            indices = positions.within_polygon(rings, enterprise_ids=enterprise_ids)
+        return Response(positions.to_data(indices, timezones=get_enterprise_timezones()))
+
+
+class FleetNearestView(FleetSpatialView):
+    """k ближайших к точке (lat, lon) машин, по возрастанию расстояния."""
+    max_k = 1000
+
+    def get(self, request):
+        try:
+            enterprise_ids = self.get_enterprise_ids(request)
+            lat, lon = float(request.GET['lat']), float(request.GET['lon'])
+            k = min(int(request.GET.get('k', 10)), self.max_k)
+            positions = self.get_positions(request, enterprise_ids)
+        except (KeyError, ValueError):
+            raise exceptions.ValidationError(detail='Bad request. Error code: 400', code=400)
+
+        indices, distances = positions.nearest(lat, lon, k, enterprise_ids=enterprise_ids)
+        return Response(positions.to_data(indices, distances, timezones=get_enterprise_timezones()))
+
+
+
+class HeatmapTileView(APIView):
+    """
+    Тайл тепловой карты предприятия: сумма суточных тайлов за дни start..end (UTC, по умолчанию последние 7).
+    Отдаются только непустые ячейки сетки bins x bins. ETag меняется только после очередного update_heatmaps.
+    """
+    permission_classes = (IsManagerPermission,)
+    parser_classes = (JSONParser,)
+    default_days = 7
+
+    def check_permissions(self, request):
+        for permission in self.get_permissions():
+            if not permission.has_permission(request, self):
+                self.permission_denied(request, message='Error code: 401', code=401)
+
+    def get(self, request, enterprise_id, zoom, x, y):
+        if not request.user.is_superuser:
+            enterprises = Manager.objects.filter(user=request.user)[0].enterprise.all()
+            if not enterprises.filter(pk=enterprise_id).exists():
+                self.permission_denied(request, message='Error code: 403', code=403)
+        try:
+            end_day = date.fromisoformat(request.GET['end']) if 'end' in request.GET \
+                else timezone.now().astimezone(dt_timezone.utc).date()
+            begin_day = date.fromisoformat(request.GET['start']) if 'start' in request.GET \
+                else end_day - timedelta(days=self.default_days - 1)
+        except ValueError:
+            raise exceptions.ValidationError(detail='Bad request. Error code: 400', code=400)
+
+        etag = '"{0}-{1}-{2}-{3}-{4}-{5}-{6}"'.format(
+            get_heatmap_watermark(), enterprise_id, zoom, x, y, begin_day.isoformat(), end_day.isoformat())
+        headers = {'ETag': etag, 'Cache-Control': 'private, max-age={0}'.format(settings.HEATMAP_TILE_MAX_AGE)}
+        if request.headers.get('If-None-Match') == etag:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        counts, total = get_tile_counts(enterprise_id, zoom, x, y, begin_day, end_day)
+        cells = []
+        if counts is not None:
+            indices = np.flatnonzero(counts)
+            cells = [[index % HEATMAP_BINS, index // HEATMAP_BINS, count]
+                     for index, count in zip(indices.tolist(), counts[indices].tolist())]
+        return Response({
+            'zoom': zoom,
+            'x': x,
+            'y': y,
+            'start': begin_day.isoformat(),
+            'end': end_day.isoformat(),
+            'bins': HEATMAP_BINS,
+            'total': total,
+            'cells': cells,
+        }, headers=headers)
 
 @login_required
 def enterprises(request):
@@ -323,7 +675,7 @@ def enterprises(request):
                 vehicle = get_object_or_404(Vehicle, pk=vehicle_id)
                 context['vehicle'] = vehicle
 
-                travels = Travel.objects.filter(vehicle=vehicle)
+                travels = Travel.objects.filter(vehicle=vehicle).defer('bbox', 'start_point', 'end_point')
                 context['travels'] = travels
 
         if request.POST.get('travel'):
@@ -332,27 +684,36 @@ def enterprises(request):
                 travel = get_object_or_404(Travel, pk=travel_id)
                 context['travel'] = travel
 
-                route_points = RoutePoint.objects.filter(
-                    vehicle=vehicle,
-                    datetime__gt=travel.begin,
-                    datetime__lt=travel.end
-                ).order_by('datetime')
-
-                route_line = []
-                for route_point in route_points:
-                    route_line.append(list(reversed(route_point.point.coords)))
+                route_points = get_travel_points(travel)
 
-                context['route_line'] = route_line
+                zoom = request.POST.get('zoom')
+                if zoom:
+                    context['route_line'] = track_cache.get_or_set(
+                        VEHICLE, vehicle.id, 'travel:{0}:zoom:{1}'.format(travel.id, int(zoom)), travel.begin,
+                        travel.end, lambda: get_route_line(route_points, int(zoom))
+                    )
+                else:
+                    context['route_line'] = get_route_line(route_points)
     return render(request, 'enterprises.html', context=context)
 
 
+def get_route_line(route_points, zoom=None):
+    lats, lons = [], []
+    for point in route_points.values_list('point', flat=True).iterator(chunk_size=2000):
+        lats.append(point.y)
+        lons.append(point.x)
+    keep = simplify_track(lats, lons, zoom=zoom)
+    return [[lat, lon] for lat, lon, kept in zip(lats, lons, keep) if kept]
+
+
 def report(request):
     enterprise_id = int(request.POST.get('enterprise'))
     report_type = int(request.POST.get('report_type'))
     begin = datetime.fromisoformat(request.POST.get('begining'))
     end = datetime.fromisoformat(request.POST.get('ending'))
     rep = TrackReport(report_type=report_type, begin_report_dt=begin, finish_report_dt=end)
-    report_data = rep.generate_full_enterprise_report(enterprise_id)
+    report_data = report_cache.get_or_set(ENTERPRISE, enterprise_id, report_type, begin, end,
+                                          lambda: rep.generate_full_enterprise_report(enterprise_id))
 
     context = {'report_data': report_data}
     return render(request, 'report.html', context=context)
@@ -391,5 +752,72 @@ class ReportInfoView(APIView):
             self.permission_denied(request, message='Error code: 401', code=401)
 
         track_report = TrackReport(report_type=report_type, begin_report_dt=begin, finish_report_dt=end)
-        data = track_report.generate_report(vehicle_id)
+        data = report_cache.get_or_set(VEHICLE, vehicle_id, report_type, begin, end,
+                                       lambda: track_report.generate_report(vehicle_id))
         return Response(json.dumps(data))
+
+
+class ReportCacheStatsView(APIView):
+    permission_classes = (IsManagerPermission,)
+
+    def get(self, request):
+        return Response(report_cache.stats())
+
+
+
+class ReportJobView(APIView):
+    permission_classes = (IsManagerPermission,)
+    parser_classes = (JSONParser, )
+
+    def check_permissions(self, request):
+        for permission in self.get_permissions():
+            if not permission.has_permission(request, self):
+                self.permission_denied(request, message='Error code: 401', code=401)
+
+    def get_job(self, request, job_id):
+        if job_id is None:
+            raise exceptions.ValidationError(detail='Bad request. Error code: 400', code=400)
+        job = get_object_or_404(ReportJob, pk=job_id)
+        if not request.user.is_superuser and job.created_by_id != request.user.id:
+            self.permission_denied(request, message='Error code: 403', code=403)
+        return job
+
+    def check_owner(self, request, scope, owner_id):
+        if request.user.is_superuser:
+            return
+        enterprises = Manager.objects.filter(user=request.user)[0].enterprise.all()
+        if scope == ReportJob.ENTERPRISE:
+            allowed = enterprises.filter(pk=owner_id).exists()
+        else:
+            allowed = Vehicle.objects.filter(pk=owner_id, enterprise__in=enterprises).exists()
+        if not allowed:
+            self.permission_denied(request, message='Error code: 403', code=403)
+
+    def get(self, request):
+        job = refresh_report_job(self.get_job(request, request.GET.get('job')))
+        return Response(ReportJobSerializer(job).data)
+
+    def post(self, request):
+        recieved_data = request.data
+        try:
+            if 'enterprise' in recieved_data:
+                scope, owner_id = ReportJob.ENTERPRISE, int(recieved_data['enterprise'])
+            else:
+                scope, owner_id = ReportJob.VEHICLE, int(recieved_data['id'])
+            report_type = TrackReport.ReportType(int(recieved_data['type'])).value
+            begin = datetime.fromisoformat(recieved_data['begin'])
+            end = datetime.fromisoformat(recieved_data['end'])
+        except (KeyError, TypeError, ValueError):
+            raise exceptions.ValidationError(detail='Bad request. Error code: 400', code=400)
+        self.check_owner(request, scope, owner_id)
+
+        job, created = submit_report_job(scope, owner_id, report_type, begin, end, request.user)
+        return Response(ReportJobSerializer(job).data,
+                        status=status.HTTP_202_ACCEPTED if created else status.HTTP_200_OK)
+
+    def delete(self, request):
+        job = self.get_job(request, request.data.get('job', request.GET.get('job')))
+        if not cancel_report_job(job):
+            raise exceptions.ValidationError(detail='Job is already finished. Error code: 400', code=400)
+        job.refresh_from_db()
+        return Response(ReportJobSerializer(job).data)
@@ -0,0 +1,205 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.db import InterfaceError, OperationalError, close_old_connections
+
+from autopark import settings
+from .geocoding import LRUCache
+from .ingest import build_route_points, store_route_points, get_token_vehicle_ids
+
+logger = logging.getLogger(__name__)
+
+# Обрыв соединения, дедлок или ожидание блокировки проходят сами, такую пачку стоит повторить.
+# Остальные ошибки (нарушение ограничений, неверные данные) повторились бы на каждой попытке
+TRANSIENT_ERRORS = (OperationalError, InterfaceError)
+
+
+class BufferFull(Exception):
+    pass
+
+
+class WriteBehindBuffer:
+    """
+    Буфер отложенной записи точек для ASGI-процесса. Запрос только кладёт проверенные колонки в память
+    и сразу получает ответ, а фоновая задача сбрасывает их в RoutePoint пачками: как только набралось
+    flush_size точек или прошло flush_interval секунд с первой несохранённой.
+    Если база не успевает, буфер заполняется до max_points, и новые пачки отклоняются (BufferFull),
+    пока флашер не разгребёт очередь. Пачка, которую не удалось записать за max_retries повторов
+    или с ошибкой, не связанной с соединением, отбрасывается и учитывается в stats['dropped'].
+    """
+
+    def __init__(self, max_points, flush_size, flush_interval, retry_delay=1.0, max_retry_delay=30.0,
+                 max_retries=5):
+        self.max_points = max_points
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.max_retries = max_retries
+        self.chunks = deque()
+        self.size = 0
+        # Точки пачки, которую сейчас пишет флашер: занимают место в буфере, пока не записаны или не отброшены
+        self.flushing = 0
+        self.oldest = None
+        self.closing = False
+        self.task = None
+        self.wakeup = None
+        self.stats = {'accepted': 0, 'flushed': 0, 'rejected': 0, 'failures': 0, 'dropped': 0}
+
+    def start(self):
+        # Флашер запускается лениво в цикле событий сервера при первом обращении
+        if self.task is None or self.task.done():
+            self.wakeup = asyncio.Event()
+            self.task = asyncio.get_running_loop().create_task(self.run())
+
+    def put(self, vehicle_ids, lons, lats, timestamps):
+        count = len(vehicle_ids)
+        if self.closing:
+            raise BufferFull('Server is shutting down')
+        if self.size + self.flushing + count > self.max_points:
+            self.stats['rejected'] += count
+            raise BufferFull('Ingest buffer is full')
+        if not count:
+            return 0
+        self.start()
+        self.chunks.append((vehicle_ids, lons, lats, timestamps))
+        self.size += count
+        self.stats['accepted'] += count
+        if self.oldest is None:
+            # Флашер мог уснуть без таймаута на пустом буфере: будим его, чтобы он отсчитал flush_interval
+            self.oldest = time.monotonic()
+            self.wakeup.set()
+        if self.size >= self.flush_size:
+            self.wakeup.set()
+        return count
+
+    def take(self):
+        """Забирает из начала очереди не больше flush_size точек, склеивая куски в общие колонки."""
+        taken, count = [], 0
+        while self.chunks and count < self.flush_size:
+            chunk = self.chunks.popleft()
+            room = self.flush_size - count
+            if len(chunk[0]) > room:
+                self.chunks.appendleft(tuple(column[room:] for column in chunk))
+                chunk = tuple(column[:room] for column in chunk)
+            taken.append(chunk)
+            count += len(chunk[0])
+        self.size -= count
+        self.oldest = time.monotonic() if self.chunks else None
+        return tuple(np.concatenate(columns) for columns in zip(*taken))
+
+    async def wait_for_batch(self):
+        while not self.closing and self.size < self.flush_size:
+            timeout = None
+            if self.oldest is not None:
+                timeout = max(self.flush_interval - (time.monotonic() - self.oldest), 0)
+                if timeout == 0:
+                    return
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                return
+
+    async def run(self):
+        while True:
+            await self.wait_for_batch()
+            if not self.size:
+                if self.closing:
+                    return
+                continue
+            batch = self.take()
+            self.flushing = len(batch[0])
+            try:
+                await self.flush(batch)
+            finally:
+                self.flushing = 0
+
+    async def flush(self, batch):
+        """Пишет пачку, при сбоях соединения повторяя с растущей паузой. Возвращает, записана ли она."""
+        count = len(batch[0])
+        delay = self.retry_delay
+        for attempt in range(self.max_retries + 1):
+            try:
+                await sync_to_async(flush_points)(*batch)
+            except TRANSIENT_ERRORS:
+                self.stats['failures'] += 1
+                if attempt == self.max_retries:
+                    logger.exception('Failed to flush %d route points in %d attempts, dropping them',
+                                     count, attempt + 1)
+                    break
+                logger.warning('Failed to flush %d route points, retrying in %.1f s', count, delay, exc_info=True)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_retry_delay)
+            except Exception:
+                self.stats['failures'] += 1
+                logger.exception('Failed to flush %d route points, dropping them', count)
+                break
+            else:
+                self.stats['flushed'] += count
+                return True
+        self.stats['dropped'] += count
+        return False
+
+    async def close(self, timeout=None):
+        """Перестаёт принимать точки и дожидается, пока флашер запишет всё, что осталось в буфере."""
+        self.closing = True
+        if self.task is None:
+            return
+        self.wakeup.set()
+        try:
+            await asyncio.wait_for(asyncio.shield(self.task), timeout)
+        except asyncio.TimeoutError:
+            logger.error('Ingest buffer was not drained in %s s, %d route points lost', timeout,
+                         self.size + self.flushing)
+
+    def get_stats(self):
+        return dict(self.stats, buffered=self.size + self.flushing, capacity=self.max_points)
+
+
+def get_principal(key):
+    close_old_connections()
+    try:
+        return get_token_vehicle_ids(key)
+    finally:
+        close_old_connections()
+
+
+_principals = LRUCache(settings.INGEST_AUTH_CACHE_SIZE)
+
+
+async def get_token_principal(key):
+    """
+    Пользователь и доступные ему машины по токену с кэшем в памяти процесса на INGEST_AUTH_TTL секунд,
+    чтобы приём точек не ходил в базу на каждый запрос. Кэшируются только известные токены: перебор
+    случайных ключей не вытесняет из кэша рабочие токены и не растит его.
+    """
+    now = time.monotonic()
+    cached = _principals.get(key)
+    if cached is not None and cached[0] > now:
+        return cached[1]
+    principal = await sync_to_async(get_principal)(key)
+    if principal is not None:
+        _principals.set(key, (now + settings.INGEST_AUTH_TTL, principal))
+    return principal
+
+
+def flush_points(vehicle_ids, lons, lats, timestamps):
+    # Выполняется в потоке sync_to_async, соединение с базой держит только флашер
+    close_old_connections()
+    try:
+        return store_route_points(build_route_points(vehicle_ids, lons, lats, timestamps))
+    finally:
+        close_old_connections()
+
+
+ingest_buffer = WriteBehindBuffer(
+    max_points=settings.INGEST_BUFFER_POINTS,
+    flush_size=settings.INGEST_FLUSH_SIZE,
+    flush_interval=settings.INGEST_FLUSH_INTERVAL,
+    max_retries=settings.INGEST_FLUSH_RETRIES,
+)